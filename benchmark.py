@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from unittest.mock import patch
+import project
+from project import app, download_video, convert, cut_audio_batch, mashup, mashup_ffmpeg, create_zip
+
+START = project.SEGMENT_START_SECONDS
+
+def make_source(path, seconds, frequency, noise=False):
+    # Synthetic stand-in for a downloaded track: a tone, or pink noise for variety
+    source = f'anoisesrc=color=pink:duration={seconds}' if noise else f'sine=frequency={frequency}:duration={seconds}'
+    codec = ['-c:a', 'libopus', '-b:a', '128k'] if path.endswith('.webm') else ['-c:a', 'aac', '-b:a', '128k']
+    subprocess.run(['ffmpeg', '-v', 'quiet', '-y', '-f', 'lavfi', '-i', source] + codec + [path], check=True)
+
+def make_sources(fixture_dir, count, duration):
+    """Generate ``count`` source tracks alternating between webm/opus and m4a/aac."""
+    os.makedirs(fixture_dir, exist_ok=True)
+    sources = []
+    for i in range(count):
+        path = os.path.join(fixture_dir, f"source{i:02d}.{'webm' if i % 2 == 0 else 'm4a'}")
+        if not os.path.exists(path):
+            make_source(path, START + duration + 5, 220 + 55 * i, noise=(i % 3 == 2))
+        sources.append(path)
+    return sources
+
+class FakeYoutubeDL:
+    """Offline yt_dlp.YoutubeDL: search returns the fixtures, downloads copy them after ``latency`` seconds."""
+    sources = []
+    latency = 0.0
+
+    def __init__(self, params=None):
+        self.params = dict(params or {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def extract_info(self, query, download=False, process=True):
+        if query.startswith('ytsearch'):
+            return {'entries': [
+                {'id': f'bench{i:02d}', 'title': f'Bench Track {i}', 'uploader': 'Bench Singer - Topic',
+                 'view_count': 1000 - i, 'url': f'bench://{i}'}
+                for i in range(len(self.sources))]}
+        return {} # no direct media URL, so range mode falls back to download()
+
+    def download(self, urls):
+        time.sleep(self.latency)
+        index = int(urls[0].split('://')[1])
+        source = self.sources[index]
+        template = self.params['outtmpl']['default']
+        shutil.copyfile(source, template % {'title': f'Bench Track {index}', 'ext': source.rsplit('.', 1)[1]})
+
+def cpu_seconds():
+    """CPU time of this process and its children, or None where there's no rusage (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ffmpeg does the heavy lifting in child processes, so count those too
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def measure(action):
+    wall_start, cpu_start = time.perf_counter(), cpu_seconds()
+    result = action()
+    cpu_end = cpu_seconds()
+    return result, {"wall_seconds": round(time.perf_counter() - wall_start, 3),
+                    "cpu_seconds": None if cpu_start is None else round(cpu_end - cpu_start, 3)}
+
+def record(results, benchmark, tracks, concurrency, stats, ok=True):
+    entry = {"benchmark": benchmark, "tracks": tracks, "concurrency": concurrency, "ok": bool(ok), **stats}
+    results.append(entry)
+    cpu = 'n/a' if stats['cpu_seconds'] is None else f"{stats['cpu_seconds']:.3f}s"
+    print(f"{benchmark:<16} tracks={tracks:<3} concurrency={concurrency:<3} "
+          f"wall={stats['wall_seconds']:.3f}s cpu={cpu}{'' if ok else '  FAILED'}",
+          file=sys.stderr)
+
+def bench_stages(results, sources, tracks, concurrency, duration):
+    """Time each pipeline stage on its own against the fixtures."""
+    work_dir = tempfile.mkdtemp()
+    try:
+        app.config['MASHUP_DOWNLOAD_CONCURRENCY'] = concurrency
+        app.config['MASHUP_CUT_WORKERS'] = concurrency
+        project.reset_extractor_pools()
+
+        count, stats = measure(lambda: download_video("Bench Singer", tracks, work_dir, retry_delay=0))
+        record(results, "download_video", tracks, concurrency, stats, count == tracks)
+        # Taken before the later stages write their cuts and outputs into work_dir
+        downloads = project.list_sources(work_dir)
+
+        cuts, stats = measure(lambda: convert(work_dir, duration))
+        record(results, "convert", tracks, concurrency, stats, len(cuts) == tracks)
+
+        merged = os.path.join(work_dir, "moviepy.mp3")
+        output, stats = measure(lambda: mashup(cuts, merged))
+        record(results, "mashup", tracks, concurrency, stats, output)
+
+        single_pass = os.path.join(work_dir, "ffmpeg.mp3")
+        output, stats = measure(lambda: mashup_ffmpeg(downloads, single_pass, duration))
+        record(results, "mashup_ffmpeg", tracks, concurrency, stats, output and len(downloads) == tracks)
+
+        ok, stats = measure(lambda: create_zip(merged, os.path.join(work_dir, "merged_audio.zip")))
+        record(results, "create_zip", tracks, concurrency, stats, ok)
+    finally:
+        shutil.rmtree(work_dir)
+
+def bench_route(results, tracks, concurrency, duration):
+    """Time ``concurrency`` simultaneous POSTs to /generate_mashup."""
+    app.config['MASHUP_DOWNLOAD_CONCURRENCY'] = 4
+    app.config['MASHUP_CUT_WORKERS'] = 0
+    project.reset_extractor_pools()
+    data = {'singer': 'Bench Singer', 'number_of_videos': str(tracks), 'duration': str(duration),
+            'email': 'bench@example.com'}
+    statuses = []
+
+    def post():
+        with app.test_client() as client:
+            statuses.append(client.post('/generate_mashup', data=data).status_code)
+
+    def run_clients():
+        threads = [threading.Thread(target=post) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    _, stats = measure(run_clients)
+    stats["requests_per_second"] = round(concurrency / stats["wall_seconds"], 3) if stats["wall_seconds"] else None
+    record(results, "generate_mashup", tracks, concurrency, stats, statuses == [200] * concurrency)
+
+def bench_batch(results, tracks, concurrency, duration):
+    """Time one POST /batches carrying ``concurrency`` items until every item is done."""
+    app.config['MASHUP_DOWNLOAD_CONCURRENCY'] = 4
+    app.config['MASHUP_CUT_WORKERS'] = 0
+    project.reset_extractor_pools()
+    # Two singers, so the batch shares a search but still has distinct builds
+    items = [{'singer': f'Bench Singer {i % 2}', 'number_of_videos': tracks, 'duration': duration,
+              'email': f'bench{i}@example.com'} for i in range(concurrency)]
+
+    def run_batch():
+        with app.test_client() as client:
+            status_url = client.post('/batches', json={'items': items}).get_json()['status_url']
+            while True:
+                batch = client.get(status_url).get_json()
+                if batch['status'] == 'done':
+                    return batch
+                time.sleep(0.02)
+
+    batch, stats = measure(run_batch)
+    stats["requests_per_second"] = round(concurrency / stats["wall_seconds"], 3) if stats["wall_seconds"] else None
+    record(results, "batch", tracks, concurrency, stats, all(item['status'] == 'done' for item in batch['items']))
+
+def bench_merge(tracks, duration, start=START):
+    """Time the cut-then-MoviePy merge against the single-pass ffmpeg engine and stream copy."""
+    work_dir = tempfile.mkdtemp()
+    try:
+        sources = [(path, start) for path in make_sources(work_dir, tracks, duration)]
+
+        def moviepy_path():
+            jobs = [(path, f"{path}.cut.mp3", offset) for path, offset in sources]
+            cut = [output for _, output, error in cut_audio_batch(jobs, duration) if not error]
+            return mashup(cut, os.path.join(work_dir, "moviepy.mp3"))
+
+        def ffmpeg_path():
+            return mashup_ffmpeg(sources, os.path.join(work_dir, "ffmpeg.mp3"), duration)
+
+        def copy_path():
+            # The fixtures alternate webm/opus and m4a/aac, so half of them are transcoded
+            return project.copy_mashup(sources, os.path.join(work_dir, "copy"), duration)
+
+        results = {"tracks": tracks, "duration": duration}
+        for name, action in (("moviepy", moviepy_path), ("ffmpeg", ffmpeg_path), ("copy", copy_path)):
+            output, stats = measure(action)
+            stats["ok"] = bool(output)
+            results[name] = stats
+        return results
+    finally:
+        shutil.rmtree(work_dir)
+
+IMPORT_PROBE = """
+import sys, time
+started = time.perf_counter()
+import project
+imported = time.perf_counter()
+with project.app.test_client() as client:
+    client.get('/health')
+print(imported - started, time.perf_counter() - started,
+      int(any(name in sys.modules for name in ('yt_dlp', 'moviepy'))))
+"""
+
+def bench_import(runs):
+    """Cold-start cost: import project and answer /health in a fresh interpreter, ``runs`` times."""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', IMPORT_PROBE], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        samples.append(output.stdout.split())
+    import_times = sorted(float(sample[0]) for sample in samples)
+    first_request = sorted(float(sample[1]) for sample in samples)
+    return {"runs": runs,
+            "import_seconds_median": round(import_times[len(import_times) // 2], 4),
+            "first_response_seconds_median": round(first_request[len(first_request) // 2], 4),
+            "media_stack_imported": any(sample[2] == '1' for sample in samples)}
+
+def run_suite(track_counts, concurrency_levels, duration, latency):
+    fixture_dir = tempfile.mkdtemp(prefix='mashup-bench-')
+    results = []
+    # Measure the work itself: no caches, no network, no real mail
+    app.config.update(MASHUP_CACHE_DIR='', MASHUP_RESULT_CACHE_DIR='', MASHUP_SEARCH_CACHE_TTL=0,
+                      MASHUP_MAIL_QUEUE=False, MASHUP_FETCH_MODE='full', MASHUP_DELIVERY='attachment',
+                      MASHUP_RATE_LIMIT=0) # every benchmark request comes from the same address
+    project.reset_admission_controller()
+    try:
+        FakeYoutubeDL.sources = make_sources(fixture_dir, max(track_counts), duration)
+        FakeYoutubeDL.latency = latency
+        with patch('project.yt_dlp.YoutubeDL', FakeYoutubeDL), patch('project.mail.send'):
+            for tracks in track_counts:
+                for concurrency in concurrency_levels:
+                    bench_stages(results, FakeYoutubeDL.sources, tracks, concurrency, duration)
+                    bench_route(results, tracks, concurrency, duration)
+                    bench_batch(results, tracks, concurrency, duration)
+    finally:
+        project.reset_extractor_pools()
+        shutil.rmtree(fixture_dir)
+    return results
+
+def compare(results, baseline, tolerance):
+    """Return descriptions of benchmarks whose wall time grew by more than ``tolerance``."""
+    previous = {(r["benchmark"], r["tracks"], r["concurrency"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        before = previous.get((result["benchmark"], result["tracks"], result["concurrency"]))
+        if before and before["wall_seconds"] and result["wall_seconds"] > before["wall_seconds"] * (1 + tolerance):
+            regressions.append(f"{result['benchmark']} tracks={result['tracks']} concurrency={result['concurrency']}: "
+                               f"{before['wall_seconds']:.3f}s -> {result['wall_seconds']:.3f}s")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the mashup pipeline.")
+    parser.add_argument('--tracks', type=int, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--duration', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.5, help="Simulated download latency per track (seconds)")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    parser.add_argument('--compare', help="Baseline JSON from an earlier run to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown before flagging a regression")
+    parser.add_argument('--merge-only', action='store_true', help="Only compare the MoviePy, ffmpeg and stream-copy merge paths")
+    parser.add_argument('--import-time', type=int, metavar='RUNS',
+                        help="Only measure cold-start import time over RUNS fresh interpreters")
+    args = parser.parse_args()
+
+    report = {"meta": {"python": platform.python_version(), "platform": platform.platform(),
+                       "cores": project.available_cores(), "duration": args.duration, "latency": args.latency,
+                       "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S')}}
+    if args.import_time:
+        report["import"] = bench_import(args.import_time)
+    elif args.merge_only:
+        report["merge"] = [bench_merge(tracks, args.duration) for tracks in args.tracks]
+    else:
+        report["results"] = run_suite(args.tracks, args.concurrency, args.duration, args.latency)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+    if args.compare and "results" in report:
+        with open(args.compare) as f:
+            regressions = compare(report["results"], json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,84 @@
 import os
-import yt_dlp
+import re
+import argparse
+import signal
+import socket
+import sqlite3
+import multiprocessing
+import json
+import itertools
+import uuid
+import shutil
+import hashlib
+import queue
+import atexit
+import collections
+import threading
+import subprocess
+import sys
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, Future
+import importlib
 import time
-from moviepy.audio.io.AudioFileClip import AudioFileClip
-from moviepy.audio.AudioClip import concatenate_audioclips
 import zipfile
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, request, render_template, jsonify, Response, stream_with_context, url_for, send_file
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from flask_mail import Mail, Message
-import ffmpeg
 import tempfile
 from dotenv import load_dotenv
 from flask_cors import CORS
 
+class _LazyModule:
+    """Stands in for a module and imports it on first attribute access."""
+
+    def __init__(self, name):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_module', None)
+
+    def _load(self):
+        module = object.__getattribute__(self, '_module')
+        if module is None:
+            module = importlib.import_module(object.__getattribute__(self, '_name'))
+            object.__setattr__(self, '_module', module)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __delattr__(self, attr):
+        delattr(self._load(), attr)
+
+# The media stack is only imported once a pipeline needs it, so serving the
+# form and health checks (and serverless cold starts) don't pay for it.
+yt_dlp = _LazyModule('yt_dlp')
+ffmpeg = _LazyModule('ffmpeg')
+np = _LazyModule('numpy')
+
+def _moviepy():
+    from moviepy.audio.io.AudioFileClip import AudioFileClip
+    from moviepy.audio.AudioClip import concatenate_audioclips
+    return AudioFileClip, concatenate_audioclips
+
+def AudioFileClip(*args, **kwargs):
+    return _moviepy()[0](*args, **kwargs)
+
+def concatenate_audioclips(clips):
+    return _moviepy()[1](clips)
+
+def media_stack_loaded():
+    return all(name in sys.modules for name in ('yt_dlp', 'ffmpeg'))
+
+def warm_media_stack():
+    """Import the media modules now instead of on the first pipeline run."""
+    yt_dlp._load()
+    ffmpeg._load()
+    if app.config['MASHUP_MERGE_ENGINE'] == 'moviepy':
+        _moviepy()
+
 load_dotenv()
 
 app = Flask(__name__)
@@ -34,6 +102,98 @@ app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
 mail = Mail(app)
 
+# Signs download links; link delivery is disabled without it
+app.secret_key = os.getenv('SECRET_KEY')
+
+# Per-stage metrics on /metrics, plus an optional JSON-lines trace file per request
+app.config['MASHUP_METRICS'] = os.getenv('MASHUP_METRICS', '0') == '1'
+app.config['MASHUP_TRACE_LOG'] = os.getenv('MASHUP_TRACE_LOG')
+
+# Opt-in: queue outgoing mail for background workers holding pooled SMTP connections. Off by
+# default, since serverless deployments (Vercel) don't keep threads alive after the response.
+app.config['MASHUP_MAIL_QUEUE'] = os.getenv('MASHUP_MAIL_QUEUE', '0') == '1'
+# Seconds a stopping process waits for queued mail to go out
+app.config['MASHUP_MAIL_FLUSH_TIMEOUT'] = float(os.getenv('MASHUP_MAIL_FLUSH_TIMEOUT', '30'))
+app.config['MASHUP_MAIL_CONNECTIONS'] = int(os.getenv('MASHUP_MAIL_CONNECTIONS', '2'))
+app.config['MASHUP_MAIL_BATCH_SIZE'] = int(os.getenv('MASHUP_MAIL_BATCH_SIZE', '10'))
+app.config['MASHUP_MAIL_MAX_ATTEMPTS'] = int(os.getenv('MASHUP_MAIL_MAX_ATTEMPTS', '5'))
+app.config['MASHUP_MAIL_BACKOFF'] = float(os.getenv('MASHUP_MAIL_BACKOFF', '2'))
+
+# Job mode: size of the worker pool and how many jobs may be queued or running
+app.config['MASHUP_JOB_WORKERS'] = int(os.getenv('MASHUP_JOB_WORKERS', '2'))
+app.config['MASHUP_JOB_QUEUE_LIMIT'] = int(os.getenv('MASHUP_JOB_QUEUE_LIMIT', '20'))
+# Most items one POST /batches may carry, and how many jobs may be active before batches are refused
+app.config['MASHUP_BATCH_MAX_ITEMS'] = int(os.getenv('MASHUP_BATCH_MAX_ITEMS', '50'))
+app.config['MASHUP_BATCH_QUEUE_LIMIT'] = int(os.getenv('MASHUP_BATCH_QUEUE_LIMIT', '200'))
+# Admission control: global budgets every pipeline's estimated cost must fit in (0 = no limit)
+app.config['MASHUP_ADMISSION'] = os.getenv('MASHUP_ADMISSION', '1') == '1'
+app.config['MASHUP_MAX_PIPELINES'] = int(os.getenv('MASHUP_MAX_PIPELINES', '4'))
+app.config['MASHUP_SCRATCH_MAX_BYTES'] = int(os.getenv('MASHUP_SCRATCH_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+app.config['MASHUP_CPU_SLOTS'] = int(os.getenv('MASHUP_CPU_SLOTS', '0')) # 0 = four per available core
+# Seconds a request may wait for capacity, and how many may wait, before getting a 429
+app.config['MASHUP_ADMISSION_WAIT'] = float(os.getenv('MASHUP_ADMISSION_WAIT', '30'))
+app.config['MASHUP_ADMISSION_QUEUE'] = int(os.getenv('MASHUP_ADMISSION_QUEUE', '20'))
+# Mashups each email address may request per MASHUP_RATE_WINDOW seconds (0 = no limit)
+app.config['MASHUP_RATE_LIMIT'] = int(os.getenv('MASHUP_RATE_LIMIT', '10'))
+app.config['MASHUP_RATE_WINDOW'] = int(os.getenv('MASHUP_RATE_WINDOW', '3600'))
+app.config['MASHUP_JOB_RETENTION'] = int(os.getenv('MASHUP_JOB_RETENTION', '3600'))
+# Durable jobs: a SQLite file shared by the web and `project.py worker` processes on one host (empty
+# runs jobs on this process's thread pool). Keep it on a local disk; WAL locking doesn't work over
+# NFS or SMB. Workers hold a lease on each job that must be renewed every MASHUP_JOB_LEASE seconds,
+# and a job is given up on after MASHUP_JOB_MAX_ATTEMPTS claims.
+app.config['MASHUP_JOB_STORE'] = os.getenv('MASHUP_JOB_STORE', '')
+app.config['MASHUP_JOB_LEASE'] = float(os.getenv('MASHUP_JOB_LEASE', '60'))
+app.config['MASHUP_JOB_MAX_ATTEMPTS'] = int(os.getenv('MASHUP_JOB_MAX_ATTEMPTS', '3'))
+app.config['MASHUP_JOB_POLL'] = float(os.getenv('MASHUP_JOB_POLL', '1'))
+# Stored jobs keep their downloads here between attempts, so a retried job doesn't download again
+app.config['MASHUP_JOB_WORK_DIR'] = os.getenv('MASHUP_JOB_WORK_DIR', os.path.join(tempfile.gettempdir(), 'mashup-jobs'))
+
+# Downloads: parallel tracks per request and warm yt-dlp instances kept per pool
+app.config['MASHUP_DOWNLOAD_CONCURRENCY'] = int(os.getenv('MASHUP_DOWNLOAD_CONCURRENCY', '4'))
+app.config['MASHUP_EXTRACTOR_POOL_SIZE'] = int(os.getenv('MASHUP_EXTRACTOR_POOL_SIZE', '4'))
+# 'range' fetches only the sampled window of each track, 'full' downloads whole streams
+app.config['MASHUP_FETCH_MODE'] = os.getenv('MASHUP_FETCH_MODE', 'range')
+# Source audio cache shared across requests (empty dir disables it)
+app.config['MASHUP_CACHE_DIR'] = os.getenv('MASHUP_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'mashup-audio-cache'))
+app.config['MASHUP_CACHE_MAX_BYTES'] = int(os.getenv('MASHUP_CACHE_MAX_BYTES', str(1024 * 1024 * 1024)))
+# Finished mashups reused for identical requests (empty dir disables it), for up to
+# MASHUP_RESULT_CACHE_TTL seconds after they were built so new uploads get picked up (0 never expires)
+app.config['MASHUP_RESULT_CACHE_DIR'] = os.getenv('MASHUP_RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'mashup-result-cache'))
+app.config['MASHUP_RESULT_CACHE_MAX_BYTES'] = int(os.getenv('MASHUP_RESULT_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+app.config['MASHUP_RESULT_CACHE_TTL'] = int(os.getenv('MASHUP_RESULT_CACHE_TTL', '3600'))
+# Seconds a singer's search results are reused (0 disables the search cache)
+app.config['MASHUP_SEARCH_CACHE_TTL'] = int(os.getenv('MASHUP_SEARCH_CACHE_TTL', '900'))
+# 'ffmpeg' cuts and merges in one filter graph; 'numpy' decodes each segment into memory to
+# loudness-match and crossfade it; 'moviepy' (also the fallback) cuts then merges
+app.config['MASHUP_MERGE_ENGINE'] = os.getenv('MASHUP_MERGE_ENGINE', 'ffmpeg')
+app.config['MASHUP_CROSSFADE'] = float(os.getenv('MASHUP_CROSSFADE', '0'))
+# RMS level the numpy engine matches every segment to
+app.config['MASHUP_MIX_TARGET_DBFS'] = float(os.getenv('MASHUP_MIX_TARGET_DBFS', '-18'))
+# 'copy' cuts and joins the sources without re-encoding when their codecs allow it; 'transcode' always encodes
+app.config['MASHUP_CUT_MODE'] = os.getenv('MASHUP_CUT_MODE', 'transcode')
+# Preferred output encoding (see OUTPUT_PROFILES); attachments step down from it to fit the limit
+app.config['MASHUP_OUTPUT_PROFILE'] = os.getenv('MASHUP_OUTPUT_PROFILE', 'mp3-v4')
+# Largest zip that is emailed as an attachment (Gmail's limit is 25MB, this leaves headroom)
+app.config['MASHUP_ATTACHMENT_LIMIT'] = int(os.getenv('MASHUP_ATTACHMENT_LIMIT', str(24 * 1024 * 1024)))
+# Delivery: 'attachment' emails the zip, 'link' emails an expiring download link,
+# 'auto' attaches when the zip fits the email limit and links otherwise
+app.config['MASHUP_DELIVERY'] = os.getenv('MASHUP_DELIVERY', 'auto')
+app.config['MASHUP_RETENTION_DIR'] = os.getenv('MASHUP_RETENTION_DIR', os.path.join(tempfile.gettempdir(), 'mashup-downloads'))
+app.config['MASHUP_LINK_TTL'] = int(os.getenv('MASHUP_LINK_TTL', str(24 * 3600)))
+app.config['MASHUP_PUBLIC_URL'] = os.getenv('MASHUP_PUBLIC_URL')
+# Parallel ffmpeg cuts per request (0 = one per available core)
+app.config['MASHUP_CUT_WORKERS'] = int(os.getenv('MASHUP_CUT_WORKERS', '0'))
+# 'overlap' cuts and encodes tracks while the rest are still downloading; 'staged' runs
+# each stage to completion first. The MoviePy engine, and ffmpeg crossfades, always run staged.
+app.config['MASHUP_PIPELINE'] = os.getenv('MASHUP_PIPELINE', 'overlap')
+# Tracks allowed to wait between two overlapped stages (0 = twice the cut workers)
+app.config['MASHUP_PIPELINE_QUEUE'] = int(os.getenv('MASHUP_PIPELINE_QUEUE', '0'))
+# 'lazy' imports the media stack on first use, 'background' warms it in a thread at startup
+app.config['MASHUP_MEDIA_IMPORTS'] = os.getenv('MASHUP_MEDIA_IMPORTS', 'lazy')
+
+if app.config['MASHUP_MEDIA_IMPORTS'] == 'background':
+    threading.Thread(target=warm_media_stack, name='media-warmup', daemon=True).start()
+
 def valid_input(singer, number_of_videos, duration, email):
     if not singer or not number_of_videos or not email:
         return False, "Please provide singer name, number of videos, and email.", None
@@ -56,19 +216,171 @@ def valid_input(singer, number_of_videos, duration, email):
         print(f"Error: {e}")
         return None
 
-def download_video(singer, number_of_videos, download_path, max_retries=3, retry_delay=5):
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': os.path.join(download_path, '%(title)s.%(ext)s'),
-        'noplaylist': True,
-        'quiet': True,
-    }
+# --- Metrics ---
+# Per-stage timings and byte counters, exposed on /metrics in the Prometheus text
+# format and optionally appended per request to MASHUP_TRACE_LOG. Everything here
+# returns straight away when MASHUP_METRICS is off.
 
-def download_video(singer, number_of_videos, download_path, max_retries=3, retry_delay=5):
-    # 1. Fetch Metadata (Search for more candidates to find the best ones)
-    search_limit = max(50, number_of_videos * 5) # Search for more to allow filtering
-    ydl_opts_meta = {
-        'extract_flat': True, # Don't download, just get metadata
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms keyed by metric name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def inc(self, name, amount=1, help_text='', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ('counter', help_text))
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, help_text='', buckets=STAGE_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ('histogram', help_text))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in sorted(self._help.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == 'counter':
+                    for (metric, labels), value in sorted(self._counters.items()):
+                        if metric == name:
+                            lines.append(f"{name}{_format_labels(labels)} {value}")
+                    continue
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+metrics = MetricsRegistry()
+_current_trace = contextvars.ContextVar('mashup_trace', default=None)
+# Keeps concurrent trace lines from interleaving, without holding up metrics
+_trace_log_lock = threading.Lock()
+
+def metrics_enabled():
+    return app.config['MASHUP_METRICS']
+
+def new_trace(**fields):
+    """Create a per-request trace; set it on _current_trace for stage timers and byte counters to report into."""
+    if not metrics_enabled():
+        return None
+    return {"id": uuid.uuid4().hex, "started_at": time.time(), "stages": {},
+            "bytes_downloaded": 0, "bytes_written": 0, "ffmpeg_cpu_seconds": 0.0, **fields}
+
+def _trace_add(field, amount, stage=None):
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    with metrics._lock:
+        if stage:
+            trace["stages"][stage] = trace["stages"].get(stage, 0.0) + amount
+        else:
+            trace[field] += amount
+
+@contextmanager
+def stage_timer(stage):
+    if not metrics_enabled():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe('mashup_stage_seconds', elapsed, 'Time spent in each pipeline stage.', stage=stage)
+        _trace_add('stages', elapsed, stage=stage)
+
+def count_bytes(kind, amount):
+    """Count bytes 'downloaded' from the network or 'written' as pipeline output."""
+    if not metrics_enabled() or not amount:
+        return
+    metrics.inc(f'mashup_bytes_{kind}_total', amount, f'Bytes {kind} by the pipeline.')
+    _trace_add(f'bytes_{kind}', amount)
+
+def finish_trace(trace, status_code):
+    if trace is None:
+        return
+    elapsed = time.time() - trace["started_at"]
+    outcome = 'success' if status_code == 200 else 'error'
+    metrics.observe('mashup_request_seconds', elapsed, 'End-to-end pipeline time per request.', outcome=outcome)
+    metrics.inc('mashup_requests_total', 1, 'Pipeline runs by outcome.', outcome=outcome)
+    trace_log = app.config['MASHUP_TRACE_LOG']
+    if trace_log:
+        # Snapshot the trace under the lock pool threads update it with, then write without it
+        with metrics._lock:
+            line = json.dumps(dict(trace, status_code=status_code, total_seconds=round(elapsed, 3)))
+        with _trace_log_lock, open(trace_log, 'a') as f:
+            f.write(line + "\n")
+
+def in_current_context(fn):
+    """Wrap fn so pool threads report into the calling request's trace."""
+    if not metrics_enabled():
+        return fn
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(fn, *args)
+
+def _run_ffmpeg(node):
+    if not (metrics_enabled() and hasattr(os, 'wait4')):
+        return node.run(quiet=True)
+    # Reap the process ourselves so its CPU time can be attributed to this request
+    process = subprocess.Popen(node.compile(), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE)
+    _reap_ffmpeg(process)
+
+def _reap_ffmpeg(process):
+    """Wait for an ffmpeg process started with stderr=PIPE, raising ffmpeg.Error if it failed."""
+    stderr = process.stderr.read()
+    process.stderr.close()
+    if metrics_enabled() and hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        cpu_seconds = usage.ru_utime + usage.ru_stime
+        metrics.inc('mashup_ffmpeg_cpu_seconds_total', cpu_seconds, 'CPU time used by ffmpeg processes.')
+        _trace_add('ffmpeg_cpu_seconds', cpu_seconds)
+    else:
+        process.wait()
+    if process.returncode != 0:
+        raise ffmpeg.Error('ffmpeg', None, stderr)
+
+def _discard(path):
+    # A failed encode can leave a partial file; remove it so nothing mistakes it for a result
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# Tracks are sampled from this offset; range-fetched files are named with
+# SEGMENT_MARKER so convert() knows they already start there.
+SEGMENT_START_SECONDS = 20
+SEGMENT_MARKER = '.segment.'
+
+def _ydl_base_options():
+    return {
         'quiet': True,
         'noplaylist': True,
         # Enable Node.js (found on system) to fix missing JS runtime warning
@@ -79,18 +391,612 @@ def download_video(singer, number_of_videos, download_path, max_retries=3, retry
         # Check for cookies.txt in current directory
         'cookiefile': 'cookies.txt' if os.path.exists('cookies.txt') else None,
     }
-    
+
+class ExtractorPool:
+    """Keeps warm yt_dlp.YoutubeDL instances so requests don't pay for building new ones.
+
+    Each instance is handed to one caller at a time; up to ``size`` idle instances
+    are kept for reuse. ``factory`` builds a new extractor from the options and
+    defaults to an entered ``yt_dlp.YoutubeDL``.
+    """
+
+    def __init__(self, options, size=4, factory=None):
+        self.options = options
+        self.size = size
+        self.factory = factory
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _create(self):
+        if self.factory:
+            return self.factory(dict(self.options))
+        return yt_dlp.YoutubeDL(dict(self.options)).__enter__()
+
+    @contextmanager
+    def acquire(self):
+        with self._lock:
+            ydl = self._idle.pop() if self._idle else None
+        if ydl is None:
+            ydl = self._create()
+        try:
+            yield ydl
+        finally:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(ydl)
+                    ydl = None
+            if ydl is not None:
+                _close_extractor(ydl)
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for ydl in idle:
+            _close_extractor(ydl)
+
+def _close_extractor(ydl):
+    try:
+        ydl.__exit__(None, None, None)
+    except Exception as e:
+        print(f"Error closing extractor: {e}")
+
+_extractor_pools = {}
+_extractor_pools_lock = threading.Lock()
+
+def get_extractor_pool(role):
+    """Return the shared pool for 'search' (flat metadata) or 'download' extractors."""
+    with _extractor_pools_lock:
+        pool = _extractor_pools.get(role)
+        if pool is None:
+            options = _ydl_base_options()
+            if role == 'search':
+                options['extract_flat'] = True # Don't download, just get metadata
+            else:
+                options['format'] = 'bestaudio/best'
+            pool = _extractor_pools[role] = ExtractorPool(options, size=app.config['MASHUP_EXTRACTOR_POOL_SIZE'])
+        return pool
+
+def reset_extractor_pools():
+    with _extractor_pools_lock:
+        pools = list(_extractor_pools.values())
+        _extractor_pools.clear()
+    for pool in pools:
+        pool.clear()
+
+def _set_output_template(ydl, template):
+    # Pooled extractors are shared across requests, so point each download at its own directory
+    outtmpl = ydl.params.get('outtmpl')
+    if isinstance(outtmpl, dict):
+        outtmpl['default'] = template
+    else:
+        ydl.params['outtmpl'] = {'default': template}
+
+def _with_retries(action, description, max_retries, retry_delay):
+    attempts = max(1, max_retries)
+    for attempt in range(1, attempts + 1):
+        try:
+            return action()
+        except Exception as e:
+            print(f"{description} failed (attempt {attempt}/{attempts}): {e}")
+            if attempt == attempts:
+                raise
+            time.sleep(retry_delay)
+
+def fetch_segment(media_url, output_path, start_time_seconds, duration_seconds, headers=None):
+    """Pull only the [start, start + duration] window of a remote stream.
+
+    ffmpeg seeks with HTTP Range requests and copies the packets without
+    re-encoding, so only the bytes around the window are transferred.
+    """
+    input_kwargs = {'ss': start_time_seconds, 't': duration_seconds}
+    if headers:
+        input_kwargs['headers'] = ''.join(f"{key}: {value}\r\n" for key, value in headers.items())
+    try:
+        _run_ffmpeg(
+            ffmpeg
+            .input(media_url, **input_kwargs)
+            # The seek lands on the cluster (WebM) or keyframe before the start, and stream copy keeps
+            # those early packets with negative timestamps; seeking the output to 0 drops them
+            .output(output_path, c='copy', ss=0)
+            .overwrite_output()
+        )
+        return os.path.exists(output_path) and os.path.getsize(output_path) > 0
+    except Exception as e:
+        print(f"Error fetching segment from {media_url}: {e}")
+        return False
+
+def _download_segment(ydl, url, output_stem, segment):
+    # Resolve the direct media URL; streams we can't seek into (HLS/DASH
+    # fragments, merged formats) return False so the caller downloads in full.
+    info = ydl.extract_info(url, download=False)
+    media_url = info.get('url')
+    if not media_url or info.get('protocol', 'https') not in ('http', 'https'):
+        return False
+    output_path = f"{output_stem}{SEGMENT_MARKER}{info.get('ext') or 'webm'}"
+    start_time_seconds, duration_seconds = segment
+    if fetch_segment(media_url, output_path, start_time_seconds, duration_seconds, info.get('http_headers')):
+        return True
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    return False
+
+class AudioCache:
+    """Content-addressed on-disk cache of downloaded source audio.
+
+    Entries are keyed by video id and format (full stream or a sampled
+    window), written atomically and evicted least-recently-used once the
+    cache grows past ``max_bytes``. Readers get a hard link (or copy) of
+    the cached file, so an eviction never pulls a file from under a request.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        # key -> [path, size, mtime] for every entry, and their total size
+        self._index = {}
+        self._bytes = 0
+        self._index_mtime = None
+        # Files are staged in a subdirectory, so writing them doesn't move the root's mtime
+        self._staging = os.path.join(root, '.staging')
+        os.makedirs(self._staging, exist_ok=True)
+
+    def _key(self, video_id, fmt):
+        return hashlib.sha256(f"{video_id}:{fmt}".encode()).hexdigest()
+
+    def _refresh(self):
+        # Caller holds _lock. The directory's mtime moves whenever an entry is added or removed, by
+        # this process or another sharing the cache, so it is only listed again after that happened
+        mtime = os.stat(self.root).st_mtime_ns
+        if mtime == self._index_mtime:
+            return
+        index = {}
+        for name in os.listdir(self.root):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            index[name.split('.', 1)[0]] = [path, stat.st_size, stat.st_mtime]
+        self._index = index
+        self._bytes = sum(size for _, size, _ in index.values())
+        # A change within the same clock tick as this listing wouldn't move the mtime again
+        self._index_mtime = mtime if time.time_ns() - mtime > 1_000_000_000 else None
+
+    def _changed(self):
+        # Caller holds _lock, and has just made the same change to the directory and the index
+        self._index_mtime = os.stat(self.root).st_mtime_ns
+
+    def _remove(self, key):
+        # Caller holds _lock; returns False if someone else removed the file first
+        path, size, _ = self._index.pop(key)
+        self._bytes -= size
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _entry(self, key):
+        # Caller holds _lock
+        try:
+            self._refresh()
+        except FileNotFoundError:
+            return None
+        return self._index.get(key)
+
+    def _find(self, key):
+        with self._lock:
+            entry = self._entry(key)
+            return entry[0] if entry else None
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def _touch(self, path):
+        # Mark the entry recently used for LRU eviction; returns its new mtime
+        now = time.time()
+        os.utime(path, (now, now))
+        return now
+
+    def get(self, video_id, fmt, dest_stem):
+        """Place the cached file at dest_stem + its extension and return that path, or None on a miss."""
+        key = self._key(video_id, fmt)
+        cached = self._find(key)
+        if cached:
+            dest = dest_stem + os.path.splitext(cached)[1]
+            try:
+                _link_or_copy(cached, dest)
+                mtime = self._touch(cached)
+                with self._lock:
+                    entry = self._index.get(key)
+                    if entry and entry[0] == cached:
+                        entry[2] = mtime
+                    self.counters["hits"] += 1
+                return dest
+            except FileNotFoundError:
+                pass # evicted between lookup and link
+        self._count("misses")
+        return None
+
+    def put(self, video_id, fmt, src_path):
+        key = self._key(video_id, fmt)
+        final_path = os.path.join(self.root, key + os.path.splitext(src_path)[1])
+        tmp_path = os.path.join(self._staging, f"{key}.{uuid.uuid4().hex}.tmp")
+        try:
+            _link_or_copy(src_path, tmp_path)
+            with self._lock:
+                self._refresh()
+                os.replace(tmp_path, final_path)
+                stat = os.stat(final_path)
+                if key in self._index:
+                    if self._index[key][0] == final_path:
+                        self._bytes -= self._index.pop(key)[1]
+                    else:
+                        self._remove(key)
+                self._index[key] = [final_path, stat.st_size, stat.st_mtime]
+                self._bytes += stat.st_size
+                self._evict(keep=final_path)
+                self._changed()
+        except Exception as e:
+            print(f"Error caching {src_path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def evict(self, keep=None):
+        with self._lock:
+            self._refresh()
+            self._evict(keep)
+            self._changed()
+
+    def _evict(self, keep):
+        # Caller holds _lock; the oldest entries go first, without touching the disk until they do
+        if self._bytes <= self.max_bytes:
+            return
+        for key, (path, _, _) in sorted(self._index.items(), key=lambda item: item[1][2]):
+            if self._bytes <= self.max_bytes:
+                break
+            if path != keep and self._remove(key):
+                self.counters["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+def _link_or_copy(src, dest):
+    try:
+        os.link(src, dest)
+    except OSError as e:
+        if isinstance(e, FileNotFoundError):
+            raise
+        shutil.copyfile(src, dest)
+
+class ResultCache(AudioCache):
+    """AudioCache for finished mashups that also coalesces identical builds.
+
+    While one request builds a mashup, identical requests wait for it and
+    are then served from the cache instead of starting their own build.
+    Entries expire ``ttl`` seconds after they were built (0 keeps them until
+    evicted), and eviction takes the oldest builds first.
+    """
+
+    def __init__(self, root, max_bytes, ttl=0):
+        super().__init__(root, max_bytes)
+        self.ttl = ttl
+        self.counters["coalesced"] = 0
+        self.counters["expired"] = 0
+        self._building = {}
+
+    def _find(self, key):
+        with self._lock:
+            entry = self._entry(key)
+            if entry and self.ttl and time.time() - entry[2] > self.ttl:
+                if self._remove(key):
+                    self.counters["expired"] += 1
+                self._changed()
+                return None
+            return entry[0] if entry else None
+
+    def _touch(self, path):
+        # Leave mtime at the build time the TTL counts from
+        mtime = os.stat(path).st_mtime
+        os.utime(path, (time.time(), mtime))
+        return mtime
+
+    def get_or_build(self, key, fmt, dest_stem, build):
+        """Return a cached result at dest_stem, or call build() for (path, complete).
+
+        Only complete builds are cached. Requests that waited on one that came
+        up short (say, a track failed to download) get a copy of its result,
+        and those that waited on a failed build get None; only requests that
+        arrive afterwards build it again.
+        """
+        while True:
+            path = self.get(key, fmt, dest_stem)
+            if path:
+                return path
+            with self._lock:
+                flight = self._building.get((key, fmt))
+                leader = flight is None
+                if leader:
+                    flight = self._building[(key, fmt)] = {"done": threading.Event(), "waiters": 0,
+                                                           "cached": False, "path": None}
+                else:
+                    flight["waiters"] += 1
+                    self.counters["coalesced"] += 1
+            if leader:
+                return self._lead(key, fmt, flight, build)
+            flight["done"].wait()
+            if flight["cached"]:
+                # The next pass serves it from the cache (or builds again if it was evicted meanwhile)
+                continue
+            return self._follow(flight, dest_stem)
+
+    def _lead(self, key, fmt, flight, build):
+        path = complete = None
+        try:
+            path, complete = build()
+            if path and complete:
+                self.put(key, fmt, path)
+            return path
+        finally:
+            with self._lock:
+                del self._building[(key, fmt)]
+                waiters = flight["waiters"]
+            flight["cached"] = bool(path and complete)
+            if path and not complete and waiters:
+                # Set aside for the waiters, because the leader's own file goes with its work dir
+                shared = os.path.join(self._staging, f"{uuid.uuid4().hex}.partial{os.path.splitext(path)[1]}")
+                try:
+                    _link_or_copy(path, shared)
+                    flight["path"] = shared
+                except OSError as e:
+                    print(f"Error sharing {path}: {e}")
+            flight["done"].set()
+
+    def _follow(self, flight, dest_stem):
+        shared = flight["path"]
+        if shared is None:
+            return None
+        dest = dest_stem + os.path.splitext(shared)[1]
+        try:
+            _link_or_copy(shared, dest)
+        finally:
+            with self._lock:
+                flight["waiters"] -= 1
+                last = flight["waiters"] == 0
+            if last:
+                os.remove(shared)
+        return dest
+
+_audio_cache = None
+_audio_cache_lock = threading.Lock()
+
+def get_audio_cache():
+    """Return the shared audio cache, or None when MASHUP_CACHE_DIR is empty."""
+    global _audio_cache
+    with _audio_cache_lock:
+        root = app.config['MASHUP_CACHE_DIR']
+        if not root:
+            return None
+        if _audio_cache is None or _audio_cache.root != root:
+            _audio_cache = AudioCache(root, app.config['MASHUP_CACHE_MAX_BYTES'])
+        return _audio_cache
+
+_result_cache = None
+
+def get_result_cache():
+    """Return the shared mashup result cache, or None when MASHUP_RESULT_CACHE_DIR is empty."""
+    global _result_cache
+    with _audio_cache_lock:
+        root = app.config['MASHUP_RESULT_CACHE_DIR']
+        if not root:
+            return None
+        if _result_cache is None or _result_cache.root != root:
+            _result_cache = ResultCache(root, app.config['MASHUP_RESULT_CACHE_MAX_BYTES'],
+                                        app.config['MASHUP_RESULT_CACHE_TTL'])
+        return _result_cache
+
+def _cache_format(segment):
+    if segment:
+        return "bestaudio:{}:{}".format(*segment)
+    return "bestaudio"
+
+# Bracketed suffixes and filler words that make re-uploads of one song look different
+_TITLE_NOISE = re.compile(r"\(.*?\)|\[.*?\]|\b(official|video|audio|lyrics?|lyrical|full|song|hd|4k|music)\b|[^\w\s]")
+
+def normalize_title(title):
+    return ' '.join(_TITLE_NOISE.sub(' ', title.lower()).split())
+
+class IncrementalRanker:
+    """Ranks search results as they arrive and tells when the top ``count`` has settled.
+
+    Entries whose uploader matches the singer, or whose title names the singer
+    on a VEVO/Topic/official channel, are candidates; they're ranked by views
+    and only the most viewed upload of each title is kept. When no entry
+    matches, every entry is ranked the same way as a fallback.
+    """
+
+    def __init__(self, singer, count, page_size=10):
+        self.singer = singer.lower()
+        self.count = count
+        self.page_size = page_size
+        self.seen = []
+        self.matched = {} # normalized title -> best entry
+        self.others = {}
+
+    def is_match(self, entry):
+        # Criteria: Singer name in uploader (e.g. "Arijit Singh", "Arijit Singh Official")
+        # OR Singer name in title AND uploader has "VEVO" or "Topic"
+        uploader = (entry.get('uploader') or '').lower()
+        title = (entry.get('title') or '').lower()
+        if self.singer in uploader:
+            return True
+        return self.singer in title and ('vevo' in uploader or 'topic' in uploader or 'official' in uploader)
+
+    def add(self, entry):
+        self.seen.append(entry)
+        bucket = self.matched if self.is_match(entry) else self.others
+        key = normalize_title(entry.get('title') or '') or entry.get('id') or entry.get('url')
+        current = bucket.get(key)
+        # yt-dlp flat extraction sometimes lacks view_count; treat missing as 0
+        if current is None or (entry.get('view_count') or 0) > (current.get('view_count') or 0):
+            bucket[key] = entry
+
+    def top(self):
+        candidates = list((self.matched or self.others).values())
+        candidates.sort(key=lambda x: x.get('view_count') or 0, reverse=True)
+        return candidates[:self.count]
+
+    def _top_keys(self):
+        return [id(entry) for entry in self.top()] if self.matched else None
+
+    def consume(self, entries):
+        """Pull entries a page at a time until the top ``count`` stops changing."""
+        iterator = iter(entries)
+        while True:
+            before = self._top_keys()
+            page = list(itertools.islice(iterator, self.page_size))
+            for entry in page:
+                self.add(entry)
+            if len(page) < self.page_size:
+                return # search exhausted
+            # Settled: enough artist matches, and a whole page didn't move the top N
+            if len(self.matched) >= self.count and before == self._top_keys():
+                return
+
+def normalize_singer(singer):
+    return ' '.join(singer.lower().split())
+
+class SearchCache:
+    """Caches flat ytsearch entries per normalized singer for ``ttl`` seconds.
+
+    Concurrent lookups for the same singer share one in-flight search
+    (single flight) instead of each going to YouTube. Each result records how
+    many tracks it was searched for, and also serves requests for fewer.
+    """
+
+    def __init__(self, ttl, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0}
+        self._entries = {} # key -> (expires_at, count, entries)
+        self._inflight = {} # key -> (count, Future)
+        self._lock = threading.Lock()
+
+    def lookup(self, singer, count, loader):
+        """Return the entries searched for ``count`` tracks by singer, calling loader() on a miss."""
+        key = normalize_singer(singer)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached and cached[0] > time.monotonic() and cached[1] >= count:
+                self.counters["hits"] += 1
+                return cached[2]
+            flight = self._inflight.get(key)
+            if flight and flight[0] >= count:
+                self.counters["coalesced"] += 1
+                future, leader = flight[1], False
+            else:
+                self.counters["misses"] += 1
+                future, leader = Future(), True
+                self._inflight[key] = (count, future)
+
+        if not leader:
+            return future.result()
+
+        try:
+            entries = loader()
+        except Exception as e:
+            # Failures are shared with waiting callers but never cached
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._inflight.pop(key, None)
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                # Drop the entry closest to expiry to stay within bounds
+                del self._entries[min(self._entries, key=lambda k: self._entries[k][0])]
+            self._entries[key] = (time.monotonic() + self.ttl, count, entries)
+        future.set_result(entries)
+        return entries
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+_search_cache = None
+_search_cache_lock = threading.Lock()
+
+def get_search_cache():
+    """Return the shared search cache, or None when MASHUP_SEARCH_CACHE_TTL is 0."""
+    global _search_cache
+    ttl = app.config['MASHUP_SEARCH_CACHE_TTL']
+    if ttl <= 0:
+        return None
+    with _search_cache_lock:
+        if _search_cache is None or _search_cache.ttl != ttl:
+            _search_cache = SearchCache(ttl)
+        return _search_cache
+
+def _rank_files(download_path, rank):
+    prefix = f"{rank:02d}_"
+    return [os.path.join(download_path, name) for name in os.listdir(download_path)
+            if name.startswith(prefix) and not name.endswith(('.part', '.ytdl'))]
+
+def _cache_download(cache, video_id, download_path, rank, segment):
+    for path in _rank_files(download_path, rank)[:1]:
+        # A full download that fell back from range mode is cached as a full stream
+        cache.put(video_id, _cache_format(segment if SEGMENT_MARKER in path else None), path)
+
+def download_video(singer, number_of_videos, download_path, max_retries=3, retry_delay=5,
+                   concurrency=None, search_pool=None, download_pool=None, segment=None, cache=None,
+                   search_cache=None, on_track=None):
+    """Search for the singer's top tracks and download them into download_path.
+
+    With ``segment=(start, duration)`` only that window of each track is
+    fetched, falling back to a full download when the stream can't be seeked.
+    Tracks already in the audio cache are linked in instead of downloaded.
+    ``on_track(rank, file_path)`` is called from the download threads as soon
+    as each track is on disk, with file_path None for a track that failed.
+    Returns the number of tracks downloaded.
+    """
+    cache = cache or get_audio_cache()
+    search_cache = search_cache or get_search_cache()
+    search_pool = search_pool or get_extractor_pool('search')
+    download_pool = download_pool or get_extractor_pool('download')
+    concurrency = concurrency or app.config['MASHUP_DOWNLOAD_CONCURRENCY']
+
+    # 1. Fetch Metadata (Search for more candidates to find the best ones)
+    # The search is paged lazily and stops as soon as the ranking settles, so
+    # search_limit is only the most we'll ever look at.
+    search_limit = max(50, number_of_videos * 5) # Search for more to allow filtering
     search_query = f"ytsearch{search_limit}:{singer}"
     entries = []
-    
+
+    def load_entries():
+        with search_pool.acquire() as ydl:
+            # process=False keeps 'entries' a lazy generator over YouTube's result pages
+            result = ydl.extract_info(search_query, download=False, process=False)
+            if 'entries' not in result:
+                return [result]
+            ranker = IncrementalRanker(singer, number_of_videos)
+            ranker.consume(result['entries'] or [])
+            return ranker.seen
+
     print(f"Searching for top videos by {singer}...")
     try:
-        with yt_dlp.YoutubeDL(ydl_opts_meta) as ydl:
-            result = ydl.extract_info(search_query, download=False)
-            if 'entries' in result:
-                entries = result['entries']
+        with stage_timer('search'):
+            if search_cache:
+                entries = search_cache.lookup(
+                    singer, number_of_videos,
+                    lambda: _with_retries(load_entries, "Search", max_retries, retry_delay))
             else:
-                entries = [result]
+                entries = _with_retries(load_entries, "Search", max_retries, retry_delay)
     except Exception as e:
         print(f"Error fetching metadata: {e}")
         return 0
@@ -98,109 +1004,249 @@ def download_video(singer, number_of_videos, download_path, max_retries=3, retry
     if not entries:
         return 0
 
-    # 2. Filter for "Original Artist" (Basic Fuzzy Matching)
-    # We prioritize videos where the uploader name is similar to the singer name
-    # or contains "topic", "vevo", "official". 
-    # Since strict strict matching is hard, we filter for presence of singer name in uploader OR title
-    # But to satisfy "Original Artist channel", we look at the 'uploader'.
-    
-    filtered_entries = []
-    singer_lower = singer.lower()
-    
+    # 2-4. Rank: original-artist channels first, most played, duplicates dropped
+    ranker = IncrementalRanker(singer, number_of_videos)
     for entry in entries:
-        uploader = entry.get('uploader', '').lower()
-        title = entry.get('title', '').lower()
-        
-        # Criteria: Singer name in uploader (e.g. "Arijit Singh", "Arijit Singh Official")
-        # OR Singer name in title AND uploader has "VEVO" or "Topic"
-        if singer_lower in uploader:
-             filtered_entries.append(entry)
-        elif singer_lower in title and ('vevo' in uploader or 'topic' in uploader or 'official' in uploader):
-             filtered_entries.append(entry)
-             
-    # Fallback: If strict filtering removes everything, use original entries but warn
-    if not filtered_entries:
+        ranker.add(entry)
+    if not ranker.matched:
         print("Warning: Could not strictly verify original artist channels. Using best matches.")
-        filtered_entries = entries
-
-    # 3. Sort by Views (Most Played)
-    # yt-dlp flat extraction sometimes doesn't get view_count depending on backend, 
-    # strictly speaking 'view_count' might be None or missing. 
-    # We treat missing as 0.
-    filtered_entries.sort(key=lambda x: x.get('view_count') or 0, reverse=True)
-    
-    # 4. Select Top N
-    selected_entries = filtered_entries[:number_of_videos]
-    
-    # 5. Download Selected Videos
+    selected_entries = ranker.top()
+
+    # 5. Download Selected Videos (bounded concurrency, each track retried on its own)
     print(f"Selected {len(selected_entries)} videos:")
     for v in selected_entries:
         print(f"- {v.get('title')} (Views: {v.get('view_count')}, Uploader: {v.get('uploader')})")
 
-    download_count = 0
-    ydl_opts_download = {
-        'format': 'bestaudio/best',
-        'outtmpl': os.path.join(download_path, '%(title)s.%(ext)s'),
-        'noplaylist': True,
-        'quiet': True,
-        'js_runtimes': {
-            'node': {'path': 'C:/Program Files/nodejs/node.exe'},
-            'deno': {}
-        },
-        'cookiefile': 'cookies.txt' if os.path.exists('cookies.txt') else None,
-    }
-    
-    with yt_dlp.YoutubeDL(ydl_opts_download) as ydl:
-        for entry in selected_entries:
-            try:
-                # Use weburl or id
-                url = entry.get('url') or entry.get('webpage_url')
+    def track_done(rank, ok):
+        if on_track:
+            paths = _rank_files(download_path, rank)[:1] if ok else []
+            on_track(rank, paths[0] if paths else None)
+        return ok
+
+    def download_one(ranked_entry):
+        rank, entry = ranked_entry
+        # Use weburl or id
+        url = entry.get('url') or entry.get('webpage_url')
+        # The rank prefix lets convert() restore view-count order
+        output_template = os.path.join(download_path, f'{rank:02d}_%(title)s.%(ext)s')
+        segment_stem = os.path.join(download_path, f"{rank:02d}_{entry.get('id') or 'track'}")
+        video_id = entry.get('id')
+        fmt = _cache_format(segment)
+        if cache and video_id:
+            cache_stem = segment_stem + SEGMENT_MARKER.rstrip('.') if segment else segment_stem
+            if cache.get(video_id, fmt, cache_stem):
+                return track_done(rank, True)
+
+        def attempt():
+            with download_pool.acquire() as ydl:
+                if segment:
+                    try:
+                        if _download_segment(ydl, url, segment_stem, segment):
+                            return
+                    except Exception as e:
+                        print(f"Range fetch unavailable for {entry.get('title')}, downloading in full: {e}")
+                _set_output_template(ydl, output_template)
                 ydl.download([url])
-                download_count += 1
-            except Exception as e:
-                print(f"Failed to download {entry.get('title')}: {e}")
+
+        try:
+            _with_retries(attempt, f"Download of {entry.get('title')}", max_retries, retry_delay)
+            if metrics_enabled():
+                count_bytes('downloaded', sum(os.path.getsize(path) for path in _rank_files(download_path, rank)))
+            if cache and video_id:
+                _cache_download(cache, video_id, download_path, rank, segment)
+            return track_done(rank, True)
+        except Exception as e:
+            print(f"Failed to download {entry.get('title')}: {e}")
+            return track_done(rank, False)
+
+    if not selected_entries:
+        return 0
+    with stage_timer('download'), ThreadPoolExecutor(max_workers=min(concurrency, len(selected_entries)),
+                                                     thread_name_prefix='mashup-download') as executor:
+        download_count = sum(executor.map(in_current_context(download_one), enumerate(selected_entries, 1)))
 
     return download_count
 
-def convert(download_path, duration, start_time_seconds=20):
-    audio_file_paths = []
+# --- Output Profiles ---
+# The output codec and bitrate are planned before any work starts, from the
+# total audio length and the delivery size limit, so an accepted request can't
+# be thrown away at the end for being too big to send.
+
+class OutputProfile:
+    """One way to encode the finished mashup."""
+
+    def __init__(self, name, codec, ext, muxer, max_kbps, sample_rate=44100, fallback=None, **options):
+        self.name = name
+        # Profile to transcode with when this one can't be used (stream copy only)
+        self.fallback = fallback
+        self.codec = codec
+        self.ext = ext
+        self.muxer = muxer
+        self.sample_rate = sample_rate # only MoviePy needs telling; ffmpeg resamples on its own
+        # Upper bound on the average bitrate, used to budget sizes (VBR averages run lower)
+        self.max_kbps = max_kbps
+        self.options = options
+
+    def output_args(self):
+        """Keyword arguments for ffmpeg's .output()."""
+        return dict(format=self.muxer, acodec=self.codec, **self.options)
+
+    def estimate_bytes(self, seconds):
+        # ~2% for container framing and the zip entry
+        return int(seconds * self.max_kbps * 1000 / 8 * 1.02)
+
+    def describe(self, seconds):
+        return {"name": self.name, "codec": self.codec, "format": self.ext, "max_kbps": self.max_kbps,
+                "estimated_bytes": self.estimate_bytes(seconds)}
+
+# Best first; the planner walks down from MASHUP_OUTPUT_PROFILE until one fits
+OUTPUT_PROFILES = [
+    OutputProfile('mp3-v0', 'libmp3lame', 'mp3', 'mp3', 260, q=0),
+    OutputProfile('mp3-v2', 'libmp3lame', 'mp3', 'mp3', 220, q=2),
+    OutputProfile('mp3-v4', 'libmp3lame', 'mp3', 'mp3', 195, q=4),
+    OutputProfile('mp3-cbr-128', 'libmp3lame', 'mp3', 'mp3', 128, audio_bitrate='128k'),
+    OutputProfile('aac-96', 'aac', 'm4a', 'ipod', 100, audio_bitrate='96k'),
+    OutputProfile('opus-64', 'libopus', 'opus', 'opus', 68, sample_rate=48000, audio_bitrate='64k'),
+    OutputProfile('opus-48', 'libopus', 'opus', 'opus', 52, sample_rate=48000, audio_bitrate='48k'),
+    OutputProfile('opus-32', 'libopus', 'opus', 'opus', 36, sample_rate=48000, audio_bitrate='32k'),
+]
+PROFILES_BY_NAME = {profile.name: profile for profile in OUTPUT_PROFILES}
+DEFAULT_PROFILE = PROFILES_BY_NAME['mp3-v4']
+
+def plan_output(num_videos, dur, limit_bytes=None, preferred=None):
+    """Pick the best profile, starting at ``preferred``, whose estimated size fits limit_bytes.
+
+    With no limit the preferred profile is used as-is. Returns None if even
+    the smallest profile would be too big.
+    """
+    preferred = PROFILES_BY_NAME.get(preferred or app.config['MASHUP_OUTPUT_PROFILE'], DEFAULT_PROFILE)
+    seconds = num_videos * dur
+    for profile in OUTPUT_PROFILES[OUTPUT_PROFILES.index(preferred):]:
+        if not limit_bytes or profile.estimate_bytes(seconds) <= limit_bytes:
+            return profile
+    return None
+
+# Stream-copied output keeps the source bitrate; YouTube audio streams top out around 160 kbit/s
+STREAM_COPY_MAX_KBPS = 170
+
+def stream_copy_allowed():
+    # Copying can't crossfade or loudness-match, so the engines that do those always transcode
+    return (app.config['MASHUP_CUT_MODE'] == 'copy' and not app.config['MASHUP_CROSSFADE']
+            and app.config['MASHUP_MERGE_ENGINE'] != 'numpy')
+
+def plan_delivery(num_videos, dur):
+    """Decide up front how a mashup is delivered and encoded: ('attachment' | 'link', profile or None)."""
+    delivery = app.config['MASHUP_DELIVERY']
+    limit = app.config['MASHUP_ATTACHMENT_LIMIT']
+    links = link_delivery_available()
+    if delivery == 'link' and links:
+        delivery, profile, limit = 'link', plan_output(num_videos, dur), None
+    else:
+        delivery, profile = 'attachment', plan_output(num_videos, dur, limit)
+        preferred = plan_output(num_videos, dur)
+        if app.config['MASHUP_DELIVERY'] == 'auto' and links and profile is not preferred:
+            # Rather than lower the quality to fit an attachment, send a link
+            delivery, profile, limit = 'link', preferred, None
+    if profile and stream_copy_allowed():
+        # Sources that can't be copied are encoded at the planned profile's bitrate (VBR ones
+        # have none, so they get what the copy's size estimate allows)
+        bitrate = profile.options.get('audio_bitrate') or f'{min(profile.max_kbps, STREAM_COPY_MAX_KBPS)}k'
+        copy = OutputProfile('copy', 'copy', None, None, STREAM_COPY_MAX_KBPS, fallback=profile,
+                             audio_bitrate=bitrate)
+        if not limit or copy.estimate_bytes(num_videos * dur) <= limit:
+            return delivery, copy
+    return delivery, profile
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def cut_audio_batch(jobs, duration, workers=None):
+    """Cut many files at once, one ffmpeg process per worker.
+
+    ``jobs`` is a list of (input_path, output_path, start_time_seconds). Returns
+    a list of (input_path, output_path, error) in the same order, with error None
+    for files that were cut successfully; a failed file never stops the others.
+    """
+    workers = workers or app.config['MASHUP_CUT_WORKERS'] or available_cores()
+
+    def cut_one(job):
+        input_path, output_path, start_time_seconds = job
+        try:
+            if cut_audio(input_path, output_path, start_time_seconds, duration):
+                return input_path, output_path, None
+            return input_path, output_path, "ffmpeg could not cut this file"
+        except Exception as e:
+            return input_path, output_path, str(e)
+
+    if not jobs:
+        return []
+    # Each cut is an ffmpeg subprocess, so threads are enough to keep every core busy
+    with ThreadPoolExecutor(max_workers=min(workers, len(jobs)), thread_name_prefix='mashup-cut') as executor:
+        return list(executor.map(in_current_context(cut_one), jobs))
+
+def _source_start(file_name, start_time_seconds):
+    # Range-fetched files already begin at the requested offset
+    return 0 if SEGMENT_MARKER in file_name else start_time_seconds
+
+# download_video names every track "NN_<title>.<ext>" after its view-count rank
+RANKED_DOWNLOAD = re.compile(r'\d{2}_')
+
+def is_download(file_name):
+    """True for a finished track download_video wrote, as opposed to the cuts and outputs beside it."""
+    return bool(RANKED_DOWNLOAD.match(file_name)) and not file_name.endswith(('.part', '.ytdl', '.pcm'))
+
+def list_sources(download_path, start_time_seconds=SEGMENT_START_SECONDS):
+    """Return (file_path, start_time_seconds) for each downloaded track, in ranking order."""
+    # download_video prefixes each file with its view-count rank, so sorting the
+    # names keeps the mashup in ranking order however the downloads finished.
+    # Cuts, PCM segments and merged output share the directory, as do partial
+    # downloads left behind by failed tracks; none of them are sources.
+    sources = []
+    for file_name in sorted(os.listdir(download_path)):
+        file_path = os.path.join(download_path, file_name)
+        if is_download(file_name) and os.path.isfile(file_path):
+            sources.append((file_path, _source_start(file_name, start_time_seconds)))
+    return sources
+
+def convert(download_path, duration, start_time_seconds=SEGMENT_START_SECONDS):
     # Since we download audio directly, we might not need heavy conversion,
     # but we still need to cut it to the specific duration.
     # yt-dlp usually downloads webm or m4a for audio best.
-    
-    for file_name in os.listdir(download_path):
-        file_path = os.path.join(download_path, file_name)
-        # Process any audio/video file that moviepy/ffmpeg can handle
-        if os.path.isfile(file_path):
-            # We will process all files in the temp dir as candidates
-            try:
-                # We need to cut the audio. 
-                # Optimization: Use ffmpeg directly to cut without full re-encoding if possible, 
-                # but for consistency with previous logic (and to ensure valid mp3 output for merging),
-                # we'll use a reliable cut function.
-                output_cut_path = os.path.join(download_path, f"cut_{file_name}.mp3")
-                if cut_audio(file_path, output_cut_path, start_time_seconds, duration):
-                     audio_file_paths.append(output_cut_path)
-            except Exception as e:
-                print(f"Error processing {file_name}: {e}")
-                
+    jobs = []
+    for file_path, start in list_sources(download_path, start_time_seconds):
+        output_cut_path = os.path.join(download_path, f"cut_{os.path.basename(file_path)}.mp3")
+        jobs.append((file_path, output_cut_path, start))
+
+    audio_file_paths = []
+    for input_path, output_path, error in cut_audio_batch(jobs, duration):
+        if error:
+            print(f"Error processing {os.path.basename(input_path)}: {error}")
+        else:
+            audio_file_paths.append(output_path)
+
     return audio_file_paths
 
-def cut_audio(input_file_path, output_file_path, start_time_seconds, duration_seconds):
+def cut_audio(input_file_path, output_file_path, start_time_seconds, duration_seconds, profile=None):
     try:
-        (
+        _run_ffmpeg(
             ffmpeg
             .input(input_file_path, ss=start_time_seconds, t=duration_seconds)
-            .output(output_file_path, format='mp3', acodec='libmp3lame', q=4) # q=4 is good quality
+            .output(output_file_path, **(profile or DEFAULT_PROFILE).output_args())
             .overwrite_output()
-            .run(quiet=True)
         )
         return True
     except Exception as e:
         print(f"Error cutting audio with ffmpeg for {input_file_path}: {e}")
         return False
 
-def mashup(audio_file_paths, output_path):
+def mashup(audio_file_paths, output_path, backend='moviepy', profile=None):
+    if backend == 'numpy':
+        # Loudness-matched and crossfaded, one file in memory at a time
+        return mashup_numpy([(file_path, 0) for file_path in audio_file_paths], output_path,
+                            crossfade=app.config['MASHUP_CROSSFADE'], profile=profile)
     if not audio_file_paths:
         print("No audio files to merge")
         return None
@@ -218,7 +1264,15 @@ def mashup(audio_file_paths, output_path):
             return None
             
         final_audio = concatenate_audioclips(audio_clips)
-        final_audio.write_audiofile(output_path, logger=None)
+        if profile:
+            options = profile.output_args()
+            bitrate = options.pop('audio_bitrate', None)
+            extra = [arg for key, value in options.items() if key not in ('format', 'acodec')
+                     for arg in (f'-{key}', str(value))]
+            final_audio.write_audiofile(output_path, fps=profile.sample_rate, codec=profile.codec, bitrate=bitrate,
+                                        ffmpeg_params=extra or None, logger=None)
+        else:
+            final_audio.write_audiofile(output_path, logger=None)
         
         for clip in audio_clips:
             clip.close()
@@ -229,90 +1283,1000 @@ def mashup(audio_file_paths, output_path):
         print(f"Error creating audio mashup: {e}")
         return None
 
-def create_zip(file_path, zip_name):
-    try:
-        with zipfile.ZipFile(zip_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            zipf.write(file_path, os.path.basename(file_path))
-        return True
-    except Exception as e:
-        print(f"Error creating ZIP file: {e}")
-        return False
+def mashup_ffmpeg(sources, output_path, duration, crossfade=0, profile=None):
+    """Cut and join every source in one ffmpeg run, encoding the output exactly once.
 
-def send_email(email, zip_path):
+    ``sources`` is a list of (file_path, start_time_seconds). Each input is
+    seeked to its window, resampled to a common format and joined with the
+    concat filter, or with acrossfade when ``crossfade`` seconds is set.
+    Returns output_path, or None so the caller can fall back to MoviePy.
+    """
+    if not sources:
+        print("No audio files to merge")
+        return None
     try:
-        if not os.path.exists(zip_path):
-            return False, "File not found"
-        msg = Message(subject='Your Mashup Audio', recipients=[email])
-        msg.body = 'Attached is the zip file containing your mashup audio.'
-        with open(zip_path, 'rb') as f:
-            msg.attach('merged_audio.zip', 'application/zip', f.read())
-        mail.send(msg)
-        return True, None
+        streams = [
+            ffmpeg.input(file_path, ss=start, t=duration).audio
+            .filter('aresample', 44100)
+            .filter('aformat', sample_fmts='fltp', channel_layouts='stereo')
+            for file_path, start in sources
+        ]
+        # A crossfade can't be longer than half a segment
+        crossfade = min(crossfade, duration / 2)
+        if crossfade > 0 and len(streams) > 1:
+            merged = streams[0]
+            for stream in streams[1:]:
+                merged = ffmpeg.filter([merged, stream], 'acrossfade', d=crossfade, c1='qsin', c2='qsin')
+        else:
+            merged = ffmpeg.filter(streams, 'concat', n=len(streams), v=0, a=1)
+        _run_ffmpeg(
+            merged
+            .output(output_path, **(profile or DEFAULT_PROFILE).output_args())
+            .overwrite_output()
+        )
+        return output_path
     except Exception as e:
-        print(f"Error sending email to {email}: {e}")
-        return False, str(e)
+        print(f"Error creating audio mashup with ffmpeg: {e}")
+        # Don't leave a partial output where the MoviePy fallback would look for sources
+        _discard(output_path)
+        return None
 
-@app.route('/')
-def index():
-    return render_template('form.html')
+# --- Stream Copy ---
+# yt-dlp's bestaudio is usually Opus-in-WebM or AAC-in-M4A. When the sources
+# agree on a codec, segments are cut on packet boundaries and joined with the
+# concat demuxer without decoding anything; only the odd sources out are
+# transcoded to match the rest.
 
-@app.route('/generate_mashup', methods=['POST'])
-def generate_mashup():
-    singer = request.form.get('singer', '').strip()
-    number_of_videos = request.form.get('number_of_videos')
-    duration = request.form.get('duration', '10')
-    email = request.form.get('email', '').strip()
-    
-    is_valid, error_message, parsed_values = valid_input(singer, number_of_videos, duration, email)
-    if not is_valid:
-        return jsonify({"error": error_message}), 400
-    
-    num_videos, dur = parsed_values
-    
-    # Create a temporary directory for this request
-    temp_dir = tempfile.mkdtemp()
-    try:
-        print(f"Created temp dir: {temp_dir}")
-        print(f"Attempting to download {num_videos} videos for {singer}")
-        
-        # Download Phase
-        num_downloaded = download_video(singer, num_videos, temp_dir)
-        if num_downloaded == 0:
-             return jsonify({"error": "Failed to download videos."}), 500
-             
-        # Conversion/Cutting Phase
-        # We re-use temp_dir for finding files
-        audio_file_paths = convert(temp_dir, dur)
-        if not audio_file_paths:
-            return jsonify({"error": "Failed to process audio files."}), 500
-            
-        # Mashup Phase
-        merged_output_path = os.path.join(temp_dir, "merged_audio.mp3")
-        if not mashup(audio_file_paths, merged_output_path):
-             return jsonify({"error": "Failed to create mashup."}), 500
-             
-        # Zip Phase
-        zip_output_path = os.path.join(temp_dir, "merged_audio.zip")
-        if not create_zip(merged_output_path, zip_output_path):
-             return jsonify({"error": "Failed to create zip."}), 500
-             
-        # Custom File Size Check (Gmail limit is 25MB, we set 24MB for safety)
-        file_size = os.path.getsize(zip_output_path)
-        if file_size > 24 * 1024 * 1024:
-             return jsonify({"error": f"Generated file is too large ({file_size / (1024*1024):.2f}MB). Email limit is 25MB. Try fewer videos or shorter duration."}), 500
+# Source codec -> (file extension, ffmpeg muxer, encoder used for odd inputs out)
+COPY_CODECS = {
+    'opus': ('opus', 'opus', 'libopus'),
+    'aac': ('m4a', 'ipod', 'aac'),
+    'mp3': ('mp3', 'mp3', 'libmp3lame'),
+    'vorbis': ('ogg', 'ogg', 'libvorbis'),
+}
+# "Audio: aac (LC) (mp4a / 0x6134706D), 44100 Hz, stereo, ..."; the first parenthesis, unless it's
+# the codec tag, names the profile (LC, HE-AAC, ...) or decoder
+_AUDIO_STREAM = re.compile(r'Stream #\d+:\d+.*?: Audio: (\w+)(?: \(([^)/]+)\))?.*?, (\d+) Hz, ([^,(]+)')
+CHANNEL_COUNTS = {'mono': 1, 'stereo': 2, '2.1': 3, '3.0': 3, '4.0': 4, 'quad': 4, '5.0': 5, '5.1': 6,
+                  '6.1': 7, '7.1': 8}
 
-        # Email Phase
-        success, email_error = send_email(email, zip_output_path)
-        if not success:
-             return jsonify({"error": f"Failed to send email: {email_error}"}), 500
-             
-        return jsonify({"message": "Mashup generated and emailed successfully!"}), 200
+def probe_audio(file_path):
+    """Return (codec, profile, sample_rate, channels) of a file's first audio stream, or None.
 
-    except Exception as e:
+    profile is None when ffmpeg doesn't name one, and channels is None for a
+    layout it couldn't determine.
+    """
+    # ffmpeg prints the stream layout for any input, so this works without ffprobe
+    output = subprocess.run(['ffmpeg', '-hide_banner', '-i', file_path], capture_output=True, text=True).stderr
+    match = _AUDIO_STREAM.search(output)
+    if not match:
+        return None
+    codec, profile, rate, layout = match.groups()
+    return codec, profile, int(rate), CHANNEL_COUNTS.get(layout.strip())
 
-        print(f"Unexpected error: {e}")
-        return jsonify({"error": str(e)}), 500
-    finally:
+def copy_mashup(sources, output_stem, duration, audio_bitrate=f'{STREAM_COPY_MAX_KBPS}k'):
+    """Cut and join sources with stream copy, transcoding only the ones whose format differs.
+
+    Copied segments are cut on packet boundaries (within ~20 ms of the window).
+
+    ``sources`` is a list of (file_path, start_time_seconds). The output is
+    written to output_stem plus the extension of the sources' common codec;
+    sources with another codec, profile, sample rate or channel count are
+    encoded to match at ``audio_bitrate``. Returns the output path, or None
+    when the sources have nothing that can be copied, so the caller can fall
+    back to a full transcode.
+    """
+    if not sources:
+        print("No audio files to merge")
+        return None
+    probes = [probe_audio(file_path) for file_path, _ in sources]
+    # The concat demuxer needs every segment to share codec parameters exactly (HE-AAC and
+    # LC-AAC segments joined together decode as garbage), so the whole probe must match
+    candidates = [probe for probe in probes if probe and probe[0] in COPY_CODECS and probe[3]]
+    if not candidates:
+        return None
+    target = max(set(candidates), key=candidates.count)
+    codec, _, rate, channels = target
+    ext, muxer, encoder = COPY_CODECS[codec]
+    output_path = f"{output_stem}.{ext}"
+    # Intermediates get their own directory, so nothing left next to the downloads can be taken for one
+    parts_dir = tempfile.mkdtemp(prefix='copy-', dir=os.path.dirname(output_stem))
+    try:
+        jobs = []
+        for index, ((file_path, start), probe) in enumerate(zip(sources, probes)):
+            # Matroska holds any of these codecs, so every segment can share one intermediate format
+            segment_path = os.path.join(parts_dir, f"{index:02d}.mka")
+            if probe == target:
+                options = {'acodec': 'copy'}
+            else:
+                options = {'acodec': encoder, 'ar': rate, 'ac': channels, 'audio_bitrate': audio_bitrate}
+            jobs.append((file_path, segment_path, start, options))
+
+        def cut_one(job):
+            file_path, segment_path, start, options = job
+            try:
+                if options['acodec'] == 'copy':
+                    # Input seeking would start at the container's previous seek point (seconds early
+                    # in WebM); seeking on the output drops whole packets up to the start instead
+                    node = ffmpeg.input(file_path).output(segment_path, ss=start, t=duration, format='matroska',
+                                                          vn=None, **options)
+                else:
+                    node = ffmpeg.input(file_path, ss=start, t=duration).output(segment_path, format='matroska',
+                                                                               vn=None, **options)
+                _run_ffmpeg(node.overwrite_output())
+                return segment_path
+            except Exception as e:
+                print(f"Error cutting {os.path.basename(file_path)} for stream copy: {e}")
+                return None
+
+        workers = app.config['MASHUP_CUT_WORKERS'] or available_cores()
+        with ThreadPoolExecutor(max_workers=min(workers, len(jobs)), thread_name_prefix='mashup-copy') as executor:
+            segments = [path for path in executor.map(in_current_context(cut_one), jobs) if path]
+        if not segments:
+            return None
+
+        list_path = os.path.join(parts_dir, "segments.txt")
+        with open(list_path, 'w') as f:
+            for path in segments:
+                escaped = path.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        _run_ffmpeg(ffmpeg.input(list_path, format='concat', safe=0)
+                    .output(output_path, format=muxer, acodec='copy', vn=None).overwrite_output())
+        return output_path
+    except Exception as e:
+        print(f"Error creating audio mashup with stream copy: {e}")
+        _discard(output_path)
+        return None
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+# --- Overlapped Pipeline ---
+# Downloads, cuts and the encoder run at the same time, joined by bounded
+# queues: each track is cut as soon as it lands and its PCM is streamed into a
+# single encoder in ranking order, so network and CPU work overlap.
+
+PCM_RATE = 44100
+PCM_CHANNELS = 2
+
+def decode_segment(input_file_path, output_file_path, start_time_seconds, duration_seconds):
+    """Cut one track's window to raw 16-bit stereo PCM at PCM_RATE."""
+    try:
+        _run_ffmpeg(
+            ffmpeg
+            .input(input_file_path, ss=start_time_seconds, t=duration_seconds)
+            .output(output_file_path, format='s16le', acodec='pcm_s16le', ar=PCM_RATE, ac=PCM_CHANNELS)
+            .overwrite_output()
+        )
+        return True
+    except Exception as e:
+        print(f"Error decoding audio with ffmpeg for {input_file_path}: {e}")
+        return False
+
+def _start_encoder(output_path, pcm_format, profile=None):
+    """Start the one encoder a mashup is written through, reading raw PCM on stdin."""
+    return (
+        ffmpeg
+        .input('pipe:', format=pcm_format, ar=PCM_RATE, ac=PCM_CHANNELS)
+        .output(output_path, **(profile or DEFAULT_PROFILE).output_args())
+        .global_args('-nostats', '-loglevel', 'error')
+        .overwrite_output()
+        .run_async(pipe_stdin=True, pipe_stderr=True)
+    )
+
+def decode_pcm(input_file_path, start_time_seconds=0, duration_seconds=None):
+    """Decode a file (or one window of it) straight into a float32 (frames, channels) array."""
+    options = {'ss': start_time_seconds} if start_time_seconds else {}
+    if duration_seconds:
+        options['t'] = duration_seconds
+    process = (
+        ffmpeg
+        .input(input_file_path, **options)
+        .output('pipe:', format='f32le', acodec='pcm_f32le', ar=PCM_RATE, ac=PCM_CHANNELS)
+        .global_args('-nostats', '-loglevel', 'error')
+        .run_async(pipe_stdout=True, pipe_stderr=True)
+    )
+    data = process.stdout.read()
+    process.stdout.close()
+    _reap_ffmpeg(process)
+    return np.frombuffer(data, dtype='<f4').reshape(-1, PCM_CHANNELS)
+
+class PcmMixer:
+    """Loudness-matches and crossfades segments one at a time on their way to the encoder.
+
+    Each segment is scaled to ``target_dbfs`` RMS (capped at MAX_GAIN and so
+    its peak never clips) and joined to the previous one with an equal-power
+    crossfade of ``crossfade`` seconds. Only the previous segment's fade-out
+    tail is held back, so memory stays at about one decoded segment.
+    """
+    MAX_GAIN = 4.0 # +12 dB
+
+    def __init__(self, output_path, crossfade=0, target_dbfs=-18, profile=None):
+        self.output_path = output_path
+        self.profile = profile
+        self.fade_frames = int(crossfade * PCM_RATE)
+        self.target_rms = 10 ** (target_dbfs / 20)
+        self.process = None
+        self._tail = None
+
+    def _gain(self, samples):
+        rms = float(np.sqrt(np.mean(np.square(samples, dtype=np.float64))))
+        peak = float(np.max(np.abs(samples)))
+        if rms < 1e-5:
+            return 1.0 # near silence: leave it alone rather than amplify the noise floor
+        return min(self.target_rms / rms, self.MAX_GAIN, 0.99 / peak)
+
+    def _emit(self, block):
+        if len(block):
+            if self.process is None:
+                self.process = _start_encoder(self.output_path, 'f32le', self.profile)
+            self.process.stdin.write(np.ascontiguousarray(block, dtype='<f4').tobytes())
+
+    def add(self, samples):
+        if not len(samples):
+            return
+        samples = samples * np.float32(self._gain(samples))
+        # A crossfade can't be longer than half a segment
+        fade = min(self.fade_frames, len(samples) // 2)
+        if self._tail is not None:
+            overlap = min(fade, len(self._tail))
+            self._emit(self._tail[:len(self._tail) - overlap])
+            if overlap:
+                angle = (np.arange(overlap, dtype=np.float32) + 0.5) * np.float32(np.pi / 2 / overlap)
+                self._emit(self._tail[len(self._tail) - overlap:] * np.cos(angle)[:, None]
+                           + samples[:overlap] * np.sin(angle)[:, None])
+            samples = samples[overlap:]
+        split = len(samples) - fade
+        self._emit(samples[:split])
+        self._tail = samples[split:]
+
+    def finish(self):
+        """Flush the held-back tail and wait for the encoder; returns output_path or None."""
+        if self._tail is not None:
+            self._emit(self._tail)
+            self._tail = None
+        if self.process is None:
+            return None
+        self.process.stdin.close()
+        _reap_ffmpeg(self.process)
+        return self.output_path
+
+    def abort(self):
+        self._tail = None
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+def mashup_numpy(sources, output_path, duration=None, crossfade=0, target_dbfs=None, profile=None):
+    """Decode, loudness-match and crossfade each source in turn, encoding the output once.
+
+    ``sources`` is a list of (file_path, start_time_seconds); each is decoded
+    into memory only while it is being mixed. A source that fails to decode
+    is skipped. Returns output_path, or None so the caller can fall back.
+    """
+    if not sources:
+        print("No audio files to merge")
+        return None
+    if target_dbfs is None:
+        target_dbfs = app.config['MASHUP_MIX_TARGET_DBFS']
+    mixer = PcmMixer(output_path, crossfade, target_dbfs, profile)
+    try:
+        for file_path, start in sources:
+            try:
+                samples = decode_pcm(file_path, start, duration)
+            except Exception as e:
+                print(f"Error decoding {file_path}: {e}")
+                continue
+            mixer.add(samples)
+        return mixer.finish()
+    except Exception as e:
+        mixer.abort()
+        print(f"Error creating audio mashup with the numpy mixer: {e}")
+        return None
+
+class StreamingEncoder:
+    """Feeds PCM segments to one ffmpeg encoder in ranking order as they arrive.
+
+    Segments that arrive early wait until every lower rank has been written
+    (or reported missing with a None path); each one is deleted once written.
+    The encoder is only started when the first segment is written. With a
+    ``mixer`` (a PcmMixer) the segments go through it instead.
+    """
+
+    def __init__(self, output_path, mixer=None, profile=None):
+        self.output_path = output_path
+        self.mixer = mixer
+        self.profile = profile
+        self.process = None
+        self.segments = 0
+        self._pending = {}
+        self._next_rank = 1
+
+    def add(self, rank, pcm_path):
+        self._pending[rank] = pcm_path
+        while self._next_rank in self._pending:
+            self._write(self._pending.pop(self._next_rank))
+            self._next_rank += 1
+
+    def _write(self, pcm_path):
+        if not pcm_path:
+            return
+        try:
+            if self.mixer:
+                samples = np.fromfile(pcm_path, dtype='<i2').reshape(-1, PCM_CHANNELS)
+                # Scale in float32, as decode_pcm returns; true division would make a float64 copy
+                self.mixer.add(np.multiply(samples, np.float32(1 / 32768), dtype=np.float32))
+            else:
+                if self.process is None:
+                    self.process = _start_encoder(self.output_path, 's16le', self.profile)
+                with open(pcm_path, 'rb') as f:
+                    shutil.copyfileobj(f, self.process.stdin, 1024 * 1024)
+            self.segments += 1
+        finally:
+            os.remove(pcm_path)
+
+    def finish(self):
+        """Write whatever is still pending and wait for the encoder; returns output_path or None."""
+        for rank in sorted(self._pending):
+            self._write(self._pending.pop(rank))
+        if self.mixer:
+            return self.mixer.finish()
+        if self.process is None:
+            return None
+        self.process.stdin.close()
+        _reap_ffmpeg(self.process)
+        return self.output_path
+
+    def abort(self):
+        for pcm_path in self._pending.values():
+            if pcm_path and os.path.exists(pcm_path):
+                os.remove(pcm_path)
+        self._pending.clear()
+        if self.mixer:
+            self.mixer.abort()
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+def stream_mashup(download, output_path, duration, start_time_seconds=SEGMENT_START_SECONDS,
+                  workers=None, queue_size=None, report=None, mixer=None, profile=None):
+    """Download, cut and encode a mashup with all three stages running at once.
+
+    ``download(on_track)`` runs in the calling thread and must call
+    on_track(rank, file_path) as each track lands (download_video does).
+    Cut workers take tracks off a bounded queue and decode them to PCM next to
+    the source; a merge thread takes the segments off a second bounded queue and
+    streams them into one encoder, through ``mixer`` when one is given. Full queues make the stage before them wait
+    rather than pile up work. Returns (download's return value, output_path or
+    None if nothing could be encoded).
+    """
+    report = report or (lambda stage: None)
+    workers = workers or app.config['MASHUP_CUT_WORKERS'] or available_cores()
+    queue_size = queue_size or app.config['MASHUP_PIPELINE_QUEUE'] or workers * 2
+    tracks = queue.Queue(maxsize=queue_size)
+    segments = queue.Queue(maxsize=queue_size)
+    encoder = StreamingEncoder(output_path, mixer, profile)
+
+    def cut_worker():
+        while True:
+            item = tracks.get()
+            if item is None:
+                return
+            rank, file_path = item
+            pcm_path = None
+            try:
+                if file_path:
+                    start = _source_start(os.path.basename(file_path), start_time_seconds)
+                    if decode_segment(file_path, file_path + '.pcm', start, duration):
+                        pcm_path = file_path + '.pcm'
+            finally:
+                segments.put((rank, pcm_path))
+
+    def merge_worker():
+        error = None
+        while True:
+            item = segments.get()
+            if item is None:
+                break
+            if error:
+                # Keep draining so the cut workers never block on a dead encoder
+                if item[1]:
+                    os.remove(item[1])
+                continue
+            try:
+                encoder.add(*item)
+            except Exception as e:
+                error = e
+        if error:
+            encoder.abort()
+            raise error
+        return encoder.finish()
+
+    executor = ThreadPoolExecutor(max_workers=workers + 1, thread_name_prefix='mashup-stream')
+    merge_future = executor.submit(in_current_context(merge_worker))
+    cut_futures = [executor.submit(in_current_context(cut_worker)) for _ in range(workers)]
+    try:
+        result = download(lambda rank, file_path: tracks.put((rank, file_path)))
+    finally:
+        for _ in cut_futures:
+            tracks.put(None)
+        # With the stages overlapped, 'cut' and 'merge' only time how long each
+        # one ran on after the stage feeding it had finished
+        report('cut')
+        with stage_timer('cut'):
+            for future in cut_futures:
+                future.result()
+        segments.put(None)
+        report('merge')
+        try:
+            with stage_timer('merge'):
+                merged = merge_future.result()
+        except Exception as e:
+            print(f"Error creating audio mashup with the streaming encoder: {e}")
+            # The caller falls back to merging from the downloads, which must not find a partial output
+            _discard(output_path)
+            merged = None
+        executor.shutdown()
+    return result, merged
+
+# Compressed audio doesn't shrink under DEFLATE, so these are stored as-is
+STORED_EXTENSIONS = ('.mp3', '.m4a', '.aac', '.opus', '.ogg', '.webm')
+
+def create_zip(file_path, zip_name):
+    try:
+        compression = zipfile.ZIP_STORED if file_path.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+        with zipfile.ZipFile(zip_name, 'w', compression) as zipf:
+            zipf.write(file_path, os.path.basename(file_path))
+        return True
+    except Exception as e:
+        print(f"Error creating ZIP file: {e}")
+        return False
+
+class MailDispatcher:
+    """Background mail sender with a small pool of open SMTP connections.
+
+    Each of ``connections`` worker threads keeps one authenticated Flask-Mail
+    connection, takes up to ``batch_size`` queued messages at a time and sends
+    them over that connection. A failed send drops the connection and the
+    message is retried with exponential backoff, up to ``max_attempts``.
+    Messages that run out of attempts are logged, kept in ``failures`` and
+    reported to the ``on_failure`` callback they were submitted with.
+    """
+
+    def __init__(self, flask_app, mail_ext, connections=2, batch_size=10, max_attempts=5,
+                 backoff=2.0, idle_timeout=30):
+        self.app = flask_app
+        self.mail = mail_ext
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.counters = {"queued": 0, "sent": 0, "retried": 0, "failed": 0, "connections_opened": 0}
+        self._latency = {"count": 0, "total": 0.0, "max": 0.0}
+        self._delayed = 0
+        self.failures = collections.deque(maxlen=100)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._worker, name=f'mail-dispatcher-{i}', daemon=True)
+                         for i in range(connections)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, msg, on_failure=None):
+        with self._lock:
+            self.counters["queued"] += 1
+        self._queue.put((msg, 1, time.monotonic(), on_failure))
+
+    def _retry_later(self, item, error):
+        msg, attempt, queued_at, on_failure = item
+        if attempt >= self.max_attempts:
+            with self._lock:
+                self.counters["failed"] += 1
+                self.failures.append({"recipients": list(msg.recipients), "subject": msg.subject,
+                                      "error": str(error), "failed_at": time.time()})
+            print(f"Giving up on email to {', '.join(msg.recipients)} after {attempt} attempts: {error}")
+            if on_failure:
+                try:
+                    on_failure(str(error))
+                except Exception as e:
+                    print(f"Error recording failed email: {e}")
+            return
+        with self._lock:
+            self.counters["retried"] += 1
+            self._delayed += 1
+
+        def requeue():
+            self._queue.put((msg, attempt + 1, queued_at, on_failure))
+            with self._lock:
+                self._delayed -= 1
+
+        timer = threading.Timer(self.backoff * 2 ** (attempt - 1), requeue)
+        timer.daemon = True
+        timer.start()
+
+    def _close(self, conn):
+        try:
+            conn.__exit__(None, None, None)
+        except Exception:
+            pass # the server may already have dropped us
+
+    def _worker(self):
+        conn = None
+        with self.app.app_context():
+            while True:
+                try:
+                    batch = [self._queue.get(timeout=self.idle_timeout)]
+                except queue.Empty:
+                    # Don't hold an idle SMTP session open forever
+                    if conn is not None:
+                        self._close(conn)
+                        conn = None
+                    continue
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                for index, item in enumerate(batch):
+                    try:
+                        if conn is None:
+                            conn = self.mail.connect().__enter__()
+                            with self._lock:
+                                self.counters["connections_opened"] += 1
+                        conn.send(item[0])
+                    except Exception as e:
+                        print(f"Error sending email to {', '.join(item[0].recipients)}: {e}")
+                        if conn is not None:
+                            self._close(conn)
+                            conn = None
+                        self._retry_later(item, e)
+                        self._queue.task_done()
+                        continue
+                    latency = time.monotonic() - item[2]
+                    with self._lock:
+                        self.counters["sent"] += 1
+                        self._latency["count"] += 1
+                        self._latency["total"] += latency
+                        self._latency["max"] = max(self._latency["max"], latency)
+                    self._queue.task_done()
+
+    def flush(self, timeout):
+        """Wait up to ``timeout`` seconds for every queued and retrying message; True if none are left."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                pending = self._queue.unfinished_tasks + self._delayed
+            if not pending:
+                return True
+            if time.monotonic() >= deadline:
+                print(f"Exiting with {pending} emails still queued")
+                return False
+            time.sleep(0.05)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["queue_depth"] = self._queue.qsize() + self._delayed
+            count = self._latency["count"]
+            stats["latency_avg_seconds"] = self._latency["total"] / count if count else 0.0
+            stats["latency_max_seconds"] = self._latency["max"]
+            return stats
+
+_mail_dispatcher = None
+_mail_dispatcher_lock = threading.Lock()
+
+def get_mail_dispatcher():
+    """Return the shared mail dispatcher, or None when MASHUP_MAIL_QUEUE is off."""
+    global _mail_dispatcher
+    if not app.config['MASHUP_MAIL_QUEUE']:
+        return None
+    with _mail_dispatcher_lock:
+        if _mail_dispatcher is None:
+            _mail_dispatcher = MailDispatcher(
+                app, mail,
+                connections=app.config['MASHUP_MAIL_CONNECTIONS'],
+                batch_size=app.config['MASHUP_MAIL_BATCH_SIZE'],
+                max_attempts=app.config['MASHUP_MAIL_MAX_ATTEMPTS'],
+                backoff=app.config['MASHUP_MAIL_BACKOFF'])
+            # The sender threads die with the process, so give the queue a chance to drain first
+            atexit.register(_mail_dispatcher.flush, app.config['MASHUP_MAIL_FLUSH_TIMEOUT'])
+        return _mail_dispatcher
+
+# Called with the error when a queued message for the current job is given up on
+_mail_failure_hook = contextvars.ContextVar('mashup_mail_failure_hook', default=None)
+
+def dispatch_message(msg):
+    """Queue msg on the mail dispatcher, or send it right away when the queue is off."""
+    dispatcher = get_mail_dispatcher()
+    if dispatcher:
+        dispatcher.submit(msg, on_failure=_mail_failure_hook.get())
+    else:
+        mail.send(msg)
+
+def mail_delivery():
+    # 'sent' once the message has been handed to the SMTP server, 'queued' while a dispatcher holds it
+    return 'queued' if get_mail_dispatcher() else 'sent'
+
+def send_email(email, zip_path):
+    try:
+        if not os.path.exists(zip_path):
+            return False, "File not found"
+        msg = Message(subject='Your Mashup Audio', recipients=[email])
+        msg.body = 'Attached is the zip file containing your mashup audio.'
+        with open(zip_path, 'rb') as f:
+            msg.attach('merged_audio.zip', 'application/zip', f.read())
+        dispatch_message(msg)
+        return True, None
+    except Exception as e:
+        print(f"Error sending email to {email}: {e}")
+        return False, str(e)
+
+# --- Link Delivery ---
+# Results kept in a retention area and handed out through expiring signed links,
+# so delivery never holds the file in memory and isn't bound by attachment limits.
+
+def _download_serializer():
+    return URLSafeTimedSerializer(app.secret_key, salt='mashup-download')
+
+def link_delivery_available():
+    # Links need a configured public address: jobs have no request to take one from, and a
+    # request's own Host header is client-controlled, so trusting it would let anyone have
+    # signed links mailed out pointing at their host
+    return bool(app.secret_key and app.config['MASHUP_PUBLIC_URL'])
+
+def _prune_retained():
+    now = time.time()
+    for name in os.listdir(app.config['MASHUP_RETENTION_DIR']):
+        path = os.path.join(app.config['MASHUP_RETENTION_DIR'], name)
+        # Expiry is part of the name: a retained file may be a hard link to a cache entry,
+        # whose mtime is when it was built rather than when its link was handed out
+        expires, _, _ = name.partition('-')
+        try:
+            if not expires.isdigit():
+                # Retained before the expiry went into the name
+                expires = os.path.getmtime(path) + app.config['MASHUP_LINK_TTL']
+            if float(expires) < now:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def retain_result(file_path):
+    """Keep a finished mashup in the retention area and return its signed download token."""
+    os.makedirs(app.config['MASHUP_RETENTION_DIR'], exist_ok=True)
+    _prune_retained()
+    expires = int(time.time() + app.config['MASHUP_LINK_TTL']) + 1
+    file_id = f"{expires}-{uuid.uuid4().hex}{os.path.splitext(file_path)[1]}"
+    _link_or_copy(file_path, os.path.join(app.config['MASHUP_RETENTION_DIR'], file_id))
+    return _download_serializer().dumps(file_id)
+
+def public_url(path):
+    return app.config['MASHUP_PUBLIC_URL'].rstrip('/') + path
+
+def describe_duration(seconds):
+    """Render seconds in the largest unit there are at least two of, rounded down: '24 hours', '90 minutes'."""
+    for unit, size in (('day', 86400), ('hour', 3600), ('minute', 60)):
+        if seconds >= 2 * size:
+            seconds, name = seconds // size, unit
+            break
+    else:
+        name = 'second'
+    seconds = int(seconds)
+    return f"{seconds} {name}{'' if seconds == 1 else 's'}"
+
+def send_link_email(email, download_url):
+    try:
+        ttl = describe_duration(app.config['MASHUP_LINK_TTL'])
+        msg = Message(subject='Your Mashup Audio', recipients=[email])
+        msg.body = f'Your mashup audio is ready. Download it within {ttl} here:\n\n{download_url}'
+        dispatch_message(msg)
+        return True, None
+    except Exception as e:
+        print(f"Error sending email to {email}: {e}")
+        return False, str(e)
+
+def deliver_link(email, merged_output_path):
+    token = retain_result(merged_output_path)
+    # Built by hand because job threads have no request context for url_for
+    download_url = public_url(f"/download/{token}")
+    success, email_error = send_link_email(email, download_url)
+    if not success:
+        return {"error": f"Failed to send email: {email_error}"}, 500
+    if mail_delivery() == 'queued':
+        return {"message": "Mashup generated! A download link will be emailed shortly.", "email": "queued",
+                "download_url": download_url}, 200
+    return {"message": "Mashup generated! A download link has been emailed.", "email": "sent",
+            "download_url": download_url}, 200
+
+@app.route('/download/<token>')
+def download_result(token):
+    try:
+        file_id = _download_serializer().loads(token, max_age=app.config['MASHUP_LINK_TTL'])
+    except SignatureExpired:
+        return jsonify({"error": "This download link has expired."}), 410
+    except BadSignature:
+        return jsonify({"error": "Invalid download link."}), 404
+    path = os.path.join(app.config['MASHUP_RETENTION_DIR'], os.path.basename(file_id))
+    if not os.path.isfile(path):
+        return jsonify({"error": "This download link has expired."}), 410
+    # send_file streams from disk (sendfile where the server supports it) and answers Range requests
+    return send_file(path, as_attachment=True, download_name=f"merged_audio{os.path.splitext(path)[1]}",
+                     conditional=True, max_age=0)
+
+def _stats_lines(name, help_text, stats):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    lines += [f'{name}{{stat="{key}"}} {value}' for key, value in sorted(stats.items())]
+    return lines
+
+@app.route('/metrics')
+def metrics_endpoint():
+    lines = []
+    for name, help_text, source in (
+            ('mashup_audio_cache', 'Source audio cache counters.', _audio_cache),
+            ('mashup_search_cache', 'Search result cache counters.', _search_cache),
+            ('mashup_result_cache', 'Finished mashup cache counters.', _result_cache),
+            ('mashup_mail_queue', 'Mail dispatcher counters, queue depth and latency.', _mail_dispatcher),
+            ('mashup_admission', 'Admission control counters and reserved capacity.', _admission),
+            ('mashup_job_store', 'Stored jobs queued or running on the worker processes.', get_job_store())):
+        if source is not None:
+            lines += _stats_lines(name, help_text, source.stats())
+    with _jobs_cond:
+        active = _active_jobs()
+    store = get_job_store()
+    if store is not None:
+        # Stored jobs run on the workers, not on this process's thread pool
+        active += sum(store.stats().values())
+    lines += ["# HELP mashup_jobs_active Async jobs queued or running.", "# TYPE mashup_jobs_active gauge",
+              f"mashup_jobs_active {active}"]
+    body = metrics.render() + "\n".join(lines) + "\n"
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@app.route('/')
+def index():
+    return render_template('form.html')
+
+@app.route('/health')
+def health():
+    return jsonify({"status": "ok", "media_stack_loaded": media_stack_loaded()}), 200
+
+def build_mashup(singer, num_videos, dur, work_dir, report=None, shared=None, profile=None, checkpoint=None):
+    """Download, cut and merge one mashup inside work_dir, encoded with ``profile``.
+
+    ``shared`` is a batch's SharedWork, whose caches are used in place of the
+    server-wide ones. A stored job passes its JobCheckpoint, so a retry reuses
+    the tracks an earlier attempt downloaded into work_dir. Returns
+    (merged_path, None) on success or (None, error_message).
+    """
+    profile = profile or DEFAULT_PROFILE
+    copy = profile.codec == 'copy'
+    report = report or (lambda stage: None)
+    sharing = {'cache': shared.audio_cache, 'search_cache': shared.search_cache} if shared else {}
+    print(f"Attempting to download {num_videos} videos for {singer}")
+
+    # Download Phase
+    report('download')
+    segment = (SEGMENT_START_SECONDS, dur) if app.config['MASHUP_FETCH_MODE'] == 'range' else None
+    merged = None
+    engine = app.config['MASHUP_MERGE_ENGINE']
+    crossfade = app.config['MASHUP_CROSSFADE']
+    overlap = app.config['MASHUP_PIPELINE'] == 'overlap' and (engine == 'numpy' or (engine == 'ffmpeg' and not crossfade))
+
+    def fetch(**kwargs):
+        num_downloaded = download_video(singer, num_videos, work_dir, segment=segment, **kwargs, **sharing)
+        if checkpoint and num_downloaded:
+            # Only the ranked downloads: the overlapped cut and encoder are already writing beside them
+            checkpoint.save('download', files=[path for path, _ in list_sources(work_dir)], tracks=num_downloaded)
+        return num_downloaded
+
+    downloaded = checkpoint.get('download') if checkpoint else None
+    if downloaded and not checkpoint.restore('download', work_dir):
+        # The kept downloads didn't survive (e.g. the work dir was cleaned), so fetch them again
+        downloaded = None
+    if downloaded:
+        # Resuming a stored job: an earlier attempt already downloaded the tracks
+        num_downloaded = downloaded['tracks']
+        overlap = False
+    if copy:
+        # Copying is cheap enough that there's nothing to overlap with the downloads
+        if not downloaded:
+            num_downloaded = fetch()
+        if num_downloaded:
+            report('cut')
+            with stage_timer('cut'):
+                merged = copy_mashup(list_sources(work_dir), os.path.join(work_dir, "merged_audio"), dur,
+                                     profile.options['audio_bitrate'])
+            if merged:
+                if metrics_enabled():
+                    count_bytes('written', os.path.getsize(merged))
+                return merged, None
+        # Nothing could be copied, so encode with the planned fallback
+        profile = profile.fallback
+    merged_output_path = os.path.join(work_dir, f"merged_audio.{profile.ext}")
+    if overlap and not copy:
+        # Cut and encode each track while the rest are still downloading
+        mixer = (PcmMixer(merged_output_path, crossfade, app.config['MASHUP_MIX_TARGET_DBFS'], profile)
+                 if engine == 'numpy' else None)
+        num_downloaded, merged = stream_mashup(
+            lambda on_track: fetch(on_track=on_track),
+            merged_output_path, dur, report=report, mixer=mixer, profile=profile)
+    elif not copy and not downloaded:
+        num_downloaded = fetch()
+    if num_downloaded == 0:
+        return None, "Failed to download videos."
+
+    if not merged and engine == 'numpy':
+        report('merge')
+        with stage_timer('merge'):
+            merged = mashup_numpy(list_sources(work_dir), merged_output_path, dur, crossfade=crossfade,
+                                  profile=profile)
+    elif not merged and engine == 'ffmpeg':
+        # Single pass: cut and merge straight from the downloads
+        report('merge')
+        with stage_timer('merge'):
+            merged = mashup_ffmpeg(list_sources(work_dir), merged_output_path, dur, crossfade=crossfade,
+                                   profile=profile)
+
+    if not merged:
+        # Conversion/Cutting Phase
+        # We re-use work_dir for finding files
+        report('cut')
+        with stage_timer('cut'):
+            audio_file_paths = convert(work_dir, dur)
+        if not audio_file_paths:
+            return None, "Failed to process audio files."
+
+        # Mashup Phase
+        report('merge')
+        with stage_timer('merge'):
+            merged = mashup(audio_file_paths, merged_output_path, profile=profile)
+        if not merged:
+            return None, "Failed to create mashup."
+
+    if metrics_enabled():
+        count_bytes('written', os.path.getsize(merged_output_path))
+    return merged_output_path, None
+
+def mashup_cache_key(singer, num_videos, dur, start_time_seconds=SEGMENT_START_SECONDS):
+    return f"{normalize_singer(singer)}|{num_videos}|{dur}|{start_time_seconds}"
+
+def mashup_cache_format(profile=None):
+    # Anything that changes the rendered audio must be part of the cache key
+    engine = app.config['MASHUP_MERGE_ENGINE']
+    if engine == 'numpy':
+        engine += f":{app.config['MASHUP_MIX_TARGET_DBFS']}"
+    return f"mashup:{engine}:{app.config['MASHUP_CROSSFADE']}:{(profile or DEFAULT_PROFILE).name}"
+
+def run_pipeline(singer, num_videos, dur, email, progress=None, shared=None, checkpoint=None):
+    """Run search, download, cut, merge, zip and email for one request.
+
+    Returns a (payload, status_code) tuple. ``progress`` is called with the
+    stage name as each stage starts, so job mode can report it. Finished
+    mashups are served from the result cache when an identical request was
+    built before (or is being built right now); batch items pass their
+    batch's SharedWork as ``shared``. Stored jobs pass a JobCheckpoint and
+    resume after the last stage it records.
+    """
+    if checkpoint and checkpoint.get('email'):
+        # Delivered before the worker could mark the job done; don't send it twice
+        return checkpoint.get('email')['payload'], 200
+    trace = new_trace(singer=singer, num_videos=num_videos, duration=dur)
+    token = _current_trace.set(trace)
+    status_code = 500
+    try:
+        payload, status_code = _run_pipeline(singer, num_videos, dur, email, progress, shared, checkpoint)
+        if checkpoint and status_code == 200:
+            checkpoint.save('email', payload=payload)
+        return payload, status_code
+    finally:
+        _current_trace.reset(token)
+        finish_trace(trace, status_code)
+
+def _run_pipeline(singer, num_videos, dur, email, progress, shared=None, checkpoint=None):
+    def report(stage):
+        if progress:
+            progress(stage)
+        if checkpoint and stage == 'email':
+            # Another worker may have taken the job over; only the lease holder may deliver it
+            checkpoint.check()
+
+    # Plan the encoding before doing any work, so the result is sure to fit how it's delivered
+    delivery, profile = plan_delivery(num_videos, dur)
+    if profile is None:
+        return {"error": "A mashup this long can't fit in an email attachment. Try fewer videos or shorter duration."}, 400
+    output = dict(profile.describe(num_videos * dur), delivery=delivery)
+
+    def delivered(result):
+        payload, status_code = result
+        if status_code == 200:
+            payload["output"] = dict(output, delivery='link')
+        return payload, status_code
+
+    # Create a temporary directory for this request; stored jobs use one per attempt
+    if checkpoint:
+        temp_dir = checkpoint.work_dir
+        os.makedirs(temp_dir, exist_ok=True)
+    else:
+        temp_dir = tempfile.mkdtemp()
+    try:
+        print(f"Created temp dir: {temp_dir}")
+
+        errors = []
+        def build():
+            extra = {'shared': shared} if shared else {}
+            if checkpoint:
+                extra['checkpoint'] = checkpoint
+            merged_path, error = build_mashup(singer, num_videos, dur, temp_dir, report, profile=profile, **extra)
+            if error:
+                errors.append(error)
+            # Tracks that failed to download are left out, and the next identical request may get them
+            return merged_path, len(list_sources(temp_dir)) == num_videos
+
+        built = checkpoint.restore('merge', temp_dir) if checkpoint else None
+        result_cache = shared.result_cache if shared else get_result_cache()
+        if built:
+            # Resuming a stored job whose mashup an earlier attempt already built
+            merged_output_path = built[0]
+        elif result_cache:
+            merged_output_path = result_cache.get_or_build(
+                mashup_cache_key(singer, num_videos, dur), mashup_cache_format(profile),
+                os.path.join(temp_dir, "merged_audio"), build)
+        else:
+            merged_output_path, _ = build()
+        if not merged_output_path:
+            return {"error": errors[0] if errors else "Failed to create mashup."}, 500
+        if checkpoint:
+            checkpoint.save('merge', files=[merged_output_path])
+        if profile.codec == 'copy':
+            # Report what the stream copy produced, or the fallback if it had to transcode
+            ext = os.path.splitext(merged_output_path)[1][1:]
+            copied = {spec[0]: codec for codec, spec in COPY_CODECS.items()}
+            if ext == profile.fallback.ext or ext not in copied:
+                output.update(profile.fallback.describe(num_videos * dur))
+            else:
+                output.update(codec=copied[ext], format=ext)
+
+        if delivery == 'link':
+            report('email')
+            with stage_timer('email'):
+                return delivered(deliver_link(email, merged_output_path))
+
+        # Zip Phase
+        report('zip')
+        zip_output_path = os.path.join(temp_dir, "merged_audio.zip")
+        with stage_timer('zip'):
+            zipped = create_zip(merged_output_path, zip_output_path)
+        if not zipped:
+             return {"error": "Failed to create zip."}, 500
+
+        # The plan should keep us under the attachment limit; this catches estimates that ran over
+        file_size = os.path.getsize(zip_output_path)
+        count_bytes('written', file_size)
+        output["bytes"] = file_size
+        if file_size > app.config['MASHUP_ATTACHMENT_LIMIT']:
+             if app.config['MASHUP_DELIVERY'] == 'auto' and link_delivery_available():
+                 # Too big to attach, so send a download link instead of failing
+                 report('email')
+                 with stage_timer('email'):
+                     return delivered(deliver_link(email, merged_output_path))
+             return {"error": f"Generated file is too large ({file_size / (1024*1024):.2f}MB). Email limit is 25MB. Try fewer videos or shorter duration."}, 500
+
+        # Email Phase
+        report('email')
+        with stage_timer('email'):
+            success, email_error = send_email(email, zip_output_path)
+        if not success:
+             return {"error": f"Failed to send email: {email_error}"}, 500
+
+        if mail_delivery() == 'queued':
+            # Nothing has been sent yet, so don't claim it has
+            return {"message": "Mashup generated! It will be emailed shortly.", "email": "queued",
+                    "output": output}, 200
+        return {"message": "Mashup generated and emailed successfully!", "email": "sent", "output": output}, 200
+
+    except Exception as e:
+
+        print(f"Unexpected error: {e}")
+        return {"error": str(e)}, 500
+    finally:
         # Cleanup everything in the temp dir
         try:
             for root, dirs, files in os.walk(temp_dir, topdown=False):
@@ -325,7 +2289,1000 @@ def generate_mashup():
         except Exception as cleanup_error:
             print(f"Error cleaning up temp dir {temp_dir}: {cleanup_error}")
 
-def main():
+# --- Admission Control ---
+# Every pipeline is priced in scratch bytes and CPU slots before it starts. One
+# that doesn't fit the remaining budget waits its turn in a bounded FIFO queue,
+# or is turned away with a Retry-After estimate, instead of slowing everyone down.
+
+SOURCE_BYTES_PER_SECOND = 24 * 1024 # ~192 kbit/s audio stream
+FULL_TRACK_BYTES = 8 * 1024 * 1024 # a typical song downloaded whole
+PCM_BYTES_PER_SECOND = PCM_RATE * PCM_CHANNELS * 2
+
+# Pipelines spend most of their time waiting on downloads rather than cutting, so the
+# default CPU budget lets MASHUP_MAX_PIPELINES' default of four full-width pipelines share the cores
+CPU_OVERSUBSCRIPTION = 4
+
+def estimate_cost(num_videos, dur, fetch_mode='range', cut_workers=None):
+    """Return (scratch_bytes, cpu_slots) a pipeline for num_videos tracks of dur seconds needs."""
+    source = SOURCE_BYTES_PER_SECOND * dur if fetch_mode == 'range' else FULL_TRACK_BYTES
+    # Each track's source and cut segment, plus the merged output and its zip
+    scratch = num_videos * (source + PCM_BYTES_PER_SECOND * dur) + 2 * num_videos * dur * SOURCE_BYTES_PER_SECOND
+    # Tracks are cut in parallel, one ffmpeg process each, but never more at once than there are cut workers
+    cut_workers = cut_workers or app.config['MASHUP_CUT_WORKERS'] or available_cores()
+    return scratch, min(num_videos, cut_workers)
+
+class AdmissionController:
+    """Admits pipelines while they fit the global pipeline, scratch-disk and CPU-slot budgets.
+
+    acquire() blocks in FIFO order for up to ``timeout`` seconds and returns a
+    ticket to hand back to release(). A request larger than a whole budget is
+    clamped to it, so it runs alone rather than never. rate_limited() enforces
+    a sliding window of requests per email address; refund() hands back the
+    quota of a request that was turned away after all.
+    """
+
+    def __init__(self, max_pipelines=4, scratch_bytes=0, cpu_slots=0, queue_limit=20,
+                 rate_limit=0, rate_window=3600):
+        self.max_pipelines = max_pipelines
+        self.scratch_bytes = scratch_bytes
+        self.cpu_slots = cpu_slots
+        self.queue_limit = queue_limit
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.running = 0
+        self.used_bytes = 0
+        self.used_slots = 0
+        self._waiters = []
+        self._requests = {}
+        self._runtime = 30.0 # moving average of pipeline seconds, for Retry-After
+        self._cond = threading.Condition()
+        self.counters = {"admitted": 0, "queued": 0, "shed": 0, "rate_limited": 0}
+
+    def _clamp(self, cost):
+        scratch, slots = cost
+        return (min(scratch, self.scratch_bytes) if self.scratch_bytes else scratch,
+                min(slots, self.cpu_slots) if self.cpu_slots else slots)
+
+    def _fits(self, cost):
+        scratch, slots = cost
+        return ((not self.max_pipelines or self.running < self.max_pipelines)
+                and (not self.scratch_bytes or self.used_bytes + scratch <= self.scratch_bytes)
+                and (not self.cpu_slots or self.used_slots + slots <= self.cpu_slots))
+
+    def retry_after(self):
+        # Caller holds _cond. Roughly how long until everyone ahead has run.
+        ahead = len(self._waiters) + 1
+        return max(1, int(self._runtime * ahead / max(self.max_pipelines, 1) + 0.5))
+
+    def acquire(self, cost, timeout=None):
+        """Wait for room for ``cost`` (scratch_bytes, cpu_slots); returns (ticket, None) or (None, retry_after)."""
+        cost = self._clamp(cost)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if not self._waiters and self._fits(cost):
+                return self._grant(cost), None
+            if self.queue_limit and len(self._waiters) >= self.queue_limit:
+                self.counters["shed"] += 1
+                return None, self.retry_after()
+            waiter = object()
+            self._waiters.append(waiter)
+            self.counters["queued"] += 1
+            try:
+                while not (self._waiters[0] is waiter and self._fits(cost)):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.counters["shed"] += 1
+                        return None, self.retry_after()
+                    self._cond.wait(remaining)
+                return self._grant(cost), None
+            finally:
+                self._waiters.remove(waiter)
+                self._cond.notify_all()
+
+    def _grant(self, cost):
+        # Caller holds _cond
+        self.running += 1
+        self.used_bytes += cost[0]
+        self.used_slots += cost[1]
+        self.counters["admitted"] += 1
+        return {"cost": cost, "started": time.monotonic()}
+
+    def release(self, ticket):
+        with self._cond:
+            self.running -= 1
+            self.used_bytes -= ticket["cost"][0]
+            self.used_slots -= ticket["cost"][1]
+            self._runtime = 0.8 * self._runtime + 0.2 * (time.monotonic() - ticket["started"])
+            self._cond.notify_all()
+
+    def average_runtime(self):
+        """Moving average of how long an admitted pipeline runs, in seconds."""
+        with self._cond:
+            return self._runtime
+
+    def rate_limited(self, email):
+        """Count a request from email; returns 0 if allowed or the seconds until it would be."""
+        if not self.rate_limit:
+            return 0
+        key = email.strip().lower()
+        now = time.monotonic()
+        with self._cond:
+            recent = [t for t in self._requests.get(key, []) if t > now - self.rate_window]
+            if len(recent) >= self.rate_limit:
+                self._requests[key] = recent
+                self.counters["rate_limited"] += 1
+                return max(1, int(recent[0] + self.rate_window - now + 0.5))
+            recent.append(now)
+            self._requests[key] = recent
+            # Forget addresses whose window has passed so the table stays small
+            for other in [k for k, times in self._requests.items() if times[-1] <= now - self.rate_window]:
+                del self._requests[other]
+            return 0
+
+    def refund(self, email):
+        """Uncount the latest request from email, for one shed or refused after rate_limited() counted it."""
+        if not self.rate_limit:
+            return
+        key = email.strip().lower()
+        with self._cond:
+            recent = self._requests.get(key)
+            if recent:
+                recent.pop()
+                if not recent:
+                    del self._requests[key]
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counters, running=self.running, waiting=len(self._waiters),
+                        scratch_bytes_reserved=self.used_bytes, cpu_slots_reserved=self.used_slots)
+
+_admission = None
+_admission_lock = threading.Lock()
+
+def get_admission_controller():
+    """Return the shared admission controller, or None when MASHUP_ADMISSION is off."""
+    global _admission
+    if not app.config['MASHUP_ADMISSION']:
+        return None
+    with _admission_lock:
+        if _admission is None:
+            _admission = AdmissionController(
+                max_pipelines=app.config['MASHUP_MAX_PIPELINES'],
+                scratch_bytes=app.config['MASHUP_SCRATCH_MAX_BYTES'],
+                cpu_slots=app.config['MASHUP_CPU_SLOTS'] or available_cores() * CPU_OVERSUBSCRIPTION,
+                queue_limit=app.config['MASHUP_ADMISSION_QUEUE'],
+                rate_limit=app.config['MASHUP_RATE_LIMIT'],
+                rate_window=app.config['MASHUP_RATE_WINDOW'])
+        return _admission
+
+def reset_admission_controller():
+    """Drop the shared controller so the next request picks up changed limits."""
+    global _admission
+    with _admission_lock:
+        _admission = None
+
+def run_admitted(singer, num_videos, dur, email, progress=None, timeout=None, on_admit=None, shared=None,
+                 checkpoint=None):
+    """run_pipeline() once there is capacity for it; returns (payload, status_code, retry_after).
+
+    retry_after is only set when the request was shed after waiting ``timeout``
+    seconds (None waits indefinitely); on_admit is called just before it runs.
+    """
+    on_admit = on_admit or (lambda: None)
+    extra = {'shared': shared} if shared else {}
+    if checkpoint:
+        extra['checkpoint'] = checkpoint
+    run = lambda: run_pipeline(singer, num_videos, dur, email, progress, **extra)
+    controller = get_admission_controller()
+    if controller is None:
+        on_admit()
+        return run() + (None,)
+    cost = estimate_cost(num_videos, dur, app.config['MASHUP_FETCH_MODE'])
+    ticket, retry_after = controller.acquire(cost, timeout)
+    if ticket is None:
+        return {"error": "The server is busy. Please try again shortly."}, 429, retry_after
+    try:
+        on_admit()
+        return run() + (None,)
+    finally:
+        controller.release(ticket)
+
+def too_many_requests(message, retry_after):
+    return jsonify({"error": message, "retry_after": retry_after}), 429, {'Retry-After': str(retry_after)}
+
+def job_queue_retry_after():
+    # A full job queue has room again once one of the job workers finishes its pipeline
+    controller = get_admission_controller()
+    runtime = controller.average_runtime() if controller else 30.0
+    return max(1, int(runtime / max(app.config['MASHUP_JOB_WORKERS'], 1) + 0.5))
+
+# --- Job Store ---
+# With MASHUP_JOB_STORE set, jobs are rows in a SQLite database instead of
+# entries in this process's memory. Web processes only enqueue them; worker
+# processes (`python project.py worker`) claim them under expiring leases and
+# checkpoint each finished stage, so a job whose worker died is picked up by
+# another one and resumed after its last completed stage.
+
+JOB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    batch_id TEXT,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    checkpoints TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    status_code INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_by_batch ON jobs (batch_id);
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    items TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+def _batch_order(items):
+    # Biggest first, so smaller items for the same singer reuse its search
+    return sorted(items, key=lambda item: -item['num_videos'])
+
+class JobStore:
+    """Jobs and batches in a SQLite database shared by any number of processes on one host.
+
+    A worker claims a job by taking a lease on it, renewed with heartbeat()
+    while the job runs. Once a lease runs out the job goes to the next worker
+    that asks, up to ``max_attempts`` claims; after that reap() fails it.
+    Writes by a worker that has lost its lease are ignored.
+    """
+
+    def __init__(self, path, lease_seconds=60, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._db().executescript(JOB_SCHEMA)
+
+    def _db(self):
+        # One connection per thread, and a new one in a forked worker process
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            # Readers don't block the writer, so status polls never stall a claim
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    @staticmethod
+    def _job(row):
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['checkpoints'] = json.loads(job['checkpoints'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def _insert(self, db, params, batch_id=None):
+        job_id = uuid.uuid4().hex
+        db.execute("INSERT INTO jobs (id, batch_id, params, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                   (job_id, batch_id, json.dumps(params), time.time()))
+        return job_id
+
+    def enqueue(self, params, limit=None):
+        """Add a job running ``params``; returns its id, or None if ``limit`` jobs are already active."""
+        with self._transaction() as db:
+            if limit is not None and self._active(db) >= limit:
+                return None
+            return self._insert(db, params)
+
+    def enqueue_batch(self, items, limit=None):
+        """Store a batch, queueing a job for every item with ``num_videos``; returns the batch id.
+
+        Each runnable item gets its ``job_id``. Returns None, queueing nothing,
+        if the batch would take the active jobs over ``limit``.
+        """
+        runnable = [item for item in items if 'num_videos' in item]
+        with self._transaction() as db:
+            if limit is not None and self._active(db) + len(runnable) > limit:
+                return None
+            batch_id = uuid.uuid4().hex
+            for item in _batch_order(runnable):
+                item['job_id'] = self._insert(db, {k: item[k] for k in ('singer', 'num_videos', 'dur', 'email')},
+                                              batch_id)
+            db.execute("INSERT INTO batches (id, items, created_at) VALUES (?, ?, ?)",
+                       (batch_id, json.dumps(items), time.time()))
+            return batch_id
+
+    def claim(self, worker):
+        """Lease the oldest queued job, or one whose lease ran out, to ``worker``; returns it or None."""
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute("SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?"
+                             " AND attempts < ?) ORDER BY created_at LIMIT 1", (now, self.max_attempts)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE jobs SET status = 'running', worker = ?, lease_expires = ?, attempts = attempts + 1"
+                       " WHERE id = ?", (worker, now + self.lease_seconds, row['id']))
+            return self._job(db.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone())
+
+    def reap(self):
+        """Fail jobs whose lease ran out on their last allowed attempt; returns their ids."""
+        with self._transaction() as db:
+            rows = db.execute("SELECT id FROM jobs WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                              (time.time(), self.max_attempts)).fetchall()
+            result = json.dumps({"error": "The job was abandoned after its workers stopped responding."})
+            for row in rows:
+                db.execute("UPDATE jobs SET status = 'failed', result = ?, status_code = 500, worker = NULL,"
+                           " lease_expires = NULL, finished_at = ? WHERE id = ?", (result, time.time(), row['id']))
+            return [row['id'] for row in rows]
+
+    def _owned(self, sql, params, job_id, worker):
+        # Only the worker holding the lease may change a running job
+        cursor = self._db().execute(f"{sql} WHERE id = ? AND worker = ? AND status = 'running'",
+                                    params + (job_id, worker))
+        return cursor.rowcount == 1
+
+    def heartbeat(self, job_id, worker):
+        """Extend worker's lease on job_id; False once the lease has passed to someone else."""
+        return self._owned("UPDATE jobs SET lease_expires = ?", (time.time() + self.lease_seconds,), job_id, worker)
+
+    def set_stage(self, job_id, worker, stage):
+        return self._owned("UPDATE jobs SET stage = ?", (stage,), job_id, worker)
+
+    def save_checkpoint(self, job_id, worker, checkpoints):
+        return self._owned("UPDATE jobs SET checkpoints = ?", (json.dumps(checkpoints),), job_id, worker)
+
+    def finish(self, job_id, worker, payload, status_code):
+        """Record a job's result; False (and nothing recorded) if worker no longer holds its lease."""
+        return self._owned("UPDATE jobs SET status = ?, result = ?, status_code = ?, lease_expires = NULL,"
+                           " finished_at = ?", ('done' if status_code == 200 else 'failed', json.dumps(payload),
+                                                status_code, time.time()), job_id, worker)
+
+    def cancel(self, job_id):
+        """Drop a job no worker has claimed yet; False if one already has."""
+        return self._db().execute("DELETE FROM jobs WHERE id = ? AND status = 'queued'", (job_id,)).rowcount == 1
+
+    def get(self, job_id):
+        row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def get_batch(self, batch_id):
+        """Return (batch, jobs by id) for batch_id, or (None, None)."""
+        db = self._db()
+        row = db.execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        if row is None:
+            return None, None
+        jobs = {job['id']: job for job in map(self._job, db.execute("SELECT * FROM jobs WHERE batch_id = ?",
+                                                                     (batch_id,)))}
+        return {"id": batch_id, "items": json.loads(row['items']), "created_at": row['created_at']}, jobs
+
+    @staticmethod
+    def _active(db):
+        return db.execute("SELECT COUNT(*) FROM jobs WHERE finished_at IS NULL").fetchone()[0]
+
+    def stats(self):
+        """Jobs queued or running across every process using the store."""
+        counts = dict(self._db().execute("SELECT status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+                                         " GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in ('queued', 'running')}
+
+    def prune(self, retention):
+        """Delete jobs finished more than ``retention`` seconds ago, and batches with none left running."""
+        cutoff = time.time() - retention
+        with self._transaction() as db:
+            db.execute("DELETE FROM jobs WHERE finished_at < ?", (cutoff,))
+            db.execute("DELETE FROM batches WHERE created_at < ? AND NOT EXISTS"
+                       " (SELECT 1 FROM jobs WHERE jobs.batch_id = batches.id AND jobs.finished_at IS NULL)",
+                       (cutoff,))
+
+_job_store = None
+_job_store_lock = threading.Lock()
+
+def get_job_store():
+    """Return the shared JobStore, or None when jobs run on this process's thread pool."""
+    global _job_store
+    path = app.config['MASHUP_JOB_STORE']
+    if not path:
+        return None
+    with _job_store_lock:
+        if _job_store is None or _job_store.path != path:
+            _job_store = JobStore(path, app.config['MASHUP_JOB_LEASE'], app.config['MASHUP_JOB_MAX_ATTEMPTS'])
+        return _job_store
+
+def job_work_dir(job_id):
+    return os.path.join(app.config['MASHUP_JOB_WORK_DIR'], job_id)
+
+class LeaseLost(Exception):
+    """Raised in a stored job's pipeline once another worker has taken the job over."""
+
+class JobCheckpoint:
+    """The stages a claimed job has finished, saved to the store as each one completes.
+
+    Each attempt works in its own ``work_dir``. The files a stage needs to be
+    resumed from are linked into the job's ``kept_dir``, so an attempt cleaning
+    up after itself never deletes what another attempt is working from. Once
+    the lease is lost, report(), save() and check() raise LeaseLost.
+    """
+
+    def __init__(self, store, job, worker):
+        self.store = store
+        self.job_id = job['id']
+        self.worker = worker
+        self.stages = dict(job['checkpoints'])
+        self.work_dir = os.path.join(job_work_dir(self.job_id), f"attempt-{job['attempts']}")
+        self.kept_dir = os.path.join(job_work_dir(self.job_id), 'kept')
+        self.lost = threading.Event()
+
+    def get(self, stage):
+        return self.stages.get(stage)
+
+    def _lose(self):
+        self.lost.set()
+        raise LeaseLost(f"Job {self.job_id} is no longer leased to {self.worker}.")
+
+    def check(self):
+        """Raise LeaseLost unless this worker still holds the job's lease."""
+        if self.lost.is_set() or not self.store.heartbeat(self.job_id, self.worker):
+            self._lose()
+
+    def report(self, stage):
+        if self.lost.is_set() or not self.store.set_stage(self.job_id, self.worker, stage):
+            self._lose()
+
+    def save(self, stage, files=(), **data):
+        """Record ``stage`` as finished, keeping ``files`` for the attempts after this one."""
+        self.check()
+        if files:
+            os.makedirs(self.kept_dir, exist_ok=True)
+            for path in files:
+                kept = os.path.join(self.kept_dir, os.path.basename(path))
+                tmp_path = f"{kept}.{uuid.uuid4().hex}.tmp"
+                _link_or_copy(path, tmp_path)
+                os.replace(tmp_path, kept)
+            data['files'] = [os.path.basename(path) for path in files]
+        self.stages[stage] = data
+        if not self.store.save_checkpoint(self.job_id, self.worker, self.stages):
+            self._lose()
+
+    def restore(self, stage, work_dir):
+        """Link the files kept for ``stage`` into work_dir; returns their paths, or None if any is gone."""
+        names = (self.stages.get(stage) or {}).get('files')
+        if not names:
+            return None
+        os.makedirs(work_dir, exist_ok=True)
+        paths = []
+        for name in names:
+            try:
+                _link_or_copy(os.path.join(self.kept_dir, name), os.path.join(work_dir, name))
+            except FileNotFoundError:
+                for path in paths:
+                    _discard(path)
+                return None
+            paths.append(os.path.join(work_dir, name))
+        return paths
+
+class JobWorker:
+    """Runs jobs claimed from a JobStore on ``threads`` threads until stop() is called."""
+
+    def __init__(self, store, threads=1, poll_interval=None):
+        self.store = store
+        self.threads = threads
+        self.poll_interval = app.config['MASHUP_JOB_POLL'] if poll_interval is None else poll_interval
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping = threading.Event()
+
+    def run_once(self, worker=None):
+        """Claim and run one job; returns False if there was none to claim."""
+        worker = worker or f"{self.name}:{threading.current_thread().name}"
+        for job_id in self.store.reap():
+            shutil.rmtree(job_work_dir(job_id), ignore_errors=True)
+        job = self.store.claim(worker)
+        if job is None:
+            return False
+        job_id, params = job['id'], job['params']
+        if job['attempts'] > 1:
+            print(f"Resuming job {job_id} (attempt {job['attempts']}) after {list(job['checkpoints']) or 'no stages'}")
+
+        checkpoint = JobCheckpoint(self.store, job, worker)
+        finished = threading.Event()
+        def renew():
+            while not finished.wait(self.store.lease_seconds / 3):
+                if not self.store.heartbeat(job_id, worker):
+                    # The pipeline stops at its next stage, checkpoint or delivery
+                    print(f"Lost the lease on job {job_id}")
+                    checkpoint.lost.set()
+                    return
+        threading.Thread(target=renew, name=f'lease-{job_id[:8]}', daemon=True).start()
+        try:
+            with app.app_context():
+                payload, status_code, _ = run_admitted(
+                    params['singer'], params['num_videos'], params['dur'], params['email'],
+                    progress=checkpoint.report, checkpoint=checkpoint)
+        except Exception as e:
+            print(f"Job {job_id} crashed: {e}")
+            payload, status_code = {"error": str(e)}, 500
+        finally:
+            finished.set()
+        if self.store.finish(job_id, worker, payload, status_code):
+            shutil.rmtree(job_work_dir(job_id), ignore_errors=True)
+        else:
+            print(f"Job {job_id} was taken over by another worker; dropping this attempt's result")
+        return True
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                ran = self.run_once()
+            except sqlite3.Error as e:
+                print(f"Job store error: {e}")
+                ran = False
+            if not ran:
+                self._stopping.wait(self.poll_interval)
+
+    def run(self):
+        """Work until stop(); running jobs finish first, so a stopped worker leaves nothing to recover."""
+        threads = [threading.Thread(target=self._loop, name=f'mashup-worker-{i}') for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        self._stopping.set()
+
+def run_worker(threads):
+    """Entry point of one worker process."""
+    # Mail queued in memory would be lost with the process after the job was marked delivered
+    app.config['MASHUP_MAIL_QUEUE'] = False
+    worker = JobWorker(get_job_store(), threads)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    print(f"Worker {worker.name} running {threads} job threads from {app.config['MASHUP_JOB_STORE']}")
+    worker.run()
+
+# --- Job Mode ---
+# A POST with mode=async returns a job id straight away; the pipeline runs on a
+# fixed pool of worker threads and progress is reported per stage. With a job
+# store configured the job is enqueued there for worker processes instead.
+
+_job_executor = None
+_jobs = {}
+_batches = {}
+_jobs_cond = threading.Condition()
+
+def _get_job_executor():
+    global _job_executor
+    with _jobs_cond:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(max_workers=app.config['MASHUP_JOB_WORKERS'],
+                                               thread_name_prefix='mashup-job')
+        return _job_executor
+
+def _prune_jobs():
+    # Caller holds _jobs_cond
+    cutoff = time.time() - app.config['MASHUP_JOB_RETENTION']
+    for job_id in [j for j, job in _jobs.items() if job['finished_at'] and job['finished_at'] < cutoff]:
+        del _jobs[job_id]
+    for batch_id in [b for b, batch in _batches.items() if batch['finished_at'] and batch['finished_at'] < cutoff]:
+        del _batches[batch_id]
+
+def _job_event(job, event, **data):
+    # Caller holds _jobs_cond
+    job['events'].append({"event": event, "data": data})
+    _jobs_cond.notify_all()
+
+def _update_job(job_id, event, **fields):
+    with _jobs_cond:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        job.update(fields)
+        _job_event(job, event, status=job['status'], stage=job['stage'])
+
+def _mail_failed(job_id, error):
+    # A queued email for the job was given up on, so the mashup never reached anyone
+    with _jobs_cond:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        job['mail_error'] = f"Failed to send email: {error}"
+        if job['finished_at']:
+            job.update(status='failed', result={"error": job['mail_error']}, status_code=500)
+            _job_event(job, 'mail_failed', status=job['status'], result=job['result'])
+
+def _run_job(job_id, singer, num_videos, dur, email, shared=None):
+    token = _mail_failure_hook.set(lambda error: _mail_failed(job_id, error))
+    try:
+        _run_job_pipeline(job_id, singer, num_videos, dur, email, shared)
+    finally:
+        _mail_failure_hook.reset(token)
+
+def _run_job_pipeline(job_id, singer, num_videos, dur, email, shared=None):
+    try:
+        # Building mail messages needs an application context
+        with app.app_context():
+            # Already queued, so wait for capacity for as long as it takes
+            payload, status_code, _ = run_admitted(
+                singer, num_videos, dur, email,
+                progress=lambda stage: _update_job(job_id, 'stage', stage=stage),
+                on_admit=lambda: _update_job(job_id, 'status', status='running'), shared=shared)
+    except Exception as e:
+        print(f"Job {job_id} crashed: {e}")
+        payload, status_code = {"error": str(e)}, 500
+    with _jobs_cond:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        if job['mail_error'] and status_code == 200:
+            payload, status_code = {"error": job['mail_error']}, 500
+        job.update(status='done' if status_code == 200 else 'failed',
+                   result=payload, status_code=status_code, finished_at=time.time())
+        _job_event(job, 'done', status=job['status'], result=payload)
+        batch = _batches.get(job['batch_id'])
+        if batch is None:
+            return
+        batch['remaining'] -= 1
+        if batch['remaining'] == 0:
+            batch['finished_at'] = time.time()
+            batch['shared'].close()
+
+def _active_jobs():
+    # Caller holds _jobs_cond
+    return sum(1 for job in _jobs.values() if not job['finished_at'])
+
+def _new_job(batch_id=None):
+    # Caller holds _jobs_cond
+    job_id = uuid.uuid4().hex
+    _jobs[job_id] = {
+        "id": job_id, "status": "queued", "stage": None, "result": None, "batch_id": batch_id,
+        "status_code": None, "events": [], "created_at": time.time(), "finished_at": None, "mail_error": None,
+    }
+    _job_event(_jobs[job_id], 'status', status='queued', stage=None)
+    return job_id
+
+def submit_job(singer, num_videos, dur, email):
+    """Queue a pipeline run and return its job id, or None if the queue is full."""
+    store = get_job_store()
+    if store:
+        store.prune(app.config['MASHUP_JOB_RETENTION'])
+        return store.enqueue({"singer": singer, "num_videos": num_videos, "dur": dur, "email": email},
+                             app.config['MASHUP_JOB_QUEUE_LIMIT'])
+    with _jobs_cond:
+        _prune_jobs()
+        if _active_jobs() >= app.config['MASHUP_JOB_QUEUE_LIMIT']:
+            return None
+        job_id = _new_job()
+    _get_job_executor().submit(_run_job, job_id, singer, num_videos, dur, email)
+    return job_id
+
+def run_stored(singer, num_videos, dur, email, timeout=None):
+    """Enqueue a job in the store and wait for a worker to run it, like run_admitted().
+
+    A job no worker has claimed within ``timeout`` seconds is withdrawn and
+    reported as shed, with a Retry-After of that timeout.
+    """
+    busy = {"error": "The server is busy. Please try again shortly."}
+    retry_after = max(1, int(timeout or 1))
+    job_id = submit_job(singer, num_videos, dur, email)
+    if job_id is None:
+        return busy, 429, retry_after
+    store = get_job_store()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        job = store.get(job_id)
+        if job is None:
+            return {"error": "The job was lost."}, 500, None
+        if job['finished_at']:
+            return job['result'], job['status_code'], None
+        if job['status'] == 'queued' and deadline is not None and time.monotonic() >= deadline and store.cancel(job_id):
+            return busy, 429, retry_after
+        time.sleep(app.config['MASHUP_JOB_POLL'])
+
+def get_job(job_id):
+    store = get_job_store()
+    if store:
+        job = store.get(job_id)
+        if job is None:
+            return None
+        return {k: job[k] for k in ('id', 'status', 'stage', 'result', 'created_at', 'finished_at')}
+    with _jobs_cond:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        return {k: job[k] for k in ('id', 'status', 'stage', 'result', 'created_at', 'finished_at')}
+
+def _iter_stored_job_events(job_id, keepalive):
+    # Other processes run stored jobs, so poll the store and report what changed
+    status = stage = None
+    idle = 0
+    while True:
+        job = get_job(job_id)
+        if job is None:
+            return
+        data = json.dumps({"status": job['status'], "stage": job['stage']})
+        if job['status'] != status and not job['finished_at']:
+            yield f"event: status\ndata: {data}\n\n"
+            idle = 0
+        if job['stage'] != stage and job['stage']:
+            yield f"event: stage\ndata: {data}\n\n"
+            idle = 0
+        status, stage = job['status'], job['stage']
+        if job['finished_at']:
+            yield f"event: done\ndata: {json.dumps({'status': job['status'], 'result': job['result']})}\n\n"
+            return
+        if idle >= keepalive:
+            yield ": keepalive\n\n"
+            idle = 0
+        time.sleep(app.config['MASHUP_JOB_POLL'])
+        idle += app.config['MASHUP_JOB_POLL']
+
+def iter_job_events(job_id, keepalive=15):
+    """Yield server-sent event frames for a job until it finishes."""
+    if get_job_store():
+        yield from _iter_stored_job_events(job_id, keepalive)
+        return
+    index = 0
+    while True:
+        with _jobs_cond:
+            job = _jobs.get(job_id)
+            if job is None:
+                return
+            if index >= len(job['events']) and not job['finished_at']:
+                _jobs_cond.wait(timeout=keepalive)
+            events = job['events'][index:]
+            index += len(events)
+            finished = job['finished_at'] is not None
+        if not events and not finished:
+            yield ": keepalive\n\n"
+        for item in events:
+            yield f"event: {item['event']}\ndata: {json.dumps(item['data'])}\n\n"
+        if finished and index >= len(job['events']):
+            return
+
+# --- Batch Mode ---
+# POST /batches queues one job per (singer, count, duration, email) item on the
+# shared job pool. Items in a batch share one search cache, audio cache and
+# result cache, so repeated singers are searched once and identical items are
+# built once and delivered to each address.
+
+class SharedWork:
+    """The caches a batch's jobs share, borrowed from the server where it has them.
+
+    Caches the server runs without are created for the batch under a scratch
+    directory that close() removes once its last job has finished.
+    """
+
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='mashup-batch-')
+        # Long enough to outlive the batch however slowly its queue drains
+        self.search_cache = get_search_cache() or SearchCache(24 * 3600)
+        self.audio_cache = get_audio_cache() or AudioCache(
+            os.path.join(self.root, 'audio'), app.config['MASHUP_CACHE_MAX_BYTES'])
+        self.result_cache = get_result_cache() or ResultCache(
+            os.path.join(self.root, 'results'), app.config['MASHUP_RESULT_CACHE_MAX_BYTES'])
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+def submit_batch(items):
+    """Queue a job for every item dict with ``num_videos``; returns the batch id, or None if the queue is full.
+
+    Items without ``num_videos`` (rejected during validation) are kept as they
+    are so the batch reports a status for every submitted item.
+    """
+    store = get_job_store()
+    if store:
+        # Workers in other processes can't share this one's caches; they use their own server-wide ones
+        store.prune(app.config['MASHUP_JOB_RETENTION'])
+        return store.enqueue_batch(items, app.config['MASHUP_BATCH_QUEUE_LIMIT'])
+    runnable = [item for item in items if 'num_videos' in item]
+    shared = SharedWork()
+    with _jobs_cond:
+        _prune_jobs()
+        if _active_jobs() + len(runnable) > app.config['MASHUP_BATCH_QUEUE_LIMIT']:
+            shared.close()
+            return None
+        batch_id = uuid.uuid4().hex
+        for item in runnable:
+            item['job_id'] = _new_job(batch_id)
+        _batches[batch_id] = {"id": batch_id, "items": items, "shared": shared, "remaining": len(runnable),
+                              "created_at": time.time(), "finished_at": None if runnable else time.time()}
+    if not runnable:
+        shared.close()
+    executor = _get_job_executor()
+    for item in _batch_order(runnable):
+        executor.submit(_run_job, item['job_id'], item['singer'], item['num_videos'], item['dur'],
+                        item['email'], shared)
+    return batch_id
+
+def _batch_items(items, jobs):
+    entries = []
+    for item in items:
+        entry = {k: item[k] for k in ('index', 'singer', 'email', 'status', 'error', 'retry_after', 'job_id')
+                 if k in item}
+        job = jobs.get(item.get('job_id'))
+        if job:
+            entry.update(status=job['status'], stage=job['stage'], result=job['result'])
+        entries.append(entry)
+    return entries
+
+def get_batch(batch_id):
+    store = get_job_store()
+    if store:
+        batch, jobs = store.get_batch(batch_id)
+        if batch is None:
+            return None
+        finished = [job['finished_at'] for job in jobs.values()]
+        finished_at = max(finished, default=batch['created_at']) if None not in finished else None
+        return {"id": batch_id, "status": 'done' if finished_at else 'running', "created_at": batch['created_at'],
+                "finished_at": finished_at, "items": _batch_items(batch['items'], jobs)}
+    with _jobs_cond:
+        batch = _batches.get(batch_id)
+        if batch is None:
+            return None
+        return {"id": batch_id, "status": 'done' if batch['finished_at'] else 'running',
+                "created_at": batch['created_at'], "finished_at": batch['finished_at'],
+                "items": _batch_items(batch['items'], _jobs)}
+
+@app.route('/generate_mashup', methods=['POST'])
+def generate_mashup():
+    singer = request.form.get('singer', '').strip()
+    number_of_videos = request.form.get('number_of_videos')
+    duration = request.form.get('duration', '10')
+    email = request.form.get('email', '').strip()
+    mode = request.form.get('mode', request.args.get('mode', 'sync'))
+
+    is_valid, error_message, parsed_values = valid_input(singer, number_of_videos, duration, email)
+    if not is_valid:
+        return jsonify({"error": error_message}), 400
+
+    num_videos, dur = parsed_values
+
+    controller = get_admission_controller()
+    retry_after = controller.rate_limited(email) if controller else 0
+    if retry_after:
+        return too_many_requests("Too many mashups requested for this email. Please try again later.", retry_after)
+
+    # Only requests that get to run (or are queued to) count against the address's quota
+    refund = lambda: controller.refund(email) if controller else None
+    if mode == 'async':
+        job_id = submit_job(singer, num_videos, dur, email)
+        if job_id is None:
+            refund()
+            return too_many_requests("Too many mashups in progress. Please try again shortly.", job_queue_retry_after())
+        return jsonify({
+            "job_id": job_id,
+            "status_url": url_for('job_status', job_id=job_id),
+            "events_url": url_for('job_events', job_id=job_id),
+        }), 202
+
+    run = run_stored if get_job_store() else run_admitted
+    payload, status_code, retry_after = run(singer, num_videos, dur, email, timeout=app.config['MASHUP_ADMISSION_WAIT'])
+    if retry_after:
+        refund()
+        return too_many_requests(payload["error"], retry_after)
+    return jsonify(payload), status_code
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify(job), 200
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    if get_job(job_id) is None:
+        return jsonify({"error": "Job not found."}), 404
+    return Response(stream_with_context(iter_job_events(job_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/batches', methods=['POST'])
+def create_batch():
+    body = request.get_json(silent=True) or {}
+    specs = body.get('items')
+    if not isinstance(specs, list) or not specs:
+        return jsonify({"error": "Provide a non-empty list of items."}), 400
+    if len(specs) > app.config['MASHUP_BATCH_MAX_ITEMS']:
+        return jsonify({"error": f"A batch can hold at most {app.config['MASHUP_BATCH_MAX_ITEMS']} items."}), 400
+
+    controller = get_admission_controller()
+    counted = []
+    items = []
+    for index, spec in enumerate(specs):
+        spec = spec if isinstance(spec, dict) else {}
+        singer = str(spec.get('singer', '')).strip()
+        email = str(spec.get('email', body.get('email', ''))).strip()
+        item = {"index": index, "singer": singer, "email": email}
+        items.append(item)
+        checked = valid_input(singer, str(spec.get('number_of_videos', '')), str(spec.get('duration', '10')), email)
+        is_valid, error_message, parsed_values = checked or (False, "Number of videos and duration must be numbers.", None)
+        if not is_valid:
+            item.update(status='invalid', error=error_message)
+            continue
+        # Every item counts against its address's rate limit, as it would posted on its own
+        retry_after = controller.rate_limited(email) if controller else 0
+        if retry_after:
+            item.update(status='rejected', error="Too many mashups requested for this email.",
+                        retry_after=retry_after)
+            continue
+        counted.append(email)
+        item.update(status='queued', num_videos=parsed_values[0], dur=parsed_values[1])
+
+    if not any(item['status'] == 'queued' for item in items):
+        return jsonify({"error": "No item in the batch can be run.",
+                        "items": [{k: v for k, v in item.items() if k not in ('num_videos', 'dur')} for item in items]}), 400
+    batch_id = submit_batch(items)
+    if batch_id is None:
+        for email in counted:
+            controller.refund(email)
+        return too_many_requests("Too many mashups in progress. Please try again shortly.", job_queue_retry_after())
+    batch = get_batch(batch_id)
+    # Named like the job_id an async mashup returns; the status URL serves the batch as "id", as /jobs does
+    batch["batch_id"] = batch.pop("id")
+    batch["status_url"] = url_for('batch_status', batch_id=batch_id)
+    return jsonify(batch), 202
+
+@app.route('/batches/<batch_id>')
+def batch_status(batch_id):
+    batch = get_batch(batch_id)
+    if batch is None:
+        return jsonify({"error": "Batch not found."}), 404
+    return jsonify(batch), 200
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Audio mashup generator")
+    commands = parser.add_subparsers(dest='command')
+    worker_parser = commands.add_parser('worker', help="Run jobs from the MASHUP_JOB_STORE database")
+    worker_parser.add_argument('--processes', type=int, default=1, help="Worker processes to start")
+    worker_parser.add_argument('--threads', type=int, default=app.config['MASHUP_JOB_WORKERS'],
+                               help="Jobs each process runs at once")
+    args = parser.parse_args(argv)
+
+    if args.command == 'worker':
+        if not app.config['MASHUP_JOB_STORE']:
+            parser.error("set MASHUP_JOB_STORE to the job database the web processes enqueue into")
+        if args.processes == 1:
+            run_worker(args.threads)
+            return
+        processes = [multiprocessing.Process(target=run_worker, args=(args.threads,), name=f'mashup-worker-{i}')
+                     for i in range(args.processes)]
+        for process in processes:
+            process.start()
+
+        def forward(signum, frame):
+            # A service manager only signals this process; pass it on so every worker drains its jobs
+            for process in processes:
+                if process.is_alive():
+                    os.kill(process.pid, signum)
+        signal.signal(signal.SIGTERM, forward)
+        # Terminal Ctrl-C already reaches the whole process group, so the workers get that one themselves
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for process in processes:
+            process.join()
+        return
+
     os.makedirs('static', exist_ok=True)
     app.run(debug=True)
 
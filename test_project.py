@@ -1,8 +1,29 @@
 import pytest
 import os
+import re
+import json
+import time
+import shutil
+import zipfile
 import tempfile
+import threading
+import signal
+import subprocess
+import sys
+import socketserver
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 from unittest.mock import patch, MagicMock
+from flask import Flask
+from flask_mail import Mail, Message
+import project
 from project import app, valid_input, download_video, convert, cut_audio, mashup, create_zip, send_email
+from project import ExtractorPool, reset_extractor_pools, cut_audio_batch, mashup_ffmpeg, AudioCache, SearchCache, ResultCache, MailDispatcher
+from project import MetricsRegistry, stage_timer, IncrementalRanker, decode_segment, stream_mashup
+from project import PcmMixer, decode_pcm, PCM_RATE, AdmissionController, estimate_cost, reset_admission_controller
+from project import plan_output, plan_delivery, PROFILES_BY_NAME, copy_mashup, probe_audio
+from project import JobStore, JobWorker, JobCheckpoint
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
 
 @pytest.fixture
 def client():
@@ -11,6 +32,208 @@ def client():
     with app.test_client() as client:
         yield client
 
+@pytest.fixture(autouse=True)
+def fresh_extractor_pools(monkeypatch):
+    # Pooled extractors would otherwise outlive each test's YoutubeDL mock,
+    # and the shared audio cache would leak files between tests
+    monkeypatch.setitem(app.config, 'MASHUP_CACHE_DIR', '')
+    monkeypatch.setitem(app.config, 'MASHUP_SEARCH_CACHE_TTL', 0)
+    monkeypatch.setitem(app.config, 'MASHUP_RESULT_CACHE_DIR', '')
+    monkeypatch.setitem(app.config, 'MASHUP_MAIL_QUEUE', False)
+    reset_extractor_pools()
+    reset_admission_controller()
+    yield
+    reset_extractor_pools()
+
+class FakeExtractor:
+    """Stands in for yt_dlp.YoutubeDL with simulated latency and per-URL failures."""
+
+    def __init__(self, entries=None, latency=0, failures=None, media=None):
+        # One fake backs every pooled slot, so keep params per thread
+        self._local = threading.local()
+        self.entries = entries or []
+        self.media = media or {}
+        self.latency = latency
+        self.failures = dict(failures or {})
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.downloads = 0
+
+    @property
+    def params(self):
+        if not hasattr(self._local, 'params'):
+            self._local.params = {}
+        return self._local.params
+
+    def extract_info(self, query, download=False, process=True):
+        if query.startswith('ytsearch'):
+            return {'entries': self.entries}
+        return self.media.get(query, {})
+
+    def download(self, urls):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(self.latency)
+            with self.lock:
+                remaining = self.failures.get(urls[0], 0)
+                if remaining:
+                    self.failures[urls[0]] = remaining - 1
+                    raise Exception("simulated network error")
+            self.downloads += 1
+            template = self.params['outtmpl']['default']
+            entry = next(e for e in self.entries if e['url'] == urls[0])
+            with open(template % {'title': entry['title'], 'ext': 'webm'}, 'w') as f:
+                f.write(entry['title'])
+        finally:
+            with self.lock:
+                self.active -= 1
+
+def fake_entries(count):
+    return [{'uploader': 'Singer VEVO', 'title': f'Song {i}', 'view_count': 100 - i, 'url': f'http://vid{i}', 'id': f'vid{i}'}
+            for i in range(count)]
+
+def make_tone(path, seconds, frequency=440, loops=0):
+    # Encode the tone once, then repeat it with stream copy to build long fixtures cheaply
+    tone = path + '.tone.m4a'
+    subprocess.run(['ffmpeg', '-v', 'quiet', '-y', '-f', 'lavfi', '-i', f'sine=frequency={frequency}:duration={seconds}',
+                    '-c:a', 'aac', '-b:a', '128k', tone], check=True)
+    subprocess.run(['ffmpeg', '-v', 'quiet', '-y', '-stream_loop', str(loops), '-i', tone,
+                    '-c', 'copy', '-movflags', '+faststart', path], check=True)
+    os.remove(tone)
+
+def media_duration(path):
+    output = subprocess.run(['ffmpeg', '-i', path], capture_output=True, text=True).stderr
+    hours, minutes, seconds = re.search(r'Duration: (\d+):(\d+):([\d.]+)', output).groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler with single-range support, counting the bytes it serves."""
+    bytes_sent = 0
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if not match or not os.path.isfile(path):
+            return super().send_head()
+        size = os.path.getsize(path)
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+        f = open(path, 'rb')
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', 'audio/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self.range_remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, 'range_remaining', None)
+        while remaining is None or remaining > 0:
+            chunk = source.read(64 * 1024 if remaining is None else min(64 * 1024, remaining))
+            if not chunk:
+                break
+            try:
+                outputfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                break
+            type(self).bytes_sent += len(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """Just enough SMTP to accept mail, optionally rejecting the first few messages."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, reject_first=0):
+        super().__init__(('127.0.0.1', 0), SMTPStandInHandler)
+        self.reject_first = reject_first
+        self.messages = []
+        self.connections = 0
+        self.lock = threading.Lock()
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 stand-in ESMTP')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            command = line.split(' ', 1)[0].upper()
+            if command in ('EHLO', 'HELO'):
+                self.reply('250 stand-in')
+            elif command == 'DATA':
+                self.reply('354 go ahead')
+                data = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if data_line in (b'.\r\n', b''):
+                        break
+                    data.append(data_line)
+                with server.lock:
+                    rejected = server.reject_first > 0
+                    if rejected:
+                        server.reject_first -= 1
+                    else:
+                        server.messages.append(b''.join(data))
+                self.reply('451 try again later' if rejected else '250 queued')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+@pytest.fixture
+def smtp_server():
+    servers = []
+    def start(reject_first=0):
+        server = SMTPStandIn(reject_first)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        mail_app = Flask('smtp-stand-in')
+        mail_app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=server.server_address[1], MAIL_USE_TLS=False,
+                               MAIL_DEFAULT_SENDER='mashup@example.com')
+        return server, mail_app, Mail(mail_app)
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+@pytest.fixture
+def media_server():
+    root = tempfile.mkdtemp()
+    RangeRequestHandler.bytes_sent = 0
+    handler = lambda *args, **kwargs: RangeRequestHandler(*args, directory=root, **kwargs)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield root, f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    shutil.rmtree(root)
+
 # --- Unit Tests ---
 
 def test_valid_input():
@@ -48,6 +271,219 @@ def test_download_video_failure(mock_dl):
         count = download_video("Singer", 3, temp_dir, max_retries=1, retry_delay=0)
         assert count == 0
 
+def test_download_video_concurrent_with_pooled_extractors():
+    fake = FakeExtractor(fake_entries(4), latency=0.2)
+    created = []
+    def factory(opts):
+        created.append(opts)
+        return fake
+
+    pool = ExtractorPool({}, size=4, factory=factory)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        start = time.monotonic()
+        count = download_video("Singer", 4, temp_dir, concurrency=4, search_pool=pool, download_pool=pool)
+        elapsed = time.monotonic() - start
+        assert count == 4
+        assert len(os.listdir(temp_dir)) == 4
+    assert fake.peak > 1
+    assert elapsed < 0.6 # serial downloads would take at least 0.8s
+
+    # A second request reuses the warm instances instead of building new ones
+    created_before = len(created)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        assert download_video("Singer", 1, temp_dir, search_pool=pool, download_pool=pool) == 1
+    assert len(created) == created_before
+
+def test_download_video_retries_per_track():
+    fake = FakeExtractor(fake_entries(3), failures={'http://vid0': 1, 'http://vid1': 5})
+    pool = ExtractorPool({}, factory=lambda opts: fake)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        count = download_video("Singer", 3, temp_dir, max_retries=2, retry_delay=0,
+                               search_pool=pool, download_pool=pool)
+    # vid0 recovers on its second attempt, vid1 keeps failing past max_retries
+    assert count == 2
+    assert fake.failures == {'http://vid0': 0, 'http://vid1': 3}
+
+@requires_ffmpeg
+def test_download_video_fetches_only_the_segment(media_server):
+    root, base_url = media_server
+    make_tone(os.path.join(root, 'long.m4a'), 60, loops=59) # one hour of audio
+    full_size = os.path.getsize(os.path.join(root, 'long.m4a'))
+    media = {'http://vid0': {'url': f'{base_url}/long.m4a', 'ext': 'm4a', 'protocol': 'http'}}
+    fake = FakeExtractor(fake_entries(1), media=media)
+    pool = ExtractorPool({}, factory=lambda opts: fake)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        count = download_video("Singer", 1, temp_dir, search_pool=pool, download_pool=pool, segment=(20, 10))
+        assert count == 1
+        assert os.listdir(temp_dir) == ['01_vid0.segment.m4a']
+        assert abs(media_duration(os.path.join(temp_dir, '01_vid0.segment.m4a')) - 10) < 1
+    assert RangeRequestHandler.bytes_sent < full_size / 4
+
+def test_download_video_segment_falls_back_to_full_download():
+    # No direct media URL to seek into, so the whole track is downloaded
+    fake = FakeExtractor(fake_entries(2), media={'http://vid0': {'protocol': 'm3u8_native', 'url': 'http://x/playlist.m3u8'}})
+    pool = ExtractorPool({}, factory=lambda opts: fake)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        assert download_video("Singer", 2, temp_dir, search_pool=pool, download_pool=pool, segment=(20, 10)) == 2
+        assert sorted(os.listdir(temp_dir)) == ["01_Song 0.webm", "02_Song 1.webm"]
+
+@patch('project.cut_audio')
+def test_convert_cuts_range_fetched_files_from_start(mock_cut):
+    mock_cut.return_value = True
+    with tempfile.TemporaryDirectory() as temp_dir:
+        open(os.path.join(temp_dir, "01_abc.segment.webm"), 'w').close()
+        open(os.path.join(temp_dir, "02_Song.webm"), 'w').close()
+        convert(temp_dir, 10)
+    starts = {os.path.basename(call.args[0]): call.args[2] for call in mock_cut.call_args_list}
+    assert starts == {"01_abc.segment.webm": 0, "02_Song.webm": 20}
+
+def test_audio_cache_lru_eviction():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = AudioCache(os.path.join(temp_dir, 'cache'), max_bytes=250)
+        for name in ['a', 'b', 'c']:
+            src = os.path.join(temp_dir, f'{name}.webm')
+            with open(src, 'wb') as f:
+                f.write(b'x' * 100)
+            cache.put(name, 'bestaudio', src)
+            time.sleep(0.01)
+        # Adding 'c' pushed the cache over budget, so the least recently used entry went
+        assert cache.get('a', 'bestaudio', os.path.join(temp_dir, 'a_out')) is None
+        assert cache.get('b', 'bestaudio', os.path.join(temp_dir, 'b_out')) == os.path.join(temp_dir, 'b_out.webm')
+        assert cache.get('b', 'bestaudio:20:10', os.path.join(temp_dir, 'b_seg')) is None
+        assert cache.stats() == {"hits": 1, "misses": 2, "evictions": 1}
+
+def test_audio_cache_lists_its_directory_only_after_changes(tmp_path, monkeypatch):
+    cache = AudioCache(str(tmp_path / 'cache'), max_bytes=1024 * 1024)
+    src = tmp_path / 'a.webm'
+    src.write_bytes(b'x' * 100)
+    cache.put('a', 'bestaudio', str(src))
+    settled = time.time() - 10
+    os.utime(cache.root, (settled, settled))
+
+    listings = []
+    real_listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda path: listings.append(path) or real_listdir(path))
+    for n in range(5):
+        assert cache.get('a', 'bestaudio', str(tmp_path / f'a{n}'))
+        assert cache.get('b', 'bestaudio', str(tmp_path / f'b{n}')) is None
+    assert len(listings) == 1
+
+    # An entry added by another process sharing the directory is still found
+    AudioCache(cache.root, max_bytes=1024 * 1024).put('b', 'bestaudio', str(src))
+    assert cache.get('b', 'bestaudio', str(tmp_path / 'b')) == str(tmp_path / 'b.webm')
+
+def test_audio_cache_puts_evict_from_the_index(tmp_path, monkeypatch):
+    cache = AudioCache(str(tmp_path / 'cache'), max_bytes=250)
+    src = tmp_path / 'a.webm'
+    src.write_bytes(b'x' * 100)
+    cache.put('a', 'bestaudio', str(src))
+    settled = time.time() - 10
+    os.utime(cache.root, (settled, settled))
+
+    listings = []
+    real_listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda path: listings.append(path) or real_listdir(path))
+    for name in ['b', 'c', 'd']:
+        time.sleep(0.01)
+        cache.put(name, 'bestaudio', str(src))
+    assert len(listings) == 1
+
+    # Only the two most recent entries fit the budget
+    assert sorted(os.listdir(cache.root)) == sorted(['.staging'] + [cache._key(name, 'bestaudio') + '.webm' for name in 'cd'])
+    assert cache.stats()["evictions"] == 2
+
+def test_download_video_reads_from_audio_cache():
+    fake = FakeExtractor(fake_entries(2))
+    pool = ExtractorPool({}, factory=lambda opts: fake)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = AudioCache(os.path.join(temp_dir, 'cache'), max_bytes=1024 * 1024)
+        for request_dir in ['first', 'second']:
+            download_path = os.path.join(temp_dir, request_dir)
+            os.makedirs(download_path)
+            assert download_video("Singer", 2, download_path, search_pool=pool, download_pool=pool, cache=cache) == 2
+        # The repeat request is served entirely from the cache, in ranking order
+        assert fake.downloads == 2
+        assert sorted(os.listdir(os.path.join(temp_dir, 'second'))) == ["01_vid0.webm", "02_vid1.webm"]
+        assert cache.stats()["hits"] == 2
+
+def test_search_cache_ttl_and_normalized_key():
+    cache = SearchCache(ttl=0.2)
+    calls = []
+    def loader():
+        calls.append(1)
+        return [{'title': f'Song {i}'} for i in range(50)]
+
+    assert len(cache.lookup("Arijit Singh", 5, loader)) == 50
+    # Same singer with different spacing/case, wanting fewer tracks, reuses the result
+    assert len(cache.lookup("  arijit   SINGH ", 2, loader)) == 50
+    assert len(calls) == 1
+    # Searching for more tracks than the cached result covers goes back to YouTube
+    cache.lookup("Arijit Singh", 10, loader)
+    assert len(calls) == 2
+    time.sleep(0.25)
+    cache.lookup("Arijit Singh", 5, loader)
+    assert len(calls) == 3
+
+def test_search_cache_single_flight():
+    cache = SearchCache(ttl=60)
+    calls = []
+    def slow_loader():
+        calls.append(1)
+        time.sleep(0.2)
+        return [{'title': 'Song'}]
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.lookup("Singer", 5, slow_loader)))
+               for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert results == [[{'title': 'Song'}]] * 5
+    assert cache.stats()["coalesced"] == 4
+
+def test_search_cache_does_not_cache_failures():
+    cache = SearchCache(ttl=60)
+    def failing_loader():
+        raise Exception("rate limited")
+    with pytest.raises(Exception):
+        cache.lookup("Singer", 50, failing_loader)
+    assert cache.lookup("Singer", 50, lambda: [{'title': 'Song'}]) == [{'title': 'Song'}]
+
+def test_incremental_ranker_stops_once_top_n_settles():
+    pulled = []
+    def search_pages():
+        for i in range(200):
+            pulled.append(i)
+            uploader = 'Singer VEVO' if i < 8 else 'Someone Else'
+            yield {'uploader': uploader, 'title': f'Singer Song {i}', 'view_count': 1000 - i, 'id': f'v{i}'}
+
+    ranker = IncrementalRanker("Singer", 3)
+    ranker.consume(search_pages())
+    # Page one settles the top three, page two confirms it, and nothing more is fetched
+    assert len(pulled) == 20
+    assert [e['id'] for e in ranker.top()] == ['v0', 'v1', 'v2']
+
+def test_incremental_ranker_suppresses_duplicate_titles():
+    ranker = IncrementalRanker("Singer", 3)
+    for entry in [
+        {'uploader': 'Singer', 'title': 'Tum Hi Ho (Official Video)', 'view_count': 500, 'id': 'a'},
+        {'uploader': 'Singer - Topic', 'title': 'Tum Hi Ho | Lyrics', 'view_count': 900, 'id': 'b'},
+        {'uploader': 'Singer', 'title': 'Channa Mereya', 'view_count': 300, 'id': 'c'},
+        {'uploader': 'Fan Uploads', 'title': 'Random Cover', 'view_count': 10 ** 9, 'id': 'd'},
+    ]:
+        ranker.add(entry)
+    assert [e['id'] for e in ranker.top()] == ['b', 'c']
+
+def test_incremental_ranker_falls_back_to_all_entries():
+    ranker = IncrementalRanker("Singer", 2)
+    ranker.add({'uploader': 'A', 'title': 'One', 'view_count': 1, 'id': '1'})
+    ranker.add({'uploader': 'B', 'title': 'Two', 'view_count': 2, 'id': '2'})
+    assert not ranker.matched
+    assert [e['id'] for e in ranker.top()] == ['2', '1']
+
 @patch('project.ffmpeg')
 def test_cut_audio(mock_ffmpeg):
     # Setup mock
@@ -59,7 +495,7 @@ def test_cut_audio(mock_ffmpeg):
 @patch('project.cut_audio')
 def test_convert(mock_cut, mock_listdir):
     # Setup
-    mock_listdir.return_value = ["song1.webm", "song2.m4a"]
+    mock_listdir.return_value = ["01_song1.webm", "02_song2.m4a"]
     mock_cut.return_value = True
     
     # We mock os.path.isfile in project.py context or just ensure logic flows
@@ -73,14 +509,56 @@ def test_convert(mock_cut, mock_listdir):
     
     with tempfile.TemporaryDirectory() as temp_dir:
         # Create dummy files
-        open(os.path.join(temp_dir, "song1.webm"), 'w').close()
-        open(os.path.join(temp_dir, "song2.m4a"), 'w').close()
+        open(os.path.join(temp_dir, "01_song1.webm"), 'w').close()
+        open(os.path.join(temp_dir, "02_song2.m4a"), 'w').close()
         
         result = convert(temp_dir, 20)
         # Check result
         assert len(result) == 2
         # fix: convert returns paths join with temp_dir
-        assert os.path.join(temp_dir, "cut_song1.webm.mp3") in result
+        assert os.path.join(temp_dir, "cut_01_song1.webm.mp3") in result
+
+@patch('project.cut_audio')
+def test_convert_keeps_ranking_order_and_reports_failures(mock_cut):
+    # Fail the second-ranked track only
+    mock_cut.side_effect = lambda src, dst, start, dur: not src.endswith('02_B.webm')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in ["03_A.m4a", "01_C.webm", "02_B.webm", "04_D.webm.part"]:
+            open(os.path.join(temp_dir, name), 'w').close()
+
+        result = convert(temp_dir, 10)
+        assert result == [os.path.join(temp_dir, "cut_01_C.webm.mp3"),
+                          os.path.join(temp_dir, "cut_03_A.m4a.mp3")]
+
+def test_download_video_names_files_by_rank():
+    fake = FakeExtractor(fake_entries(3))
+    pool = ExtractorPool({}, factory=lambda opts: fake)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        download_video("Singer", 3, temp_dir, search_pool=pool, download_pool=pool)
+        assert sorted(os.listdir(temp_dir)) == ["01_Song 0.webm", "02_Song 1.webm", "03_Song 2.webm"]
+
+@patch('project.cut_audio')
+def test_cut_audio_batch_runs_in_parallel(mock_cut):
+    active = []
+    peak = []
+    lock = threading.Lock()
+    def slow_cut(src, dst, start, dur):
+        with lock:
+            active.append(src)
+            peak.append(len(active))
+        time.sleep(0.1)
+        with lock:
+            active.remove(src)
+        if src == 'bad':
+            raise Exception("corrupt input")
+        return True
+    mock_cut.side_effect = slow_cut
+
+    results = cut_audio_batch([('a', 'a.mp3', 0), ('bad', 'bad.mp3', 0), ('c', 'c.mp3', 0)], 10, workers=3)
+    assert [r[0] for r in results] == ['a', 'bad', 'c']
+    assert results[1][2] == "corrupt input"
+    assert results[0][2] is None and results[2][2] is None
+    assert max(peak) > 1
 
 @patch('project.AudioFileClip')
 @patch('project.concatenate_audioclips')
@@ -101,6 +579,248 @@ def test_mashup(mock_concat, mock_clip):
     # Test empty request
     assert mashup([], "output.mp3") is None
 
+@requires_ffmpeg
+def test_mashup_ffmpeg_single_pass():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        sources = []
+        for i, frequency in enumerate([220, 440, 880]):
+            path = os.path.join(temp_dir, f"0{i + 1}_track.m4a")
+            make_tone(path, 40, frequency)
+            sources.append((path, 20))
+
+        output = os.path.join(temp_dir, "merged.mp3")
+        assert mashup_ffmpeg(sources, output, 5) == output
+        assert abs(media_duration(output) - 15) < 0.5
+
+        # Each crossfade overlaps neighbouring segments by one second
+        assert mashup_ffmpeg(sources, output, 5, crossfade=1) == output
+        assert abs(media_duration(output) - 13) < 0.5
+
+    assert mashup_ffmpeg([], "merged.mp3", 5) is None
+
+@requires_ffmpeg
+def test_stream_mashup_cuts_while_downloading():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths = {}
+        for rank in (1, 3):
+            paths[rank] = os.path.join(temp_dir, f"{rank:02d}_track.m4a")
+            make_tone(paths[rank], 30, 220 * rank)
+        first_cut = threading.Event()
+
+        def decode(*args):
+            ok = decode_segment(*args)
+            first_cut.set()
+            return ok
+
+        def download(on_track):
+            # Track 3 lands first and track 2 fails; a cut must still finish
+            # before the download stage does
+            on_track(3, paths[3])
+            on_track(2, None)
+            on_track(1, paths[1])
+            assert first_cut.wait(10)
+            return 2
+
+        output = os.path.join(temp_dir, 'merged.mp3')
+        with patch('project.decode_segment', side_effect=decode):
+            count, merged = stream_mashup(download, output, 4, start_time_seconds=5, workers=2, queue_size=1)
+        assert (count, merged) == (2, output)
+        assert abs(media_duration(output) - 8) < 0.5
+        assert not [name for name in os.listdir(temp_dir) if name.endswith('.pcm')]
+
+def test_list_sources_only_returns_ranked_downloads():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        names = ["02_b.segment.webm", "01_a.m4a", "01_a.m4a.pcm", "03_c.webm.part", "merged_audio.mp3",
+                 "cut_01_a.m4a.mp3", "copy_00.mka", "copy_segments.txt"]
+        for name in names:
+            open(os.path.join(temp_dir, name), 'w').close()
+        assert project.list_sources(temp_dir) == [(os.path.join(temp_dir, "01_a.m4a"), 20),
+                                                  (os.path.join(temp_dir, "02_b.segment.webm"), 0)]
+
+def test_stream_mashup_removes_partial_output_when_encoding_fails():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output = os.path.join(temp_dir, 'merged_audio.mp3')
+        def fail(self):
+            with open(output, 'wb') as f:
+                f.write(b'partial')
+            raise RuntimeError("encoder died")
+        with patch.object(project.StreamingEncoder, 'finish', fail):
+            count, merged = stream_mashup(lambda on_track: 0, output, 4, workers=1)
+        assert (count, merged) == (0, None)
+        assert not os.path.exists(output)
+
+@requires_ffmpeg
+def test_pcm_mixer_matches_loudness_and_crossfades():
+    import numpy as np
+    t = np.arange(4 * PCM_RATE, dtype=np.float32) / PCM_RATE
+    quiet = np.repeat((0.05 * np.sin(2 * np.pi * 220 * t))[:, None], 2, axis=1)
+    loud = np.repeat((0.8 * np.sin(2 * np.pi * 330 * t))[:, None], 2, axis=1)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output = os.path.join(temp_dir, 'mixed.mp3')
+        mixer = PcmMixer(output, crossfade=1, target_dbfs=-18)
+        mixer.add(quiet)
+        mixer.add(loud)
+        assert mixer.finish() == output
+
+        samples = decode_pcm(output)
+        # Two 4s segments overlapping by 1s
+        assert abs(len(samples) / PCM_RATE - 7) < 0.1
+        rms = [20 * np.log10(np.sqrt(np.mean(np.square(samples[int(a * PCM_RATE):int(b * PCM_RATE)]))))
+               for a, b in ((0.5, 2.5), (4.5, 6.5))]
+        assert all(abs(level + 18) < 1 for level in rms)
+        # Equal-power fade: no dip in the middle of the crossfade
+        middle = samples[int(3.4 * PCM_RATE):int(3.6 * PCM_RATE)]
+        assert 20 * np.log10(np.sqrt(np.mean(np.square(middle)))) > -21
+
+def test_streaming_encoder_feeds_the_mixer_float32(tmp_path):
+    import numpy as np
+    received = []
+    class Mixer:
+        def add(self, samples):
+            received.append(samples)
+    pcm_path = tmp_path / '01.pcm'
+    np.array([[16384, -32768]], dtype='<i2').tofile(pcm_path)
+    project.StreamingEncoder(str(tmp_path / 'out.mp3'), mixer=Mixer()).add(1, str(pcm_path))
+    assert received[0].dtype == np.float32
+    assert received[0].tolist() == [[0.5, -1.0]]
+    assert not pcm_path.exists()
+
+@requires_ffmpeg
+def test_fetch_segment_starts_at_the_requested_time(tmp_path):
+    # Ten-second clusters, like long WebM streams, with the tone starting mid-cluster
+    source = str(tmp_path / 'source.webm')
+    subprocess.run(['ffmpeg', '-v', 'quiet', '-y', '-f', 'lavfi', '-i',
+                    "aevalsrc='if(gte(t,32),0.5*sin(2*PI*440*t),0)':d=60:s=48000", '-c:a', 'libopus',
+                    '-cluster_time_limit', '10000', '-cluster_size_limit', '10000000', source], check=True)
+    output = str(tmp_path / 'window.webm')
+    assert project.fetch_segment(source, output, 32, 10)
+    assert abs(media_duration(output) - 10) < 0.1
+    silence = subprocess.run(['ffmpeg', '-i', output, '-af', 'silencedetect=n=-40dB:d=0.1', '-f', 'null', '-'],
+                             capture_output=True, text=True).stderr
+    assert 'silence_start' not in silence
+
+@requires_ffmpeg
+def test_mashup_numpy_backend():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(temp_dir, f"{i + 1:02d}_track.m4a"))
+            make_tone(paths[-1], 3, 220 * (i + 1))
+        output = os.path.join(temp_dir, 'merged.mp3')
+        assert mashup(paths + [os.path.join(temp_dir, 'missing.m4a')], output, backend='numpy') == output
+        assert abs(media_duration(output) - 9) < 0.5
+
+def test_plan_output_steps_down_to_fit_the_limit():
+    limit = 24 * 1024 * 1024
+    assert plan_output(2, 10, limit).name == 'mp3-v4'
+    assert plan_output(2, 10, limit, preferred='mp3-v0').name == 'mp3-v0'
+    # 40 minutes of audio only fits an attachment as Opus
+    assert plan_output(20, 120, limit).name == 'opus-64'
+    assert plan_output(20, 120, limit).estimate_bytes(20 * 120) <= limit
+    assert plan_output(20, 120).name == 'mp3-v4'
+    assert plan_output(20, 120, 1024 * 1024) is None
+
+def test_plan_delivery_prefers_a_link_over_lower_quality(monkeypatch):
+    monkeypatch.setattr(app, 'secret_key', 'test-secret')
+    monkeypatch.setitem(app.config, 'MASHUP_DELIVERY', 'auto')
+    # Without a configured public address there's nowhere trustworthy to point links
+    monkeypatch.setitem(app.config, 'MASHUP_PUBLIC_URL', None)
+    assert plan_delivery(20, 120)[0] == 'attachment'
+    monkeypatch.setitem(app.config, 'MASHUP_PUBLIC_URL', 'https://mashup.example.com')
+    assert [(d, p.name) for d, p in (plan_delivery(2, 10), plan_delivery(20, 120))] == \
+        [('attachment', 'mp3-v4'), ('link', 'mp3-v4')]
+    monkeypatch.setitem(app.config, 'MASHUP_DELIVERY', 'attachment')
+    delivery, profile = plan_delivery(20, 120)
+    assert (delivery, profile.name) == ('attachment', 'opus-64')
+
+@requires_ffmpeg
+def test_mashup_ffmpeg_encodes_with_profile():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source = os.path.join(temp_dir, "01_track.m4a")
+        make_tone(source, 10)
+        output = os.path.join(temp_dir, "merged.opus")
+        assert mashup_ffmpeg([(source, 2)], output, 4, profile=PROFILES_BY_NAME['opus-32']) == output
+        probe = subprocess.run(['ffmpeg', '-i', output], capture_output=True, text=True).stderr
+        assert 'Audio: opus' in probe
+        assert abs(media_duration(output) - 4) < 0.5
+
+@requires_ffmpeg
+def test_copy_mashup_copies_matching_codecs_and_transcodes_the_rest():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        sources = []
+        for i in range(3):
+            path = os.path.join(temp_dir, f"{i + 1:02d}_track.webm")
+            subprocess.run(['ffmpeg', '-v', 'quiet', '-y', '-f', 'lavfi', '-i', f'sine=frequency={220 * (i + 1)}:duration=12',
+                            '-ac', '2', '-c:a', 'libopus', '-b:a', '96k', path], check=True)
+            sources.append((path, 2))
+        odd = os.path.join(temp_dir, "04_track.m4a")
+        make_tone(odd, 12)
+        sources.append((odd, 2))
+        assert probe_audio(sources[0][0])[0] == 'opus' and probe_audio(odd)[0] == 'aac'
+
+        with patch('project.cut_audio') as mock_cut:
+            output = copy_mashup(sources, os.path.join(temp_dir, "merged_audio"), 5, '64k')
+        mock_cut.assert_not_called()
+        assert output == os.path.join(temp_dir, "merged_audio.opus")
+        assert probe_audio(output)[0] == 'opus'
+        assert abs(media_duration(output) - 20) < 0.5
+        # Intermediates are cleaned up, leaving only the downloads and the output
+        assert sorted(os.listdir(temp_dir)) == ["01_track.webm", "02_track.webm", "03_track.webm", "04_track.m4a",
+                                                "merged_audio.opus"]
+
+        # A failed join leaves nothing behind for the transcode fallback to pick up
+        os.remove(output)
+        real_run = project._run_ffmpeg
+        def fail_concat(node):
+            if 'concat' in node.compile():
+                raise RuntimeError("concat failed")
+            return real_run(node)
+        with patch('project._run_ffmpeg', side_effect=fail_concat):
+            assert copy_mashup(sources, os.path.join(temp_dir, "merged_audio"), 5) is None
+        assert [path for path, _ in project.list_sources(temp_dir)] == [path for path, _ in sources]
+        assert sorted(os.listdir(temp_dir)) == ["01_track.webm", "02_track.webm", "03_track.webm", "04_track.m4a"]
+
+        # Nothing copyable: the caller falls back to transcoding
+        assert copy_mashup([(os.path.join(temp_dir, "missing.webm"), 0)], os.path.join(temp_dir, "x"), 5) is None
+
+def test_probe_audio_tells_aac_profiles_apart():
+    def probe(line):
+        stderr = f"Input #0, mov,mp4,m4a, from 'x.m4a':\n  Stream #0:0[0x1](und): {line}\n"
+        with patch('project.subprocess.run', return_value=MagicMock(stderr=stderr)):
+            return probe_audio('x.m4a')
+    lc = probe("Audio: aac (LC) (mp4a / 0x6134706D), 44100 Hz, stereo, fltp, 128 kb/s (default)")
+    he = probe("Audio: aac (HE-AAC) (mp4a / 0x6134706D), 44100 Hz, stereo, fltp, 48 kb/s (default)")
+    assert lc == ('aac', 'LC', 44100, 2)
+    assert he == ('aac', 'HE-AAC', 44100, 2) and he != lc
+    assert probe("Audio: opus, 48000 Hz, 5.1(side), fltp") == ('opus', None, 48000, 6)
+    assert probe("Audio: aac (mp4a / 0x6134706D), 96000 Hz, 0 channels, fltp") == ('aac', None, 96000, None)
+
+def test_plan_delivery_uses_stream_copy_only_when_it_can(monkeypatch):
+    monkeypatch.setitem(app.config, 'MASHUP_DELIVERY', 'attachment')
+    monkeypatch.setitem(app.config, 'MASHUP_CUT_MODE', 'copy')
+    delivery, profile = plan_delivery(5, 30)
+    assert (profile.name, profile.fallback.name) == ('copy', 'mp3-v4')
+    assert profile.options['audio_bitrate'] == '170k'
+    monkeypatch.setitem(app.config, 'MASHUP_OUTPUT_PROFILE', 'opus-64')
+    assert plan_delivery(5, 30)[1].options['audio_bitrate'] == '64k'
+    monkeypatch.setitem(app.config, 'MASHUP_OUTPUT_PROFILE', 'mp3-v4')
+    # Too long to attach at source bitrates: transcode down instead
+    assert plan_delivery(20, 120)[1].name == 'opus-64'
+    monkeypatch.setitem(app.config, 'MASHUP_CROSSFADE', 1.0)
+    assert plan_delivery(5, 30)[1].name == 'mp3-v4'
+
+@patch('project.ffmpeg')
+def test_mashup_ffmpeg_reports_failure(mock_ffmpeg):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output = os.path.join(temp_dir, "merged_audio.mp3")
+        def fail(*args, **kwargs):
+            with open(output, 'wb') as f:
+                f.write(b'partial')
+            raise Exception("bad input")
+        mock_ffmpeg.filter.return_value.output.return_value.overwrite_output.return_value.run.side_effect = fail
+        assert mashup_ffmpeg([("a.webm", 20), ("b.webm", 20)], output, 5) is None
+        assert not os.path.exists(output)
+
 def test_create_zip():
     with tempfile.TemporaryDirectory() as temp_dir:
         # Create a dummy file to zip
@@ -125,6 +845,67 @@ def test_send_email(mock_send):
             assert err is None
             mock_send.assert_called_once()
 
+def test_mail_dispatcher_sends_batches_over_pooled_connection(smtp_server):
+    server, mail_app, mail_ext = smtp_server()
+    dispatcher = MailDispatcher(mail_app, mail_ext, connections=1, batch_size=10)
+    with mail_app.app_context():
+        for i in range(5):
+            dispatcher.submit(Message(subject=f'Mashup {i}', recipients=['test@example.com'], body='hi'))
+    assert wait_for(lambda: dispatcher.stats()["sent"] == 5)
+    assert len(server.messages) == 5
+    # All five went through one SMTP session
+    assert server.connections == 1
+    stats = dispatcher.stats()
+    assert stats["queue_depth"] == 0
+    assert stats["latency_max_seconds"] > 0
+
+def test_mail_dispatcher_retries_with_backoff(smtp_server):
+    server, mail_app, mail_ext = smtp_server(reject_first=2)
+    dispatcher = MailDispatcher(mail_app, mail_ext, connections=1, backoff=0.05)
+    with mail_app.app_context():
+        dispatcher.submit(Message(subject='Mashup', recipients=['test@example.com'], body='hi'))
+    # flush() waits out the backoff timers as well as the queue
+    assert dispatcher.flush(5)
+    assert dispatcher.stats()["sent"] == 1
+    assert dispatcher.stats()["retried"] == 2
+    assert len(server.messages) == 1
+
+def test_mail_dispatcher_gives_up_after_max_attempts(smtp_server):
+    server, mail_app, mail_ext = smtp_server(reject_first=10)
+    dispatcher = MailDispatcher(mail_app, mail_ext, connections=1, max_attempts=2, backoff=0.01)
+    errors = []
+    with mail_app.app_context():
+        dispatcher.submit(Message(subject='Mashup', recipients=['test@example.com'], body='hi'), on_failure=errors.append)
+    assert wait_for(lambda: dispatcher.stats()["failed"] == 1)
+    assert dispatcher.stats()["sent"] == 0
+    assert len(errors) == 1
+    assert dispatcher.failures[0]["recipients"] == ['test@example.com']
+    assert dispatcher.flush(1)
+
+@patch('project.build_mashup')
+def test_queued_mail_is_reported_as_queued_and_failures_reach_the_job(mock_build, client, smtp_server, monkeypatch):
+    def fake_build(singer, num_videos, dur, work_dir, report=None, profile=None):
+        path = os.path.join(work_dir, "merged_audio.mp3")
+        with open(path, 'wb') as f:
+            f.write(b'mashup')
+        return path, None
+    mock_build.side_effect = fake_build
+    server, mail_app, mail_ext = smtp_server(reject_first=10)
+    monkeypatch.setitem(app.config, 'MASHUP_MAIL_QUEUE', True)
+    monkeypatch.setitem(app.config, 'MASHUP_DELIVERY', 'attachment')
+    monkeypatch.setattr(project, '_mail_dispatcher',
+                        MailDispatcher(mail_app, mail_ext, connections=1, max_attempts=1, backoff=0.01))
+
+    data = {'singer': 'Test Singer', 'number_of_videos': '2', 'duration': '10', 'email': 'test@example.com'}
+    payload = client.post('/generate_mashup', data=data).get_json()
+    # Nothing has been sent when the response goes out, so it mustn't say otherwise
+    assert payload['email'] == 'queued'
+    assert 'emailed successfully' not in payload['message']
+
+    job_id = client.post('/generate_mashup', data=dict(data, mode='async', email='b@example.com')).get_json()['job_id']
+    assert wait_for(lambda: client.get(f'/jobs/{job_id}').get_json()['status'] == 'failed')
+    assert "Failed to send email" in client.get(f'/jobs/{job_id}').get_json()['result']['error']
+
 # --- Integration Tests ---
 
 def test_index_route(client):
@@ -169,6 +950,291 @@ def test_generate_mashup_route_success(mock_getsize, mock_email_func, mock_zip,
     assert response.is_json
     assert "Mashup generated" in response.get_json()['message']
 
+@patch('project.download_video')
+@patch('project.mashup_ffmpeg')
+@patch('project.convert')
+@patch('project.mashup')
+@patch('project.create_zip')
+@patch('project.send_email')
+@patch('project.os.path.getsize')
+def test_generate_mashup_falls_back_to_moviepy(mock_getsize, mock_email_func, mock_zip, mock_mashup_func, mock_convert, mock_ffmpeg_mashup, mock_dl, client):
+    mock_dl.return_value = 2
+    mock_ffmpeg_mashup.return_value = None # single-pass merge failed
+    mock_convert.return_value = ["cut1.mp3", "cut2.mp3"]
+    mock_mashup_func.return_value = "merged.mp3"
+    mock_zip.return_value = True
+    mock_email_func.return_value = (True, None)
+    mock_getsize.return_value = 1000
+
+    data = {'singer': 'Test Singer', 'number_of_videos': '2', 'duration': '10', 'email': 'test@example.com'}
+    response = client.post('/generate_mashup', data=data)
+    assert response.status_code == 200
+    mock_ffmpeg_mashup.assert_called_once()
+    mock_mashup_func.assert_called_once()
+
+def test_result_cache_coalesces_identical_builds():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = ResultCache(os.path.join(temp_dir, 'results'), max_bytes=1024 * 1024)
+        builds = []
+
+        def request(n):
+            work_dir = os.path.join(temp_dir, f'request{n}')
+            os.makedirs(work_dir)
+            def build():
+                builds.append(n)
+                time.sleep(0.2)
+                path = os.path.join(work_dir, 'merged_audio.mp3')
+                with open(path, 'wb') as f:
+                    f.write(b'mashup')
+                return path, True
+            return cache.get_or_build('singer|2|10|20', 'mashup', os.path.join(work_dir, 'merged_audio'), build)
+
+        results = [None] * 4
+        threads = [threading.Thread(target=lambda n=n: results.__setitem__(n, request(n))) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(builds) == 1
+        for n, path in enumerate(results):
+            assert path == os.path.join(temp_dir, f'request{n}', 'merged_audio.mp3')
+            with open(path, 'rb') as f:
+                assert f.read() == b'mashup'
+        assert cache.stats()["coalesced"] == 3
+
+def test_result_cache_skips_partial_builds_and_expires_entries(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results'), max_bytes=1024 * 1024, ttl=60)
+    builds = []
+    def build(complete):
+        def run():
+            builds.append(complete)
+            path = str(tmp_path / f'build{len(builds)}.mp3')
+            with open(path, 'wb') as f:
+                f.write(b'mashup')
+            return path, complete
+        return run
+    dest = str(tmp_path / 'merged_audio')
+
+    # A mashup that came up a track short is handed out once, not cached
+    assert cache.get_or_build('singer|2|10|20', 'mashup', dest, build(False))
+    cache.get_or_build('singer|2|10|20', 'mashup', dest, build(True))
+    cache.get_or_build('singer|2|10|20', 'mashup', dest, build(True))
+    assert builds == [False, True]
+
+    # Serving an entry doesn't extend its life; once the TTL has passed it is built again
+    entry = cache._find(cache._key('singer|2|10|20', 'mashup'))
+    assert time.time() - os.stat(entry).st_mtime < 60
+    built_at = time.time() - 61
+    os.utime(entry, (built_at, built_at))
+    cache = ResultCache(cache.root, max_bytes=1024 * 1024, ttl=60)
+    cache.get_or_build('singer|2|10|20', 'mashup', dest, build(True))
+    assert builds == [False, True, True]
+    assert cache.stats()["expired"] == 1
+
+def test_result_cache_shares_an_incomplete_build_with_its_waiters(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results'), max_bytes=1024 * 1024)
+    builds = []
+
+    def request(n):
+        work_dir = tmp_path / f'request{n}'
+        work_dir.mkdir()
+        def build():
+            builds.append(n)
+            time.sleep(0.2)
+            path = work_dir / 'merged_audio.mp3'
+            path.write_bytes(b'short a track')
+            return str(path), False
+        return cache.get_or_build('singer|3|10|20', 'mashup', str(work_dir / 'merged_audio'), build)
+
+    results = [None] * 4
+    threads = [threading.Thread(target=lambda n=n: results.__setitem__(n, request(n))) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # One build served every request waiting on it, but none of it was cached
+    assert len(builds) == 1
+    for n, path in enumerate(results):
+        assert path == str(tmp_path / f'request{n}' / 'merged_audio.mp3')
+        with open(path, 'rb') as f:
+            assert f.read() == b'short a track'
+    assert os.listdir(cache.root) == ['.staging']
+    assert os.listdir(os.path.join(cache.root, '.staging')) == []
+    request(4)
+    assert len(builds) == 2
+
+@patch('project.build_mashup')
+@patch('project.send_email')
+def test_generate_mashup_serves_repeat_requests_from_result_cache(mock_email_func, mock_build, client, monkeypatch):
+    def fake_build(singer, num_videos, dur, work_dir, report=None, profile=None):
+        for rank in range(1, num_videos + 1):
+            with open(os.path.join(work_dir, f'{rank:02d}_song.webm'), 'wb') as f:
+                f.write(b'source')
+        path = os.path.join(work_dir, 'merged_audio.mp3')
+        with open(path, 'wb') as f:
+            f.write(b'mashup')
+        return path, None
+    mock_build.side_effect = fake_build
+    mock_email_func.return_value = (True, None)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setitem(app.config, 'MASHUP_RESULT_CACHE_DIR', temp_dir)
+        for singer in ['Test Singer', ' test  singer']:
+            data = {'singer': singer, 'number_of_videos': '2', 'duration': '10', 'email': 'test@example.com'}
+            assert client.post('/generate_mashup', data=data).status_code == 200
+        assert mock_build.call_count == 1
+        assert mock_email_func.call_count == 2
+
+        # Asking for more tracks than could be downloaded gives a mashup that isn't cached
+        data = {'singer': 'Test Singer', 'number_of_videos': '3', 'duration': '10', 'email': 'test@example.com'}
+        mock_build.side_effect = lambda *args, **kwargs: fake_build(args[0], 2, *args[2:], **kwargs)
+        for _ in range(2):
+            assert client.post('/generate_mashup', data=data).status_code == 200
+        assert mock_build.call_count == 3
+
+@patch('project.build_mashup')
+@patch('project.mail.send')
+def test_generate_mashup_link_delivery_streams_with_range(mock_send, mock_build, client, monkeypatch):
+    payload = bytes(range(256)) * 1024
+    def fake_build(singer, num_videos, dur, work_dir, report=None, profile=None):
+        path = os.path.join(work_dir, 'merged_audio.mp3')
+        with open(path, 'wb') as f:
+            f.write(payload)
+        return path, None
+    mock_build.side_effect = fake_build
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setattr(app, 'secret_key', 'test-secret')
+        monkeypatch.setitem(app.config, 'MASHUP_DELIVERY', 'link')
+        monkeypatch.setitem(app.config, 'MASHUP_RETENTION_DIR', temp_dir)
+        monkeypatch.setitem(app.config, 'MASHUP_PUBLIC_URL', 'https://mashup.example.com/')
+        monkeypatch.setitem(app.config, 'MASHUP_LINK_TTL', 1800)
+        data = {'singer': 'Test Singer', 'number_of_videos': '2', 'duration': '10', 'email': 'test@example.com'}
+        # The link points at the configured address, whatever Host the client sent
+        response = client.post('/generate_mashup', data=data, headers={'Host': 'attacker.example'})
+        assert response.status_code == 200
+        download_url = response.get_json()['download_url']
+        assert download_url.startswith('https://mashup.example.com/download/')
+
+        # The email carries the link rather than an attachment
+        msg = mock_send.call_args[0][0]
+        assert download_url in msg.body
+        assert 'within 30 minutes' in msg.body
+        assert not msg.attachments
+
+        path = download_url.split('mashup.example.com', 1)[1]
+        partial = client.get(path, headers={'Range': 'bytes=100-199'})
+        assert partial.status_code == 206
+        assert partial.data == payload[100:200]
+        full = client.get(path)
+        assert full.status_code == 200
+        assert full.data == payload
+        full.close()
+        partial.close()
+
+        assert client.get('/download/not-a-token').status_code == 404
+        monkeypatch.setitem(app.config, 'MASHUP_LINK_TTL', -1)
+        assert client.get(path).status_code == 410
+
+def test_retained_cache_entry_lives_as_long_as_its_link(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'secret_key', 'test-secret')
+    monkeypatch.setitem(app.config, 'MASHUP_RETENTION_DIR', str(tmp_path / 'retained'))
+    monkeypatch.setitem(app.config, 'MASHUP_LINK_TTL', 1800)
+    cache = ResultCache(str(tmp_path / 'results'), max_bytes=1024 * 1024)
+    built = tmp_path / 'built.mp3'
+    built.write_bytes(b'mashup')
+    cache.put('singer|2|10|20', 'mashup', str(built))
+    # Served from a cache entry built three days ago, which the retained file shares an inode with
+    served = cache.get('singer|2|10|20', 'mashup', str(tmp_path / 'merged_audio'))
+    three_days_ago = time.time() - 3 * 86400
+    os.utime(served, (three_days_ago, three_days_ago))
+
+    token = project.retain_result(served)
+    project.retain_result(served)
+    file_id = project._download_serializer().loads(token)
+    assert os.path.exists(os.path.join(app.config['MASHUP_RETENTION_DIR'], file_id))
+
+def test_describe_duration():
+    assert [project.describe_duration(s) for s in (86400, 172800, 5400, 3600, 90, 1)] == \
+        ['24 hours', '2 days', '90 minutes', '60 minutes', '90 seconds', '1 second']
+
+def test_create_zip_stores_audio_uncompressed():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        src_file = os.path.join(temp_dir, "merged_audio.mp3")
+        with open(src_file, "wb") as f:
+            f.write(b"\xff" * 1000)
+        zip_path = os.path.join(temp_dir, "merged_audio.zip")
+        assert create_zip(src_file, zip_path)
+        with zipfile.ZipFile(zip_path) as zipf:
+            assert zipf.getinfo("merged_audio.mp3").compress_type == zipfile.ZIP_STORED
+
+def test_metrics_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    registry.inc('mashup_requests_total', 1, 'Pipeline runs.', outcome='success')
+    registry.observe('mashup_stage_seconds', 0.3, 'Stage time.', stage='zip')
+    text = registry.render()
+    assert '# TYPE mashup_requests_total counter' in text
+    assert 'mashup_requests_total{outcome="success"} 1' in text
+    assert 'mashup_stage_seconds_bucket{stage="zip",le="0.25"} 0' in text
+    assert 'mashup_stage_seconds_bucket{stage="zip",le="0.5"} 1' in text
+    assert 'mashup_stage_seconds_count{stage="zip"} 1' in text
+
+@patch('project.metrics')
+def test_stage_timer_is_a_no_op_when_disabled(mock_metrics):
+    with stage_timer('zip'):
+        pass
+    mock_metrics.observe.assert_not_called()
+
+@requires_ffmpeg
+@patch('project.download_video')
+@patch('project.send_email')
+def test_generate_mashup_records_stage_metrics_and_trace(mock_email_func, mock_dl, client, monkeypatch):
+    def fake_download(singer, num_videos, download_path, segment=None, on_track=None):
+        for i in range(num_videos):
+            path = os.path.join(download_path, f"{i + 1:02d}_track.m4a")
+            make_tone(path, 30, 220 * (i + 1))
+            on_track(i + 1, path)
+        return num_videos
+    mock_dl.side_effect = fake_download
+    mock_email_func.return_value = (True, None)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        trace_log = os.path.join(temp_dir, 'trace.jsonl')
+        monkeypatch.setitem(app.config, 'MASHUP_METRICS', True)
+        monkeypatch.setitem(app.config, 'MASHUP_TRACE_LOG', trace_log)
+        data = {'singer': 'Test Singer', 'number_of_videos': '2', 'duration': '5', 'email': 'test@example.com'}
+        assert client.post('/generate_mashup', data=data).status_code == 200
+
+        text = client.get('/metrics').get_data(as_text=True)
+        for stage in ('cut', 'merge', 'zip', 'email'):
+            assert f'mashup_stage_seconds_count{{stage="{stage}"}}' in text
+        assert 'mashup_ffmpeg_cpu_seconds_total' in text
+        assert 'mashup_bytes_written_total' in text
+
+        with open(trace_log) as f:
+            trace = json.loads(f.readline())
+        assert trace['singer'] == 'Test Singer'
+        assert trace['status_code'] == 200
+        assert set(trace['stages']) == {'cut', 'merge', 'zip', 'email'}
+        assert trace['ffmpeg_cpu_seconds'] > 0
+        assert trace['bytes_written'] > 0
+
+def test_finish_trace_writes_without_holding_the_metrics_lock(tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'MASHUP_METRICS', True)
+    monkeypatch.setitem(app.config, 'MASHUP_TRACE_LOG', str(tmp_path / 'trace.jsonl'))
+    held = []
+    real_open = open
+    def checked_open(*args, **kwargs):
+        held.append(project.metrics._lock.locked())
+        return real_open(*args, **kwargs)
+    monkeypatch.setattr(project, 'open', checked_open, raising=False)
+    project.finish_trace(project.new_trace(singer='Test Singer'), 200)
+    assert held == [False]
+    with real_open(tmp_path / 'trace.jsonl') as f:
+        assert json.loads(f.readline())['singer'] == 'Test Singer'
+
 def test_generate_mashup_route_invalid(client):
     # Missing email
     data = {
@@ -177,4 +1243,424 @@ def test_generate_mashup_route_invalid(client):
         'duration': '10'
     }
     response = client.post('/generate_mashup', data=data)
-    assert response.status_code == 400
\ No newline at end of file
+    assert response.status_code == 400
+
+@patch('project.run_pipeline')
+def test_generate_mashup_async_job(mock_pipeline, client):
+    def fake_pipeline(singer, num_videos, dur, email, progress=None):
+        for stage in ('download', 'cut', 'merge', 'zip', 'email'):
+            progress(stage)
+        return {"message": "Mashup generated and emailed successfully!"}, 200
+    mock_pipeline.side_effect = fake_pipeline
+
+    data = {
+        'singer': 'Test Singer',
+        'number_of_videos': '2',
+        'duration': '10',
+        'email': 'test@example.com',
+        'mode': 'async'
+    }
+    response = client.post('/generate_mashup', data=data)
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+
+    # The event stream ends once the job finishes
+    events = client.get(f'/jobs/{job_id}/events').get_data(as_text=True)
+    for stage in ('download', 'cut', 'merge', 'zip', 'email'):
+        assert f'"stage": "{stage}"' in events
+    assert 'event: done' in events
+
+    status = client.get(f'/jobs/{job_id}').get_json()
+    assert status['status'] == 'done'
+    assert "Mashup generated" in status['result']['message']
+
+def test_job_not_found(client):
+    assert client.get('/jobs/missing').status_code == 404
+    assert client.get('/jobs/missing/events').status_code == 404
+
+def test_cold_start_skips_media_stack():
+    # Serving the form and health checks must not import yt_dlp or MoviePy
+    probe = (
+        "import sys, project\n"
+        "client = project.app.test_client()\n"
+        "assert client.get('/').status_code == 200\n"
+        "assert client.get('/health').get_json()['media_stack_loaded'] is False\n"
+        "print(sorted(name for name in ('yt_dlp', 'moviepy', 'ffmpeg', 'numpy') if name in sys.modules))\n"
+    )
+    result = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == '[]'
+
+def test_admission_controller_queues_then_sheds():
+    controller = AdmissionController(max_pipelines=2, scratch_bytes=100, cpu_slots=4, queue_limit=1)
+    big, _ = controller.acquire((80, 1))
+    assert big is not None
+    # Fits the pipeline and slot budgets but not the remaining scratch space
+    ticket, retry_after = controller.acquire((40, 1), timeout=0.05)
+    assert ticket is None and retry_after >= 1
+
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(controller.acquire((40, 1), timeout=5)[0]))
+    waiter.start()
+    wait_for(lambda: controller.stats()['waiting'] == 1)
+    # The queue is full, so this one is shed straight away
+    assert controller.acquire((1, 1), timeout=5) == (None, controller.retry_after())
+    controller.release(big)
+    waiter.join(5)
+    assert admitted[0] is not None
+    controller.release(admitted[0])
+
+    # A request bigger than a whole budget is clamped so it can still run alone
+    ticket, _ = controller.acquire(estimate_cost(20, 120), timeout=0)
+    assert ticket is not None and controller.stats()['scratch_bytes_reserved'] == 100
+    controller.release(ticket)
+    stats = controller.stats()
+    assert (stats['admitted'], stats['shed'], stats['running']) == (3, 2, 0)
+
+def test_default_cpu_budget_admits_max_pipelines_of_wide_requests(monkeypatch):
+    monkeypatch.setattr(project, 'available_cores', lambda: 2)
+    # A request is priced at the cuts it can actually run at once
+    assert estimate_cost(20, 10)[1] == 2
+    assert estimate_cost(20, 10, cut_workers=8)[1] == 8
+    controller = project.get_admission_controller()
+    tickets = [controller.acquire(estimate_cost(20, 10), timeout=0)[0] for _ in range(4)]
+    assert all(tickets)
+    # MASHUP_MAX_PIPELINES, not the CPU budget, is what stops the fifth
+    assert controller.acquire(estimate_cost(1, 10), timeout=0)[0] is None
+    for ticket in tickets:
+        controller.release(ticket)
+
+@patch('project.run_pipeline')
+def test_generate_mashup_rate_limits_per_email(mock_pipeline, client, monkeypatch):
+    mock_pipeline.return_value = ({"message": "Mashup generated and emailed successfully!"}, 200)
+    monkeypatch.setitem(app.config, 'MASHUP_RATE_LIMIT', 2)
+    data = {'singer': 'Test Singer', 'number_of_videos': '2', 'duration': '10', 'email': 'Limited@example.com'}
+    assert client.post('/generate_mashup', data=data).status_code == 200
+    assert client.post('/generate_mashup', data=dict(data, email='limited@example.com ')).status_code == 200
+    response = client.post('/generate_mashup', data=data)
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+    assert client.post('/generate_mashup', data=dict(data, email='other@example.com')).status_code == 200
+    assert mock_pipeline.call_count == 3
+
+@patch('project.run_pipeline')
+def test_batch_items_each_count_against_the_rate_limit(mock_pipeline, client, monkeypatch):
+    mock_pipeline.return_value = ({"message": "Mashup generated and emailed successfully!"}, 200)
+    monkeypatch.setitem(app.config, 'MASHUP_RATE_LIMIT', 2)
+    item = {'singer': 'Test Singer', 'number_of_videos': 2, 'duration': 10, 'email': 'limited@example.com'}
+    response = client.post('/batches', json={'items': [item, item, item, dict(item, email='other@example.com')]})
+    assert response.status_code == 202
+    items = response.get_json()['items']
+    assert [entry['status'] != 'rejected' for entry in items] == [True, True, False, True]
+    assert items[2]['retry_after'] > 0
+    # The address's quota is used up by the batch
+    assert client.post('/batches', json={'items': [item]}).status_code == 400
+    status_url = response.get_json()['status_url']
+    assert wait_for(lambda: client.get(status_url).get_json()['status'] == 'done')
+
+def test_full_job_queue_asks_clients_to_back_off(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'MASHUP_JOB_QUEUE_LIMIT', 0)
+    monkeypatch.setitem(app.config, 'MASHUP_BATCH_QUEUE_LIMIT', 0)
+    item = {'singer': 'Test Singer', 'number_of_videos': 2, 'duration': 10, 'email': 'test@example.com'}
+    responses = [client.post('/generate_mashup', data=dict(item, mode='async')),
+                 client.post('/batches', json={'items': [item]})]
+    for response in responses:
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) == response.get_json()['retry_after'] > 0
+
+@patch('project.run_pipeline')
+def test_generate_mashup_sheds_load_when_full(mock_pipeline, client, monkeypatch):
+    mock_pipeline.return_value = ({"message": "Mashup generated and emailed successfully!"}, 200)
+    monkeypatch.setitem(app.config, 'MASHUP_MAX_PIPELINES', 1)
+    monkeypatch.setitem(app.config, 'MASHUP_ADMISSION_WAIT', 0.05)
+    # Shed requests hand their quota back, so retrying on Retry-After can't lock an address out
+    monkeypatch.setitem(app.config, 'MASHUP_RATE_LIMIT', 1)
+    controller = project.get_admission_controller()
+    ticket, _ = controller.acquire((0, 0))
+
+    data = {'singer': 'Test Singer', 'number_of_videos': '2', 'duration': '10', 'email': 'test@example.com'}
+    for _ in range(2):
+        response = client.post('/generate_mashup', data=data)
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == str(response.get_json()['retry_after'])
+        assert "busy" in response.get_json()['error']
+    mock_pipeline.assert_not_called()
+
+    controller.release(ticket)
+    assert client.post('/generate_mashup', data=data).status_code == 200
+    assert 'mashup_admission{stat="shed"} 2' in client.get('/metrics').get_data(as_text=True)
+
+@patch('project.build_mashup')
+@patch('project.send_email')
+def test_batch_shares_work_and_reports_per_item_status(mock_email_func, mock_build, client):
+    builds = []
+    def fake_build(singer, num_videos, dur, work_dir, report=None, shared=None, profile=None):
+        builds.append((singer, num_videos, shared))
+        for rank in range(1, num_videos + 1):
+            with open(os.path.join(work_dir, f'{rank:02d}_song.webm'), 'wb') as f:
+                f.write(b'source')
+        path = os.path.join(work_dir, "merged_audio.mp3")
+        with open(path, 'wb') as f:
+            f.write(b'mashup')
+        return path, None
+    mock_build.side_effect = fake_build
+    mock_email_func.return_value = (True, None)
+
+    items = [
+        {'singer': 'Test Singer', 'number_of_videos': 2, 'duration': 10, 'email': 'a@example.com'},
+        {'singer': 'Test Singer', 'number_of_videos': 2, 'duration': 10, 'email': 'b@example.com'},
+        {'singer': 'Test Singer', 'number_of_videos': 3, 'duration': 10},
+        {'singer': 'Other Singer', 'number_of_videos': 50, 'duration': 10},
+    ]
+    response = client.post('/batches', json={'items': items, 'email': 'c@example.com'})
+    assert response.status_code == 202
+    batch = response.get_json()
+    assert [item['status'] != 'invalid' for item in batch['items']] == [True, True, True, False]
+    assert all(item['job_id'] for item in batch['items'][:3])
+    assert batch['items'][2]['email'] == 'c@example.com'
+    assert batch['status_url'] == f"/batches/{batch['batch_id']}"
+
+    assert wait_for(lambda: client.get(batch['status_url']).get_json()['status'] == 'done')
+    batch = client.get(batch['status_url']).get_json()
+    assert [item['status'] for item in batch['items']] == ['done', 'done', 'done', 'invalid']
+    # The two identical items were built once; every build shared the batch's caches
+    assert sorted(count for _, count, _ in builds) == [2, 3]
+    shared = builds[0][2]
+    assert all(entry[2] is shared for entry in builds)
+    assert mock_email_func.call_count == 3
+    assert not os.path.exists(shared.root)
+
+def test_batch_rejects_bad_submissions(client, monkeypatch):
+    assert client.post('/batches', json={'items': []}).status_code == 400
+    monkeypatch.setitem(app.config, 'MASHUP_BATCH_MAX_ITEMS', 1)
+    item = {'singer': 'Test Singer', 'number_of_videos': 2, 'email': 'a@example.com'}
+    assert client.post('/batches', json={'items': [item, item]}).status_code == 400
+    response = client.post('/batches', json={'items': [dict(item, number_of_videos='many')]})
+    assert response.status_code == 400
+    assert response.get_json()['items'][0]['status'] == 'invalid'
+    assert client.get('/batches/missing').status_code == 404
+
+@patch('project.build_mashup')
+@patch('project.send_email')
+def test_generate_mashup_plans_output_before_building(mock_email_func, mock_build, client, monkeypatch):
+    def fake_build(singer, num_videos, dur, work_dir, report=None, profile=None):
+        path = os.path.join(work_dir, f"merged_audio.{profile.ext}")
+        with open(path, 'wb') as f:
+            f.write(b'mashup')
+        return path, None
+    mock_build.side_effect = fake_build
+    mock_email_func.return_value = (True, None)
+    monkeypatch.setitem(app.config, 'MASHUP_DELIVERY', 'attachment')
+
+    data = {'singer': 'Test Singer', 'number_of_videos': '20', 'duration': '120', 'email': 'test@example.com'}
+    response = client.post('/generate_mashup', data=data)
+    assert response.status_code == 200
+    output = response.get_json()['output']
+    assert (output['name'], output['format'], output['delivery']) == ('opus-64', 'opus', 'attachment')
+    assert mock_build.call_args.kwargs['profile'].name == 'opus-64'
+
+    # Nothing is downloaded for a request that could never be delivered
+    mock_build.reset_mock()
+    monkeypatch.setitem(app.config, 'MASHUP_ATTACHMENT_LIMIT', 1024 * 1024)
+    response = client.post('/generate_mashup', data=dict(data, email='other@example.com'))
+    assert response.status_code == 400
+    mock_build.assert_not_called()
+
+@pytest.fixture
+def job_store(tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'MASHUP_JOB_STORE', str(tmp_path / 'jobs.db'))
+    monkeypatch.setitem(app.config, 'MASHUP_JOB_WORK_DIR', str(tmp_path / 'work'))
+    monkeypatch.setitem(app.config, 'MASHUP_JOB_LEASE', 0.2)
+    monkeypatch.setitem(app.config, 'MASHUP_JOB_POLL', 0.01)
+    return project.get_job_store()
+
+def test_job_store_hands_expired_leases_to_another_worker(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'), lease_seconds=0.05, max_attempts=2)
+    job_id = store.enqueue({'singer': 'Test Singer'})
+    assert store.claim('a')['id'] == job_id
+    assert store.claim('b') is None
+    assert store.heartbeat(job_id, 'a')
+
+    # 'a' stops renewing its lease, so 'b' takes over and 'a' can no longer write
+    time.sleep(0.1)
+    job = store.claim('b')
+    assert (job['id'], job['attempts']) == (job_id, 2)
+    assert not store.heartbeat(job_id, 'a')
+    assert not store.finish(job_id, 'a', {'message': 'late'}, 200)
+
+    # Its last allowed attempt dies too, so the job is failed rather than retried forever
+    time.sleep(0.1)
+    assert store.claim('c') is None
+    assert store.reap() == [job_id]
+    assert store.get(job_id)['status'] == 'failed'
+    assert store.enqueue({}, limit=0) is None
+
+def test_metrics_count_stored_jobs(client, job_store):
+    job_store.enqueue({'singer': 'Test Singer'})
+    job_store.enqueue({'singer': 'Test Singer'})
+    job_store.claim('worker')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'mashup_job_store{stat="queued"} 1' in text
+    assert 'mashup_job_store{stat="running"} 1' in text
+    assert 'mashup_jobs_active 2' in text
+
+class WorkerCrash(BaseException):
+    """Stands in for the worker process dying; nothing in the pipeline catches it."""
+
+@requires_ffmpeg
+@patch('project.send_email')
+def test_stored_job_resumes_from_its_last_checkpoint(mock_email_func, client, job_store, monkeypatch):
+    monkeypatch.setitem(app.config, 'MASHUP_DELIVERY', 'attachment')
+    monkeypatch.setitem(app.config, 'MASHUP_PIPELINE', 'overlap')
+    mock_email_func.return_value = (True, None)
+
+    data = {'singer': 'Test Singer', 'number_of_videos': '2', 'duration': '4', 'email': 'test@example.com',
+            'mode': 'async'}
+    response = client.post('/generate_mashup', data=data)
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+    assert client.get(f'/jobs/{job_id}').get_json()['status'] == 'queued'
+
+    # A worker downloads the tracks in overlap mode, then dies while the encoder is writing the mashup
+    job = job_store.claim('crashed-worker')
+    checkpoint = JobCheckpoint(job_store, job, 'crashed-worker')
+    work_dir = checkpoint.work_dir
+    os.makedirs(work_dir)
+    partial = os.path.join(work_dir, 'merged_audio.mp3')
+    def fake_download(singer, num_videos, download_path, segment=None, on_track=None, **kwargs):
+        for rank in (1, 2):
+            path = os.path.join(download_path, f"{rank:02d}_t{rank}.m4a")
+            make_tone(path, 30, 220 * rank)
+            on_track(rank, path)
+        # Checkpoint with the encoder's output already on disk beside the downloads
+        assert wait_for(lambda: os.path.exists(partial), timeout=10)
+        return 2
+    def crash(self):
+        self.abort()
+        raise WorkerCrash()
+    with patch('project.download_video', side_effect=fake_download), \
+            patch.object(project.StreamingEncoder, 'finish', crash), pytest.raises(WorkerCrash):
+        project.build_mashup('Test Singer', 2, 4, work_dir, checkpoint=checkpoint)
+    assert checkpoint.get('download') == {'tracks': 2, 'files': ['01_t1.m4a', '02_t2.m4a']}
+    assert os.path.exists(partial)
+
+    # Once its lease runs out the next worker carries on from the checkpoint, merging only the downloads
+    time.sleep(0.3)
+    with patch('project.download_video') as mock_dl, \
+            patch('project.mashup_ffmpeg', wraps=project.mashup_ffmpeg) as spy, patch('project.mashup') as mock_moviepy:
+        assert JobWorker(job_store).run_once()
+    mock_dl.assert_not_called()
+    mock_moviepy.assert_not_called()
+    assert [os.path.basename(path) for path, _ in spy.call_args.args[0]] == ['01_t1.m4a', '02_t2.m4a']
+    mock_email_func.assert_called_once()
+    assert not os.path.exists(work_dir)
+
+    events = client.get(f'/jobs/{job_id}/events').get_data(as_text=True)
+    assert 'event: done' in events
+    status = client.get(f'/jobs/{job_id}').get_json()
+    assert status['status'] == 'done'
+    assert "Mashup generated" in status['result']['message']
+    assert job_store.get(job_id)['attempts'] == 2
+
+@requires_ffmpeg
+@patch('project.send_email')
+def test_worker_that_lost_its_lease_stops_without_touching_the_new_owners_files(mock_email_func, job_store,
+                                                                               monkeypatch):
+    monkeypatch.setitem(app.config, 'MASHUP_DELIVERY', 'attachment')
+    monkeypatch.setitem(app.config, 'MASHUP_PIPELINE', 'staged')
+    mock_email_func.return_value = (True, None)
+    job_id = job_store.enqueue({'singer': 'Test Singer', 'num_videos': 2, 'dur': 4, 'email': 'test@example.com'})
+
+    # Worker A downloads the tracks, then stalls (no heartbeats) until B has taken the job over
+    checkpoint_a = JobCheckpoint(job_store, job_store.claim('a'), 'a')
+    downloaded, b_merging = threading.Event(), threading.Event()
+    def stalled_report(stage):
+        if stage == 'merge':
+            downloaded.set()
+            b_merging.wait(timeout=10)
+        checkpoint_a.report(stage)
+    def fake_download(singer, num_videos, download_path, segment=None, **kwargs):
+        for rank in (1, 2):
+            make_tone(os.path.join(download_path, f"{rank:02d}_t{rank}.m4a"), 30, 220 * rank)
+        return 2
+    results = {}
+    def run_a():
+        with app.app_context():
+            results['a'] = project.run_pipeline('Test Singer', 2, 4, 'test@example.com', progress=stalled_report,
+                                                checkpoint=checkpoint_a)
+    thread_a = threading.Thread(target=run_a)
+
+    # B resumes from A's checkpoint, and only merges once A has given up and cleaned up after itself
+    def merge_after_a(*args, **kwargs):
+        b_merging.set()
+        thread_a.join()
+        return real_mashup_ffmpeg(*args, **kwargs)
+    real_mashup_ffmpeg = project.mashup_ffmpeg
+    with patch('project.download_video', side_effect=fake_download) as mock_dl, \
+            patch('project.mashup_ffmpeg', side_effect=merge_after_a) as spy:
+        thread_a.start()
+        assert downloaded.wait(timeout=10)
+        time.sleep(0.3)
+        assert JobWorker(job_store).run_once('b')
+    thread_a.join()
+
+    payload, status_code = results['a']
+    assert status_code == 500 and 'no longer leased' in payload['error']
+    assert mock_dl.call_count == 1
+    assert [os.path.basename(path) for path, _ in spy.call_args.args[0]] == ['01_t1.m4a', '02_t2.m4a']
+    mock_email_func.assert_called_once()
+    job = job_store.get(job_id)
+    assert (job['status'], job['worker']) == ('done', 'b')
+    assert not os.path.exists(project.job_work_dir(job_id))
+
+@patch('project.run_pipeline')
+def test_generate_mashup_only_enqueues_with_a_job_store(mock_pipeline, client, job_store, monkeypatch):
+    mock_pipeline.return_value = ({"message": "Mashup generated and emailed successfully!"}, 200)
+    monkeypatch.setitem(app.config, 'MASHUP_ADMISSION_WAIT', 0.05)
+    data = {'singer': 'Test Singer', 'number_of_videos': '2', 'duration': '10', 'email': 'test@example.com'}
+
+    # With no worker running nothing claims the job, so it's withdrawn and the request shed
+    response = client.post('/generate_mashup', data=data)
+    assert response.status_code == 429
+    mock_pipeline.assert_not_called()
+
+    worker = JobWorker(job_store, threads=2)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    try:
+        response = client.post('/generate_mashup', data=dict(data, email='other@example.com'))
+        assert response.status_code == 200
+        assert "Mashup generated" in response.get_json()['message']
+        assert 'checkpoint' in mock_pipeline.call_args.kwargs
+
+        item = {'singer': 'Test Singer', 'number_of_videos': 2, 'duration': 10, 'email': 'b@example.com'}
+        batch = client.post('/batches', json={'items': [item, item]}).get_json()
+        assert wait_for(lambda: client.get(batch['status_url']).get_json()['status'] == 'done')
+        assert [entry['status'] for entry in client.get(batch['status_url']).get_json()['items']] == ['done', 'done']
+    finally:
+        worker.stop()
+        thread.join()
+
+def test_worker_processes_stop_together_on_sigterm(tmp_path):
+    env = dict(os.environ, MASHUP_JOB_STORE=str(tmp_path / 'jobs.db'), MASHUP_JOB_POLL='0.05', PYTHONUNBUFFERED='1')
+    parent = subprocess.Popen([sys.executable, 'project.py', 'worker', '--processes', '2', '--threads', '1'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        pids = []
+        while len(pids) < 2:
+            line = parent.stdout.readline()
+            assert line, "worker exited before starting"
+            # Both workers share the pipe, so their lines can land on one
+            pids += [int(pid) for pid in re.findall(r'Worker [^:]+:(\d+) running', line)]
+        # Only the parent is signalled, as a service manager would
+        parent.send_signal(signal.SIGTERM)
+        assert parent.wait(timeout=10) == 0
+        # The parent joined its workers, so none are left running
+        for pid in pids:
+            with pytest.raises(ProcessLookupError):
+                os.kill(pid, 0)
+    finally:
+        if parent.poll() is None:
+            parent.kill()